@@ -0,0 +1,4 @@
+"""
+Benchmarks for the deployers, run against a stand in for pymssql which
+simulates the latency of a round trip to the server.
+"""
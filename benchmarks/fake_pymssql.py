@@ -0,0 +1,132 @@
+"""
+A stand in for the pymssql module, which answers every statement after a
+configurable delay and counts the round trips made.
+
+Only the parts of pymssql the deployers use are here.
+"""
+from contextlib import contextmanager
+import sys
+import threading
+import time
+
+
+class Error(Exception):
+    """Base class for errors, as in pymssql."""
+    pass
+
+class OperationalError(Error):
+    """Raised by fetchall when a statement returned no rows, as in pymssql."""
+    pass
+
+
+# a recent enough server for CREATE OR ALTER
+SERVER_PROPERTIES = [('15.0.2000.5', 3)]
+
+
+class Server(object):
+    """
+    The simulated server, shared by every connection made through connect.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.round_trips = 0
+        self.statements = 0
+        self._lock = threading.Lock()
+
+    def execute(self, sql):
+        """
+        Waits for the simulated round trip, and returns the rows the sql
+        would give, or None if it gives none.
+        """
+        with self._lock:
+            self.round_trips += 1
+            self.statements += max(1, sql.count(';'))
+        if self.latency:
+            time.sleep(self.latency)
+
+        if sql == 'SELECT 1':
+            return [(1,)]
+        if 'SERVERPROPERTY' in sql:
+            return list(SERVER_PROPERTIES)
+        if sql.lstrip().upper().startswith('SELECT'):
+            return []
+        return None
+
+    def reset(self):
+        """Zeroes the counts."""
+        with self._lock:
+            self.round_trips = 0
+            self.statements = 0
+
+
+server = Server()
+
+
+class Cursor(object):
+    """A cursor on the simulated server."""
+    def __init__(self):
+        self._rows = None
+
+    def execute(self, sql):
+        """Runs sql on the simulated server."""
+        self._rows = server.execute(sql)
+
+    def fetchall(self):
+        """Returns the rows of the last statement."""
+        if self._rows is None:
+            raise OperationalError('Statement not executed or executed '
+                                   'statement has no resultset')
+        return self._rows
+
+
+class Connection(object):
+    """A connection to the simulated server."""
+    def __init__(self):
+        self.closed = False
+
+    def autocommit(self, status):
+        """Autocommit is the only mode the fake has."""
+        pass
+
+    def cursor(self):
+        """Returns a new cursor."""
+        return Cursor()
+
+    def close(self):
+        """Closes the connection."""
+        self.closed = True
+
+
+def connect(*args, **kwargs): # pylint: disable=unused-argument
+    """Returns a connection to the simulated server."""
+    if server.latency:
+        time.sleep(server.latency)
+    return Connection()
+
+
+@contextmanager
+def installed(latency=0.0):
+    """
+    Swaps this module in for pymssql, in sys.modules and in any deployable_sql
+    modules which have already imported it, and yields the simulated server.
+    """
+    this = sys.modules[__name__]
+    server.latency = latency
+    server.reset()
+
+    previous = sys.modules.get('pymssql')
+    sys.modules['pymssql'] = this
+    patched = []
+    for name, module in list(sys.modules.items()):
+        if name.startswith('deployable_sql') and hasattr(module, 'pymssql'):
+            patched.append((module, module.pymssql))
+            module.pymssql = this
+    try:
+        yield server
+    finally:
+        for module, original in patched:
+            module.pymssql = original
+        if previous is None:
+            del sys.modules['pymssql']
+        else:
+            sys.modules['pymssql'] = previous
@@ -0,0 +1,310 @@
+"""run.py
+
+Benchmarks the deployers against synthetic projects, with a stand in for
+pymssql which adds a fixed latency to every round trip.
+
+Results are appended to a results file with the commit they were measured
+at, and compared against the last results from a different commit.
+
+Run it from the root of the repository with python -m benchmarks.run.
+
+Usage:
+    run.py [options]
+
+Options:
+    -h, --help              Show this screen.
+    --sizes=<sizes>         Comma separated numbers of objects to generate.
+                            [default: 10,1000,10000]
+    --latency=<ms>          Simulated latency of each round trip. [default: 1]
+    --batch=<n>             Benchmark batched deploys of up to n objects.
+    --results=<path>        Where to keep results.
+                            [default: benchmarks/results.jsonl]
+    --no-save               Print the results without saving them.
+"""
+from __future__ import print_function
+from collections import OrderedDict
+from datetime import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+from docopt import docopt
+
+from . import fake_pymssql
+
+try:
+    import pymssql # pylint: disable=unused-import
+except ImportError:
+    # the benchmarks never talk to a real server
+    sys.modules['pymssql'] = fake_pymssql
+
+try:
+    import tracemalloc
+except ImportError: # pragma: no cover
+    tracemalloc = None
+
+from deployable_sql.deployers.pymssql_deployer import (PyMSSQLDeployer, load_job,
+                                                     read_job)
+from deployable_sql.engine import DEPLOY_FOLDERS
+from deployable_sql.exc import GitError
+from deployable_sql.folders import create_job, run_setup
+from deployable_sql.gitdiff import git
+
+
+# how many objects the sync_file benchmark deploys one at a time
+SYNC_FILE_COUNT = 100
+
+VIEW_SQL = "SELECT %(i)d AS id, name FROM sys.objects ORDER BY name"
+FUNCTION_SQL = """CREATE FUNCTION dbo.f_%(i)05d (@x int)
+RETURNS int
+AS
+BEGIN
+    RETURN @x + %(i)d
+END"""
+PROCEDURE_SQL = """CREATE PROCEDURE dbo.p_%(i)05d
+AS
+SELECT %(i)d AS id;"""
+
+
+def generate_project(size):
+    """
+    Creates a project of size objects in the current directory, spread evenly
+    over views, functions, stored procedures and jobs.
+    """
+    run_setup('bench', 'bench', gitinit=False)
+    templates = [
+        ('views', 'v_%05d.sql', VIEW_SQL),
+        ('functions', 'f_%05d.sql', FUNCTION_SQL),
+        ('stored_procedures', 'p_%05d.sql', PROCEDURE_SQL),
+    ]
+    for i in range(size):
+        if i % 4 == 3:
+            create_job('j_%05d' % i)
+            continue
+        folder, filename, sql = templates[i % 4]
+        with open(os.path.join(folder, filename % i), 'w') as stream:
+            stream.write(sql % {'i': i})
+
+
+def _deployer(batch_size, force=False):
+    """Returns a deployer for the simulated server."""
+    return PyMSSQLDeployer('bench', 'bench', 'bench', 'bench',
+                           batch_size=batch_size, force=force)
+
+def _paths(folder):
+    """Returns the files in a folder of the project."""
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder))]
+
+
+def bench_sync_folder(batch_size):
+    """
+    A first deploy of every folder.
+    """
+    d = _deployer(batch_size)
+    def run():
+        for folder in DEPLOY_FOLDERS:
+            d.sync_folder(folder)
+        d.close()
+        return d.deployed
+    return run
+
+def bench_sync_unchanged(batch_size):
+    """
+    A deploy of every folder when nothing has changed since the last one.
+    """
+    d = _deployer(batch_size)
+    for folder in DEPLOY_FOLDERS:
+        d.sync_folder(folder)
+    d.flush()
+    def run():
+        for folder in DEPLOY_FOLDERS:
+            d.sync_folder(folder)
+        d.close()
+        return d.skipped
+    return run
+
+def bench_sync_file(batch_size):
+    """
+    Deploys of single objects, looked up by name.
+    """
+    names = [os.path.splitext(f)[0] for folder in DEPLOY_FOLDERS
+             for f in sorted(os.listdir(folder))][:SYNC_FILE_COUNT]
+    d = _deployer(batch_size, force=True)
+    def run():
+        for name in names:
+            d.sync_file(name)
+        d.close()
+        return len(names)
+    return run
+
+def bench_read_job(batch_size): # pylint: disable=unused-argument
+    """
+    Loading and compiling every job, without touching the server.
+    """
+    paths = _paths('jobs')
+    def run():
+        for path in paths:
+            read_job(load_job(path))
+        return len(paths)
+    return run
+
+BENCHMARKS = OrderedDict([
+    ('sync_folder', bench_sync_folder),
+    ('sync_unchanged', bench_sync_unchanged),
+    ('sync_file', bench_sync_file),
+    ('read_job', bench_read_job),
+])
+
+
+def measure(bench, latency, batch_size):
+    """
+    Runs a benchmark, returning its wall time, round trips and the number of
+    objects handled, then runs it again without latency to find its peak
+    memory use.
+    """
+    with fake_pymssql.installed(latency) as server:
+        run = bench(batch_size)
+        server.reset()
+        gc.collect()
+        start = default_timer()
+        count = run()
+        seconds = default_timer() - start
+        round_trips = server.round_trips
+
+    peak_kb = None
+    if tracemalloc is not None:
+        with fake_pymssql.installed(0):
+            run = bench(batch_size)
+            gc.collect()
+            tracemalloc.start()
+            try:
+                run()
+                peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+            finally:
+                tracemalloc.stop()
+
+    return OrderedDict([
+        ('count', count),
+        ('seconds', round(seconds, 4)),
+        ('per_object_ms', round(1000.0 * seconds / count, 4) if count else None),
+        ('round_trips', round_trips),
+        ('peak_kb', peak_kb),
+    ])
+
+def run_size(size, latency, batch_size):
+    """
+    Runs every benchmark against a generated project of size objects, in a
+    temporary directory, and returns a result for each.
+    """
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp(prefix='deploy_sql_bench_')
+    results = []
+    try:
+        os.chdir(tmp)
+        generate_project(size)
+        for name, bench in BENCHMARKS.items():
+            result = OrderedDict([('bench', name), ('size', size)])
+            result.update(measure(bench, latency, batch_size))
+            results.append(result)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+    return results
+
+
+def current_commit():
+    """
+    Returns the short hash of the checked out commit, marked if the working
+    tree has changes, or None outside of git.
+    """
+    try:
+        commit = git('rev-parse', '--short', 'HEAD').decode('utf-8').strip()
+        if git('status', '--porcelain', '--untracked-files=no').strip():
+            commit += '-dirty'
+        return commit
+    except GitError:
+        return None
+
+def _key(result):
+    """The settings which make two results comparable."""
+    return (result['bench'], result['size'], result['latency_ms'], result['batch'])
+
+def load_results(path):
+    """
+    Returns every result saved at path.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path) as stream:
+        return [json.loads(line) for line in stream if line.strip()]
+
+def save_results(results, path):
+    """
+    Appends results to path, one json object per line.
+    """
+    with open(path, 'a') as stream:
+        for result in results:
+            stream.write(json.dumps(result) + '\n')
+
+def format_results(results, previous):
+    """
+    Returns a table of results, with the change in time from the latest
+    previous result for the same benchmark and settings.
+    """
+    baseline = {}
+    for result in previous:
+        baseline[_key(result)] = result
+
+    lines = ['%-16s %7s %10s %12s %11s %10s  %s' % (
+        'bench', 'size', 'seconds', 'ms/object', 'round trips', 'peak kb', 'change')]
+    for result in results:
+        before = baseline.get(_key(result))
+        change = ''
+        if before and before['seconds']:
+            change = '%+.1f%% vs %s' % (
+                100.0 * (result['seconds'] - before['seconds']) / before['seconds'],
+                before['commit'])
+        lines.append('%-16s %7d %10.3f %12s %11d %10s  %s' % (
+            result['bench'], result['size'], result['seconds'],
+            result['per_object_ms'], result['round_trips'],
+            result['peak_kb'] if result['peak_kb'] is not None else '-', change))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """
+    Parses arguments and runs the benchmarks.
+    """
+    args = docopt(__doc__, argv=argv)
+    sizes = [int(size) for size in args['--sizes'].split(',')]
+    latency_ms = float(args['--latency'])
+    batch_size = int(args['--batch']) if args['--batch'] else None
+    results_path = os.path.abspath(args['--results'])
+
+    commit = current_commit()
+    results = []
+    for size in sizes:
+        for result in run_size(size, latency_ms / 1000.0, batch_size):
+            result.update([
+                ('latency_ms', latency_ms),
+                ('batch', batch_size),
+                ('commit', commit),
+                ('date', datetime.now().isoformat()),
+                ('python', platform.python_version()),
+            ])
+            results.append(result)
+
+    previous = [r for r in load_results(results_path) if r['commit'] != commit]
+    print(format_results(results, previous))
+    if not args['--no-save']:
+        save_results(results, results_path)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,10 @@ Usage:
     deploy_sql.py setup <usr> <db>
     deploy_sql.py [options]
     deploy_sql.py <usr> <pwd> <host> <db> [options]
+    deploy_sql.py fleet <targets> [options]
+    deploy_sql.py compile (--out=<path> | --check=<path>) [options]
+    deploy_sql.py bundle --out=<path> [options]
+    deploy_sql.py rollback <deploy_id> [options]
     deploy_sql.py create_job <jobname> [--recurrence=(daily|weekly)]
 
 Options:
@@ -15,20 +19,85 @@ Options:
     -f, --filename=<filename>       A single file to sync.
     --schema=<schema>               Specify a non-standard schema. [default: dbo]
     --test                          Test the connection.
+    --force                         Deploy objects even if they are unchanged.
+    --since=<ref>                   Deploy the files changed since a git ref,
+                                    and drop the objects of deleted files.
+    --range=<range>                 Like --since, for the changes in a range
+                                    of commits such as a..b.
+    --watch                         Keep a connection open and deploy files as
+                                    they are saved.
+    --poll                          Watch by polling rather than inotify.
+    --plan                          Show what a deploy would change, comparing
+                                    against the server without running DDL.
+    --changed-only                  Deploy only what the plan says differs
+                                    from the server.
+    --no-snapshot                   Do not snapshot the objects a deploy is
+                                    about to change, for rolling it back.
+    --validate                      Refresh the modules which depend on what
+                                    was deployed, and report invalid ones.
+    --create-or-alter=<folders>     Alter modules in place instead of dropping
+                                    them, for "all" or a comma separated list
+                                    of views, functions and stored_procedures.
+    --allow-size-of-data            Allow table changes which read or rewrite
+                                    every row, such as changing a column type.
+    --allow-drop                    Allow table changes which lose data, such
+                                    as dropping a column.
+    --rebuild=<rows>                Rebuild tables needing changes which
+                                    cannot be made online into a copy, this
+                                    many rows at a time, then swap it in.
+    --rebuild-throttle=<seconds>    How long to wait between the chunks of a
+                                    rebuild. [default: 0]
+    --batch=<n>                     Send each object in a single round trip,
+                                    packing up to n objects into each batch.
+    --pipeline=<chars>              Send consecutive batches of GO separated
+                                    files which add up to no more than this
+                                    many characters in one round trip.
+    --lock-timeout=<ms>             Deploy with low impact on a busy server,
+                                    giving up on locks after this long and
+                                    losing any deadlocks, then retrying.
+    --lock-retries=<n>              How many times to retry a statement which
+                                    hit a lock timeout or deadlock. [default: 5]
+    -j <n>, --workers=<n>           Deploy independent objects in parallel,
+                                    each worker with its own connection.
+                                    [default: 1]
+    --concurrency=<n>               How many fleet targets to deploy to at
+                                    once. [default: 8]
+    --per-host=<n>                  How many fleet targets on the same host to
+                                    deploy to at once. [default: 2]
+    --report=<path>                 Write per object, per phase timings of the
+                                    deploy as json.
+    --prometheus=<path>             Write deploy metrics for the Prometheus
+                                    node exporter's textfile collector.
+    --out=<path>                    Compile a GO separated release script,
+                                    or build a bundle, without connecting to
+                                    a server.
+    --check=<path>                  Check a compiled release script against
+                                    the files in the repo.
+    --db=<db>                       The database a compiled script switches to.
+    --bundle=<path>                 Deploy from a bundle built by
+                                    deploy_sql.py bundle, without reading the
+                                    project.
     --all                           Rebuild everything.
     --functions                     Rebuild the functions folder.
     --jobs                          Rebuild the jobs folder.
+    --permissions                   Sync the permissions folder.
+    --scripts                       Run the changed scripts in the scripts
+                                    folder.
     --sps                           Rebuild stored procedures.
+    --tables                        Create or alter the tables folder.
     --views                         Rebuild only views.
 """
 import os
+import sys
 import logging
-import logging.config
 
 from docopt import docopt
-import yaml
 
-from deployable_sql import PyMSSQLDeployer, run_setup, create_job
+# modules which need pymssql or yaml are imported by the commands which use
+# them, so that setup and create_job start quickly
+from deployable_sql import run_setup, create_job
+from deployable_sql.engine import DeployEngine, DEPLOY_FOLDERS, list_folders
+from deployable_sql.gitdiff import git_changes
 
 
 LOGGERS = {
@@ -68,6 +137,8 @@ def get_credentials(args):
 
     The order of precence is same as above.
     """
+    import yaml
+
     config_path = os.path.expanduser('~/.deploy_sql.yml')
     if os.path.exists(config_path):
         with open(config_path, 'rb') as stream:
@@ -85,6 +156,202 @@ def get_credentials(args):
     return usr, pwd, host, db, schema
 
 
+def make_deployer(usr, pwd, host, db, schema, args, pool=None):
+    """
+    Returns a deployer for a target, configured by the arguments.
+    """
+    from deployable_sql import PyMSSQLDeployer
+    from deployable_sql.tables import DESTRUCTIVE, SIZE_OF_DATA
+
+    batch_size = int(args['--batch']) if args['--batch'] else None
+    create_or_alter = args['--create-or-alter']
+    if create_or_alter:
+        create_or_alter = create_or_alter == 'all' or create_or_alter.split(',')
+    allow = [impact for option, impact in (('--allow-size-of-data', SIZE_OF_DATA),
+                                           ('--allow-drop', DESTRUCTIVE))
+             if args[option]]
+    return PyMSSQLDeployer(
+        usr, pwd, host, db, schema=schema, force=args['--force'],
+        batch_size=batch_size, pool=pool,
+        # the deployer keeps its own connection while each worker takes one
+        pool_size=int(args['--workers']) + 1,
+        create_or_alter=create_or_alter, allow=allow,
+        rebuild_chunk_size=int(args['--rebuild']) if args['--rebuild'] else None,
+        rebuild_throttle=float(args['--rebuild-throttle']),
+        pipeline_size=int(args['--pipeline']) if args['--pipeline'] else None,
+        lock_timeout=int(args['--lock-timeout']) if args['--lock-timeout'] else None,
+        lock_retries=int(args['--lock-retries'])
+    )
+
+
+def write_reports(d, args, fleet=False):
+    """
+    Writes the timing report and metrics for a deploy, if asked to. Fleet
+    deploys write a file per target, named after its host and db.
+    """
+    d.report.finish()
+    for option, write in (('--report', d.report.write_json),
+                          ('--prometheus', d.report.write_prometheus)):
+        path = args[option]
+        if path:
+            if fleet:
+                base, ext = os.path.splitext(path)
+                path = '%s.%s_%s%s' % (base, d.host, d.db, ext)
+            write(path)
+
+
+def selected_folders(args, default=None):
+    """
+    Returns the folders the arguments ask for, or default.
+    """
+    if args['--all']:
+        return DEPLOY_FOLDERS
+    elif args['--functions']:
+        return ['functions']
+    elif args['--jobs']:
+        return ['jobs']
+    elif args['--permissions']:
+        return ['permissions']
+    elif args['--scripts']:
+        return ['scripts']
+    elif args['--sps']:
+        return ['stored_procedures']
+    elif args['--tables']:
+        return ['tables']
+    elif args['--views']:
+        return ['views']
+    return default
+
+
+def compile_release(args):
+    """
+    Compiles a release script, or checks one against the repo, without
+    connecting to a server.
+    """
+    from deployable_sql.script import check_script, compile_script
+
+    d = make_deployer(None, None, None, args['--db'], args['--schema'], args)
+    folders = selected_folders(args, DEPLOY_FOLDERS)
+    paths = list_folders([os.path.join('.', f) for f in folders], d.index)
+
+    if args['--out']:
+        count = compile_script(d, paths, args['--out'], db=args['--db'])
+        print('Compiled %d objects to %s' % (count, args['--out']))
+        return
+
+    check = check_script(d, args['--check'], paths)
+    for label, files in zip(['Changed', 'Missing', 'Not compiled'], check):
+        for path in files:
+            print('%s: %s' % (label, path))
+    if any(check):
+        sys.exit('%s does not match the repo.' % args['--check'])
+    print('%s matches the repo.' % args['--check'])
+
+
+def build_release_bundle(args):
+    """
+    Builds a release bundle of the project, without connecting to a server.
+    """
+    from deployable_sql.bundle import build_bundle
+
+    d = make_deployer(None, None, None, args['--db'], args['--schema'], args)
+    folders = selected_folders(args, DEPLOY_FOLDERS)
+    paths = list_folders([os.path.join('.', f) for f in folders], d.index)
+    bundle_id = build_bundle(d, paths, args['--out'])
+    print('Bundled %d objects to %s, id %s' % (len(paths), args['--out'], bundle_id))
+
+
+def take_snapshot(d, args, paths, deleted=(), sources=None, digests=None):
+    """
+    Snapshots the objects a deploy is about to change, unless asked not to,
+    and says how to roll it back.
+    """
+    if args['--no-snapshot']:
+        return
+    from deployable_sql.snapshot import take_snapshot as snapshot
+
+    deploy_id = snapshot(d, paths, deleted, sources=sources, digests=digests).deploy_id
+    print('To roll back this deploy, run: deploy_sql.py rollback %s' % deploy_id)
+
+
+def deploy(d, args, workers=1, fleet=False):
+    """
+    Runs whatever the arguments ask for with a deployer, and returns the
+    engine used, which knows whether anything failed.
+    """
+    from deployable_sql.plan import build_plan, changed_paths, format_plan
+    from deployable_sql.validate import deployed_names, format_validation, validate
+    from deployable_sql.watch import watch
+
+    folders = selected_folders(args)
+    if folders is None and (args['--plan'] or args['--changed-only']):
+        folders = DEPLOY_FOLDERS
+
+    engine = DeployEngine(d, workers=workers)
+
+    if args['--test']:
+        d.test()
+    elif args['--filename']:
+        found = d._detect_path(args['--filename'])
+        if found:
+            take_snapshot(d, args, [found[1]])
+            d.sync_file(found[1])
+    elif args['--watch']:
+        watch(d, [os.path.join('.', f) for f in DEPLOY_FOLDERS], poll=args['--poll'],
+              before=lambda paths: take_snapshot(d, args, paths))
+    elif args['--bundle']:
+        from deployable_sql.bundle import load_bundle
+
+        bundle = load_bundle(args['--bundle'], d)
+        # the units read their sql from the bundle as they are deployed
+        try:
+            units = bundle.units(folders)
+            d.permission_files = dict((unit.path, unit.definition)
+                                      for unit in bundle.units(['permissions'])
+                                      if unit.definition is not None)
+            print('Deploying bundle %s' % bundle.id)
+            # the files are not on disk, so jobs are named from the bundle
+            take_snapshot(d, args, [unit.path for unit in units],
+                          sources=dict((unit.path, unit.source) for unit in units
+                                       if unit.object_type == 'jobs'),
+                          digests=dict((unit.path, unit.digest) for unit in units))
+            engine.run([unit.path for unit in units],
+                       dict((unit.path, unit) for unit in units))
+        finally:
+            bundle.close()
+    elif args['--since'] or args['--range']:
+        changes = git_changes(since=args['--since'], rev_range=args['--range'])
+        take_snapshot(d, args, changes.deploy, changes.delete)
+        engine.run(changes.deploy)
+        d.flush()
+        for path, source in changes.delete:
+            d.drop_file(path, source)
+    elif folders:
+        paths = list_folders([os.path.join('.', f) for f in folders], d.index)
+        if args['--plan']:
+            print(format_plan(build_plan(d, paths)))
+        elif args['--changed-only']:
+            # the plan has already compared against the server
+            d.force = True
+            paths = changed_paths(build_plan(d, paths))
+            take_snapshot(d, args, paths)
+            engine.run(paths)
+        else:
+            take_snapshot(d, args, paths)
+            engine.run(paths)
+
+    if args['--validate'] and engine.deployed:
+        d.flush()
+        validation = validate(d, deployed_names(d, engine.deployed), workers=workers)
+        engine.invalid = validation.invalid
+        print(format_validation(validation))
+
+    d.close()
+    d.save_manifest()
+    write_reports(d, args, fleet=fleet)
+    return engine
+
+
 def main():
     """
     Parses arguments and does the doing.
@@ -98,38 +365,52 @@ def main():
         create_job(args['<jobname>'], recurrence=args['--recurrence'])
         return None
 
+    import logging.config
     logging.config.dictConfig(LOGGERS)
 
-    usr, pwd, host, db, schema = get_credentials(args)
+    if args['compile']:
+        compile_release(args)
+        return None
+    elif args['bundle']:
+        build_release_bundle(args)
+        return None
+    elif args['fleet']:
+        from deployable_sql.fleet import FleetRunner, format_report, load_targets
 
-    d = PyMSSQLDeployer(
-        usr, pwd, host, db, schema=schema
-    )
+        # one connection per target, the per host cap limits the rest
+        runner = FleetRunner(
+            load_targets(args['<targets>']),
+            lambda usr, pwd, host, db, schema, pool: make_deployer(
+                usr, pwd, host, db, schema, args, pool=pool),
+            lambda d: deploy(d, args, fleet=True).ok,
+            concurrency=args['--concurrency'], per_host=args['--per-host'])
+        results = runner.run()
+        print(format_report(results))
+        if not all(result.ok for result in results):
+            sys.exit('Deploys to some targets failed.')
+        print('Done!')
+        return None
 
-    views = os.path.join('.', 'views')
-    tables = os.path.join('.', 'tables')
-    functions = os.path.join('.', 'functions')
-    stored_procedures = os.path.join('.', 'stored_procedures')
-    jobs = os.path.join('.', 'jobs')
+    usr, pwd, host, db, schema = get_credentials(args)
+    d = make_deployer(usr, pwd, host, db, schema, args)
+    if args['rollback']:
+        from deployable_sql.snapshot import rollback
 
-    if args['--test']:
-        d.test()
-    elif args['--all']:
-        d.sync_folder(views)
-        d.sync_folder(jobs)
-        d.sync_folder(functions)
-        d.sync_folder(stored_procedures)
-    elif args['--filename']:
-        d.sync_file(args['--filename'])
-    elif args['--functions']:
-        d.sync_folder(functions)
-    elif args['--jobs']:
-        d.sync_folder(jobs)
-    elif args['--sps']:
-        d.sync_folder(stored_procedures)
-    elif args['--views']:
-        d.sync_folder(views)
+        restored = rollback(d, args['<deploy_id>'])
+        d.close()
+        d.save_manifest()
+        print('Restored %d objects from before deploy %s.' % (
+            restored, args['<deploy_id>']))
+        return None
+    engine = deploy(d, args, workers=int(args['--workers']))
 
+    if not args['--plan']:
+        # a plan deploys nothing, so has nothing to sum up
+        print(d.summary())
+    if not engine.ok:
+        sys.exit('%d objects failed, %d were blocked by a failed dependency, '
+                 '%d dependents are invalid.' % (
+                     len(engine.failed), len(engine.blocked), len(engine.invalid)))
     print('Done!')
 
 
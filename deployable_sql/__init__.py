@@ -1,2 +1,24 @@
-from deployable_sql.deployers import *
+"""
+Keeps SQL views, tables, functions, stored procedures and jobs under source
+control, and deploys them.
+
+The deployers need pymssql, so they are only imported when first used, and
+commands which never connect to a server start without loading it.
+"""
+import sys
+
 from deployable_sql.folders import *
+from deployable_sql.lazy import lazy_exports
+
+
+# names exported from modules which are slow to import, and where they live
+LAZY_EXPORTS = {
+    'BaseDeployer': 'deployable_sql.deployers.base_deployer',
+    'PyMSSQLDeployer': 'deployable_sql.deployers.pymssql_deployer',
+}
+
+__getattr__ = lazy_exports(__name__, LAZY_EXPORTS)
+
+if sys.version_info < (3, 7): # pragma: no cover
+    # modules cannot define __getattr__, so import everything up front
+    from deployable_sql.deployers import *
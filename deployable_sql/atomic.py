@@ -0,0 +1,27 @@
+"""
+Writes files by renaming a temporary file over them, so that readers never
+see a partial file, and a failed write leaves the old one in place.
+"""
+from contextlib import contextmanager
+import os
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Opens a temporary file next to path for writing, and moves it over path
+    once the block is done. If the block raises, the temporary file is
+    removed instead.
+    """
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, mode) as stream:
+            yield stream
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # os.rename will not replace a file on windows
+    if os.name == 'nt' and os.path.exists(path): # pragma: no cover
+        os.remove(path)
+    os.rename(tmp_path, path)
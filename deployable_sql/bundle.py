@@ -0,0 +1,212 @@
+"""
+Release bundles, built once by CI and deployed to many targets without the
+project. A bundle holds each object's generated sql, content hash and
+dependencies, in dependency order, so deploying from it reads no files and
+parses no sql or yaml up front.
+
+The file is an index followed by the blobs it points to. Each blob is
+compressed on its own and stored once, under the hash of its content, so
+the file can be memory mapped and each object's sql read from it directly.
+Units loaded from a bundle only hold the keys of their blobs, and each blob
+is decompressed when the deployer reads it.
+
+    magic, 8 bytes
+    length of the index, 4 bytes big endian
+    the index, zlib compressed json
+    the blobs, each zlib compressed
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from datetime import datetime
+
+from .atomic import atomic_write
+from .engine import DEPLOY_FOLDERS, topological_order
+from .exc import DeployableSQLError
+from .permissions import is_permissions_file
+from .units import DeployUnit, read_units
+
+
+MAGIC = b'DSQLBND1'
+LENGTH = struct.Struct('>I')
+
+# the fields of a unit which are stored as blobs
+BLOB_FIELDS = ['source', 'drop_sql', 'create_sql', 'definition']
+
+
+def _relpath(path):
+    """Returns path relative to the project, with forward slashes."""
+    return os.path.relpath(path).replace(os.path.sep, '/')
+
+
+def build_bundle(deployer, paths, out):
+    """
+    Reads and renders paths, and writes them to a bundle at out, in
+    dependency order. Returns the id of the bundle, the hash of its index,
+    which only changes when what it would deploy does.
+    """
+    # imported here, so that loading a bundle does not need it
+    import yaml
+
+    units = read_units(deployer, paths, render=True)
+    names = dict((unit.path, _relpath(unit.path)) for unit in units)
+    graph = dict((names[unit.path], set(names[p] for p in unit.dependencies))
+                 for unit in units)
+    folder_order = dict((folder, i) for i, folder in enumerate(DEPLOY_FOLDERS))
+    units.sort(key=lambda unit: folder_order.get(unit.object_type, len(DEPLOY_FOLDERS)))
+    order = topological_order([names[unit.path] for unit in units], graph)
+    by_path = dict((names[unit.path], unit) for unit in units)
+
+    blobs = []
+    offsets = {}
+    size = 0
+    objects = []
+    for path in order:
+        unit = by_path[path]
+        entry = {
+            'path': path,
+            'folder': unit.folder,
+            'object_type': unit.object_type,
+            'name': unit.name,
+            'digest': unit.digest,
+            'dependencies': sorted(graph[path]),
+        }
+        values = unit._asdict()
+        if unit.object_type == 'jobs' or (unit.object_type == 'permissions' and
+                                          is_permissions_file(path)):
+            values['definition'] = json.dumps(yaml.safe_load(unit.source),
+                                              sort_keys=True, default=str)
+        for field in BLOB_FIELDS:
+            value = values[field]
+            if value is None:
+                continue
+            data = value.encode('utf-8')
+            key = hashlib.sha1(data).hexdigest()
+            if key not in offsets:
+                blob = zlib.compress(data)
+                offsets[key] = [size, len(blob)]
+                blobs.append(blob)
+                size += len(blob)
+            entry[field] = key
+        objects.append(entry)
+
+    content = {'schema': deployer.schema, 'objects': objects, 'blobs': offsets}
+    bundle_id = hashlib.sha1(
+        json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+    content.update({
+        'id': bundle_id,
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    })
+    index = zlib.compress(json.dumps(content, sort_keys=True).encode('utf-8'))
+
+    with atomic_write(out, 'wb') as stream:
+        stream.write(MAGIC)
+        stream.write(LENGTH.pack(len(index)))
+        stream.write(index)
+        for blob in blobs:
+            stream.write(blob)
+    return bundle_id
+
+
+def _blob(field):
+    """
+    Returns a property which reads a field of a BundleUnit from its bundle,
+    by the key the unit holds for it.
+    """
+    index = DeployUnit._fields.index(field)
+
+    def read(self):
+        key = tuple.__getitem__(self, index)
+        if key is None:
+            return None
+        value = self.bundle.read(key)
+        return json.loads(value) if field == 'definition' else value
+    read.__doc__ = 'The %s of the unit, read from the bundle.' % field
+    return property(read)
+
+
+class BundleUnit(DeployUnit):
+    """
+    A DeployUnit of a bundle, which holds the keys of its blobs in place of
+    their text, so that units waiting to be deployed hold no sql. The bundle
+    must be open while the unit is used.
+    """
+    def __new__(cls, bundle, *values):
+        unit = super(BundleUnit, cls).__new__(cls, *values)
+        unit.bundle = bundle
+        return unit
+
+    source = _blob('source')
+    drop_sql = _blob('drop_sql')
+    create_sql = _blob('create_sql')
+    definition = _blob('definition')
+
+
+class Bundle(object):
+    """
+    A bundle, memory mapped, with its index read.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as stream:
+            self._map = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        header = len(MAGIC) + LENGTH.size
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise DeployableSQLError('Not a deployable_sql bundle: %s' % path)
+        length = LENGTH.unpack(self._map[len(MAGIC):header])[0]
+        self.index = json.loads(zlib.decompress(
+            self._map[header:header + length]).decode('utf-8'))
+        self._data = header + length
+
+    @property
+    def id(self):
+        """The hash of what the bundle deploys."""
+        return self.index['id']
+
+    @property
+    def schema(self):
+        """The schema the bundle's sql was generated for."""
+        return self.index['schema']
+
+    def read(self, key):
+        """Returns the text of a blob."""
+        offset, length = self.index['blobs'][key]
+        start = self._data + offset
+        return zlib.decompress(self._map[start:start + length]).decode('utf-8')
+
+    def units(self, folders=None):
+        """
+        Returns the units in the bundle, in dependency order, only for the
+        given folders if any. Dependencies on objects left out are dropped.
+        Their sql is read from the bundle as it is used.
+        """
+        entries = [entry for entry in self.index['objects']
+                   if folders is None or entry['object_type'] in folders]
+        paths = set(entry['path'] for entry in entries)
+        return [BundleUnit(
+            self, entry['path'], entry['folder'], entry['object_type'], entry['name'],
+            entry['digest'], entry.get('source'), entry.get('drop_sql'),
+            entry.get('create_sql'), frozenset(paths.intersection(entry['dependencies'])),
+            entry.get('definition')) for entry in entries]
+
+    def close(self):
+        """Unmaps the file."""
+        self._map.close()
+
+
+def load_bundle(path, deployer=None):
+    """
+    Opens a bundle, checking that it was built for the deployer's schema,
+    if one is given.
+    """
+    bundle = Bundle(path)
+    if deployer is not None and bundle.schema != deployer.schema:
+        bundle.close()
+        raise DeployableSQLError('Bundle %s was built for schema %s, not %s' % (
+            path, bundle.schema, deployer.schema))
+    return bundle
@@ -1,2 +1,20 @@
-from .base_deployer import BaseDeployer
-from .pymssql_deployer import PyMSSQLDeployer
+"""
+The deployers, which are imported on first use, as the pymssql deployer
+needs pymssql.
+"""
+import sys
+
+from ..lazy import lazy_exports
+
+
+LAZY_EXPORTS = {
+    'BaseDeployer': 'deployable_sql.deployers.base_deployer',
+    'PyMSSQLDeployer': 'deployable_sql.deployers.pymssql_deployer',
+}
+
+__getattr__ = lazy_exports(__name__, LAZY_EXPORTS)
+
+if sys.version_info < (3, 7): # pragma: no cover
+    # modules cannot define __getattr__, so import everything up front
+    from .base_deployer import BaseDeployer
+    from .pymssql_deployer import PyMSSQLDeployer
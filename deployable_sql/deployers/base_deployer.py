@@ -1,15 +1,143 @@
 """
 Base class for deployer objects.
 """
+from contextlib import contextmanager
+import copy
 import logging
 import os
+from timeit import default_timer
+
+from ..index import ProjectIndex
+from ..manifest import Manifest, content_hash
+from ..report import DeployReport
+from ..units import read_unit
+
+
+# the sync method of each folder, by name
+SYNC_METHODS = {
+    'functions': 'sync_function',
+    'permissions': 'sync_permission',
+    'scripts': 'sync_script',
+    'stored_procedures': 'sync_stored_procedure',
+    'sps': 'sync_stored_procedure',
+    'tables': 'sync_table',
+    'views': 'sync_view',
+    'jobs': 'sync_job',
+}
 
 
 class BaseDeployer(object):
     """Base class for SQL Deployers."""
-    def __init__(self, schema="dbo"):
+    # the number of objects which may be queued before they are sent
+    batch_size = None
+
+    def __init__(self, schema="dbo", force=False):
         self.schema = schema
+        self.force = force
+        self.deployed = 0
+        self.skipped = 0
         self.logger = logging.getLogger(__name__)
+        self.report = DeployReport()
+        self._manifest = None
+        self._index = None
+        # the (object type, object name) being deployed, for the report
+        self._current = None
+
+    @property
+    def index(self):
+        """
+        The index of files in the project folders, built on first use.
+        """
+        if self._index is None:
+            self._index = ProjectIndex()
+        return self._index
+
+    @property
+    def target(self):
+        """A label for the deploy target, used to key the manifest."""
+        return self.schema
+
+    @property
+    def manifest(self):
+        """
+        The deploy manifest for this target, loaded on first use.
+        """
+        if self._manifest is None:
+            self._manifest = Manifest(self.target)
+            self._load_manifest(self._manifest)
+        return self._manifest
+
+    def _load_manifest(self, manifest):
+        """
+        Hook to refresh the manifest from the deploy target. The base deployer
+        only has the local cache to go on.
+        """
+        pass
+
+    @contextmanager
+    def _timed(self, phase):
+        """
+        Adds the time spent in the block to a phase of the object being
+        deployed.
+        """
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.report.add(self._current, phase, default_timer() - start)
+
+    def _record(self, object_type, object_name, digest):
+        """
+        Records that an object was deployed with the given content hash.
+        """
+        self.manifest.record(object_type, object_name, digest)
+
+    def save_manifest(self):
+        """
+        Writes the local manifest cache, if it has been used.
+        """
+        if self._manifest is not None:
+            self._manifest.save()
+
+    def clone(self):
+        """
+        Returns a copy of this deployer for use by another worker, sharing the
+        manifest and report but with its own counts.
+        """
+        other = copy.copy(self)
+        other.deployed = 0
+        other.skipped = 0
+        other._current = None
+        return other
+
+    def merge_counts(self, other):
+        """
+        Adds the counts from a cloned deployer to this one.
+        """
+        self.deployed += other.deployed
+        self.skipped += other.skipped
+
+    def flush(self):
+        """Sends any queued work. The base deployer queues nothing."""
+        pass
+
+    def close(self):
+        """Releases any resources held by the deployer."""
+        pass
+
+    def is_transient(self, error):
+        """
+        True if an error is worth deploying the object again for, later in
+        the deploy. The base deployer knows of no such errors.
+        """
+        return False
+
+    def summary(self):
+        """
+        Returns a one line summary of the work done so far.
+        """
+        return 'Deployed %d objects, skipped %d unchanged.' % (
+            self.deployed, self.skipped)
 
     def sync_function(self, path): # pragma: no cover
         """Syncs a function."""
@@ -35,26 +163,64 @@ class BaseDeployer(object):
         """Syncs a job, step, schedule."""
         raise NotImplementedError
 
+    def sync_script(self, path): # pragma: no cover
+        """Runs a script."""
+        raise NotImplementedError
+
+    def drop_file(self, path, source): # pragma: no cover
+        """
+        Drops the object a deleted file used to define, given the file's last
+        content.
+        """
+        raise NotImplementedError
+
     def sync_file(self, name_or_path):
         """
         Syncs a file of not yet determined type.
         """
-        path_mappings = {
-            'functions': self.sync_function,
-            'permissions': self.sync_permission,
-            'stored_procedures': self.sync_stored_procedure,
-            'sps': self.sync_stored_procedure,
-            'tables': self.sync_table,
-            'views': self.sync_view,
-            'jobs': self.sync_job,
-        }
         path_parts = self._detect_path(name_or_path)
         if path_parts:
             dirname, path = path_parts
-            try:
-                return path_mappings[dirname](path)
-            except KeyError:
+            if dirname not in SYNC_METHODS:
                 self.logger.warning('Could not find a sync function for "%s"', name_or_path)
+                return None
+            return self.sync_unit(read_unit(self, path))
+
+    def sync_unit(self, unit):
+        """
+        Deploys a unit, unless the manifest says it is unchanged, and records
+        it in the manifest.
+        """
+        self._current = unit.key
+        try:
+            if not self.force and self.manifest.is_current(
+                    unit.folder, unit.name, unit.digest):
+                self.logger.debug('Skipping unchanged: %s', unit.name)
+                self.report.skip(self._current)
+                self.skipped += 1
+                return None
+
+            result = self.deploy_unit(unit)
+            with self._timed('record'):
+                self._record(unit.folder, unit.name, unit.digest)
+            self.deployed += 1
+            return result
+        finally:
+            self._current = None
+
+    def deploy_unit(self, unit):
+        """
+        Deploys a unit with the sync method of its folder. Deployers which can
+        use the sql generated when the unit was read override this.
+        """
+        return getattr(self, SYNC_METHODS[unit.folder])(unit.path)
+
+    def render_unit(self, object_type, path, source):
+        """
+        Returns the drop and create sql for the source of a file, either of
+        which may be None. The base deployer generates nothing.
+        """
+        return None, None
 
     def _schema_path(self, name):
         """
@@ -62,35 +228,40 @@ class BaseDeployer(object):
         """
         return name
 
-    def _detect_path(self, name_or_path):
+    def _hash_path(self, path):
         """
-        Return the path for a given input, which may be a filename, a filename
-        relative to the source directory, or a full path.
+        Returns the content hash for a file, salted with the schema it will be
+        deployed to.
         """
-        full_path = ''
+        with open(path, 'rb') as stream:
+            return content_hash(stream.read(), self.schema)
 
+    def _detect_path(self, name_or_path):
+        """
+        Return the path for a given input, which may be a filename, an object
+        name, a filename relative to the source directory, or a full path.
+        """
         if os.path.exists(name_or_path):
             # handle full path or relative path by setting to absolute path
             full_path = os.path.abspath(name_or_path)
         else:
             # if partial path is provided, find the right folder
-            for root, _, files in os.walk('.'):
-                if '.git' in root:
-                    continue
-                for f in files:
-                    if name_or_path == f:
-                        clean_root = root.split(os.path.sep)[-1]
-                        full_path = os.path.join(clean_root, f)
+            matches = self.index.lookup(name_or_path)
+            if len(matches) > 1:
+                self.logger.warning('"%s" is ambiguous, it could be any of: %s',
+                                    name_or_path, ', '.join(matches))
+                return None
+            full_path = os.path.abspath(matches[0]) if matches else ''
 
         if not os.path.exists(full_path):
             self.logger.warning('Could not find path for "%s"', name_or_path)
         else:
             return os.path.basename(os.path.dirname(full_path)), full_path
 
-    def _parse_path(self, path):
+    def _parse_path(self, path, sql=None):
         """
         Breaks the path up into its important elements and returns them as a
-        tuple:
+        tuple. The sql is read from the file, unless it has been already.
         """
         self.logger.debug('path: %s', path)
 
@@ -103,8 +274,10 @@ class BaseDeployer(object):
         self.logger.debug('schema.obj: %s', schema_dot_obj)
 
         # read sql from file
-        with open(path, 'r') as stream:
-            sql = stream.read()
+        if sql is None:
+            with self._timed('parse'):
+                with open(path, 'r') as stream:
+                    sql = stream.read()
 
         self.logger.debug('read sql: %s', sql[:140].replace('\n', ''))
         return schema_dot_obj, sql, folder, filename, basename
@@ -114,5 +287,5 @@ class BaseDeployer(object):
         Syncs all the views in a given folder (that wend with ext .sql).
         """
         self.logger.debug('Looking for files in: %s', folder)
-        for sql in os.listdir(folder):
-            self.sync_file(os.path.join(folder, sql))
+        for path in self.index.files(folder):
+            self.sync_file(path)
@@ -0,0 +1,138 @@
+"""
+A small, thread safe pool of connections, which tracks the database each
+connection is using.
+"""
+import logging
+import threading
+import time
+
+import pymssql
+
+
+class PooledConnection(object):
+    """
+    A connection, its cursor, the database it is currently using, and the
+    session settings sent on it, if any.
+    """
+    __slots__ = ('conn', 'cursor', 'database', 'session', 'last_used')
+
+    def __init__(self, conn, database):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.database = database
+        self.session = None
+        self.last_used = time.time()
+
+
+class ConnectionPool(object):
+    """
+    Hands out connections to concurrent callers, reusing idle ones. Idle
+    connections are health checked before they are handed out again, and
+    replaced if they have gone away.
+
+    connect is a callable returning a new autocommit connection to database.
+    """
+    def __init__(self, connect, database, max_size=None, check_after=30):
+        self.connect = connect
+        self.database = database
+        self.max_size = max_size
+        self.check_after = check_after
+        self.logger = logging.getLogger(__name__)
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, database=None):
+        """
+        Returns a connection, preferring an idle one which is already using
+        database. Blocks while the pool is at max_size.
+        """
+        with self._cond:
+            while not self._idle and self.max_size and self._size >= self.max_size:
+                self._cond.wait()
+
+            if self._idle:
+                pooled = self._pop_idle(database)
+            else:
+                self._size += 1
+                pooled = None
+
+        if pooled is None:
+            try:
+                return self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        if time.time() - pooled.last_used > self.check_after and not self.ping(pooled):
+            self.reconnect(pooled)
+        return pooled
+
+    def release(self, pooled):
+        """
+        Returns a connection to the pool.
+        """
+        pooled.last_used = time.time()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    def ping(self, pooled):
+        """
+        True if the connection is still usable.
+        """
+        try:
+            pooled.cursor.execute('SELECT 1')
+            pooled.cursor.fetchall()
+        except (pymssql.Error, AttributeError):
+            return False
+        return True
+
+    def reconnect(self, pooled):
+        """
+        Replaces the underlying connection of a broken pooled connection.
+        """
+        self.logger.warning('Reconnecting to %s', self.database)
+        try:
+            pooled.conn.close()
+        except pymssql.Error:
+            pass
+        fresh = self._open()
+        pooled.conn = fresh.conn
+        pooled.cursor = fresh.cursor
+        pooled.database = fresh.database
+        pooled.session = None
+        return pooled
+
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for pooled in idle:
+            try:
+                pooled.conn.close()
+            except pymssql.Error:
+                pass
+
+    def _pop_idle(self, database):
+        """
+        Removes and returns an idle connection, using database if possible.
+        """
+        for i, pooled in enumerate(self._idle):
+            if pooled.database == database:
+                return self._idle.pop(i)
+        return self._idle.pop()
+
+    def _open(self):
+        """
+        Opens a new connection.
+        """
+        self.logger.debug('Opening a connection to %s', self.database)
+        conn = self.connect()
+        conn.autocommit(True)
+        return PooledConnection(conn, self.database)
@@ -3,113 +3,991 @@ Deployer object for T-SQL/MS-SQL
 """
 from collections import OrderedDict
 from datetime import datetime
+import os
+import random
+import re
+import time
+from timeit import default_timer
 
-from dateutil.parser import parse
 import pymssql
 import yaml
 
 from .base_deployer import BaseDeployer
+from .pool import ConnectionPool
 from . import constants
+from ..exc import BatchError, ScriptError, TableChangeError
+from ..folders import MODULE_FOLDERS
+from ..lexer import iter_batches, remove_order_by, rewrite_create
+from ..permissions import (PERMISSIONS_SQL, diff_permissions, is_permissions_file,
+                           merge_permissions, parse_permissions, permission_batches)
+from ..rebuild import TableRebuild
+from ..tables import (ONLINE, REBUILD, SIZE_OF_DATA, TABLE_COLUMNS_SQL,
+                      TABLE_CONSTRAINTS_SQL, diff_table, parse_table, read_catalog)
+from ..units import read_unit
+
+
+MANIFEST_TABLE = 'deployable_sql_manifest'
+
+# sys.objects types for each folder of modules
+OBJECT_TYPES = {
+    'V': 'views',
+    'FN': 'functions',
+    'IF': 'functions',
+    'TF': 'functions',
+    'P': 'stored_procedures',
+}
+
+# the settings every job is added with
+JOB_SETTINGS = OrderedDict([
+    ('notify_level_email', 3),
+    ('notify_email_operator_name', "N'Dan Cohen'"),
+    ('notify_level_eventlog', 0),
+])
+
+JOB_STEP_COLUMNS = [
+    'step_name', 'subsystem', 'command', 'database_name',
+    'on_success_action', 'on_success_step_id', 'on_fail_action',
+    'on_fail_step_id', 'retry_attempts', 'retry_interval', 'output_file_name',
+]
+
+JOB_SCHEDULE_COLUMNS = [
+    'name', 'enabled', 'freq_type', 'freq_interval', 'freq_subday_type',
+    'freq_subday_interval', 'freq_relative_interval', 'freq_recurrence_factor',
+    'active_start_date', 'active_start_time',
+]
+
+# each query selects the job name, then the listed columns of s
+JOB_CATALOG = [
+    ('settings', list(JOB_SETTINGS), """SELECT j.name, %(columns)s
+    FROM msdb.dbo.sysjobs j
+    JOIN (SELECT sj.job_id, sj.notify_level_email, sj.notify_level_eventlog,
+                 o.name AS notify_email_operator_name
+          FROM msdb.dbo.sysjobs sj
+          LEFT JOIN msdb.dbo.sysoperators o ON o.id = sj.notify_email_operator_id
+    ) s ON s.job_id = j.job_id%(where)s
+    ORDER BY j.name;"""),
+    ('steps', ['step_id'] + JOB_STEP_COLUMNS, """SELECT j.name, %(columns)s
+    FROM msdb.dbo.sysjobs j
+    JOIN msdb.dbo.sysjobsteps s ON s.job_id = j.job_id%(where)s
+    ORDER BY j.name, s.step_id;"""),
+    ('schedules', ['schedule_id', 'job_count'] + JOB_SCHEDULE_COLUMNS,
+     """SELECT j.name, %(columns)s
+    FROM msdb.dbo.sysjobs j
+    JOIN msdb.dbo.sysjobschedules js ON js.job_id = j.job_id
+    JOIN (SELECT ss.*, (SELECT COUNT(*) FROM msdb.dbo.sysjobschedules c
+                        WHERE c.schedule_id = ss.schedule_id) AS job_count
+          FROM msdb.dbo.sysschedules ss
+    ) s ON s.schedule_id = js.schedule_id%(where)s
+    ORDER BY j.name, s.name;"""),
+    ('servers', ['server_name'], """SELECT j.name, %(columns)s
+    FROM msdb.dbo.sysjobs j
+    JOIN (SELECT js.job_id, CASE WHEN js.server_id = 0 THEN N'(local)'
+                                 ELSE srv.name END AS server_name
+          FROM msdb.dbo.sysjobservers js
+          LEFT JOIN sys.servers srv ON srv.server_id = js.server_id
+    ) s ON s.job_id = j.job_id%(where)s
+    ORDER BY j.name;"""),
+]
+
+# 2016 SP1, and the engine editions of azure sql database and managed instance
+CREATE_OR_ALTER_VERSION = (13, 0, 4001)
+AZURE_EDITIONS = (5, 8)
+# enterprise and developer editions add NOT NULL columns with a default as a
+# metadata only change since 2012
+ENTERPRISE_EDITION = 3
+METADATA_DEFAULTS_VERSION = (11,)
+
+# the object type to drop for each folder of modules
+DROP_TYPES = {
+    'views': 'VIEW',
+    'functions': 'FUNCTION',
+    'stored_procedures': 'PROCEDURE',
+    'sps': 'PROCEDURE',
+}
+
+# how each folder of modules is named in the log
+MODULE_LABELS = {
+    'views': 'view',
+    'functions': 'function',
+    'stored_procedures': 'sp',
+}
+
+USE_RE = re.compile(r'^\s*USE\s+\[?(\w+)\]?', re.I | re.M)
+
+# a batch wrapped in a transaction, as _transaction writes it, which any
+# error rolls back in full
+TRANSACTION_RE = re.compile(r'^\s*(?:USE\s+\[?\w+\]?;\s*)?SET\s+XACT_ABORT\s+ON;\s*'
+                            r'BEGIN\s+TRAN(?:SACTION)?;.*COMMIT\s+TRAN(?:SACTION)?;\s*$',
+                            re.I | re.S)
+
+# what a batch may change the session with, which sp_executesql would undo
+SESSION_RE = re.compile(r'^\s*(?:USE|SET)\b|#', re.I | re.M)
+
+# runs the batches of a script in one round trip, raising the number of the
+# batch which failed along with its error
+PIPELINE_SQL = """DECLARE @deployable_sql_batch int;
+BEGIN TRY
+%s
+END TRY
+BEGIN CATCH
+    DECLARE @deployable_sql_error nvarchar(4000);
+    SET @deployable_sql_error = N'deployable_sql batch ' +
+        CAST(@deployable_sql_batch AS nvarchar(10)) + N': ' + ERROR_MESSAGE();
+    RAISERROR (N'%%s', 16, 1, @deployable_sql_error);
+END CATCH;"""
+
+PIPELINE_ERROR_RE = re.compile(r'deployable_sql batch (\d+): ')
+
+# lock request time out period exceeded, and chosen as the deadlock victim
+LOCK_ERRORS = (1222, 1205)
+
+# the session settings of low impact mode, and what they are put back to
+LOW_IMPACT_SESSION_SQL = 'SET LOCK_TIMEOUT %d;\nSET DEADLOCK_PRIORITY LOW;'
+DEFAULT_SESSION_SQL = 'SET LOCK_TIMEOUT -1;\nSET DEADLOCK_PRIORITY NORMAL;'
 
 
 class PyMSSQLDeployer(BaseDeployer):
     """
     Class used to deploy source controlled SQL files to datbase.
     """
-    def __init__(self, usr, pwd, host, db, **kwargs):
+    def __init__(self, usr, pwd, host, db, batch_size=None, pool=None,
+                 pool_size=None, create_or_alter=None, allow=None,
+                 rebuild_chunk_size=None, rebuild_throttle=0, pipeline_size=None,
+                 lock_timeout=None, lock_retries=5, retry_backoff=0.5, **kwargs):
         """
         Prepare to create an engine connection.
+
+        When batch_size is set, the statements for each object are sent in a
+        single round trip, and up to batch_size objects are packed into each
+        batch. Queued objects are sent by flush, or close.
+
+        Connections come from pool, which is created on first use if not
+        given, and is shared with any clones of this deployer.
+
+        create_or_alter may be True, or a list of folders, for which modules
+        are altered in place rather than dropped and recreated.
+
+        allow lists the impacts of table changes which may be made besides
+        online ones, such as tables.SIZE_OF_DATA and tables.DESTRUCTIVE.
+
+        When rebuild_chunk_size is set, tables needing changes which would
+        otherwise touch every row in place, or cannot be made in place at
+        all, are rebuilt into a copy instead, rebuild_chunk_size rows at a
+        time, waiting rebuild_throttle seconds between chunks.
+
+        When pipeline_size is set, consecutive batches of a GO separated
+        script which together are no longer than that many characters are
+        sent in a single round trip.
+
+        Setting lock_timeout, in milliseconds, turns on low impact mode, for
+        deploying to busy servers. Each session gives up on a lock after that
+        long, and offers itself as the victim of any deadlock, rather than
+        queueing other sessions behind its own requests. Statements which
+        fail on a lock timeout or deadlock are retried up to lock_retries
+        times, backing off from retry_backoff seconds with jitter. Only
+        statements which leave nothing behind when they fail are retried:
+        drops, module definitions and batches wrapped in a transaction.
+        Scripts and queued batches are not, since part of them may already
+        have been committed.
         """
         super(PyMSSQLDeployer, self).__init__(**kwargs)
         self.usr = usr
         self.pwd = pwd
         self.host = host
         self.db = db
-        self.conn = None
-        self.cursor = None
+        self.batch_size = batch_size
+        self.pool = pool
+        self.pool_size = pool_size
+        self._owns_pool = pool is None
+        self._pooled = None
+        self._pending = []
+        # the parsed yaml of every permissions file, keyed by path, when they
+        # are not read from the project, such as when deploying a bundle
+        self.permission_files = None
+
+        if create_or_alter is True:
+            create_or_alter = MODULE_FOLDERS
+        self.create_or_alter = set(
+            'stored_procedures' if f == 'sps' else f for f in create_or_alter or [])
+        self.allow = set([ONLINE] + list(allow or []))
+        self.rebuild_chunk_size = rebuild_chunk_size
+        self.rebuild_throttle = rebuild_throttle
+        self.pipeline_size = pipeline_size
+        self.lock_timeout = lock_timeout
+        self.lock_retries = lock_retries
+        self.retry_backoff = retry_backoff
+        self._session_sql = (None if lock_timeout is None else
+                             LOW_IMPACT_SESSION_SQL % int(lock_timeout))
+        self._server_properties = None
+        self._create_or_alter_supported = None
+        # the tables of each schema, fetched on first use, and those altered since
+        self._tables = {}
+        self._stale_tables = set()
+        # the msdb jobs, fetched on first use, and those changed since
+        self._jobs = None
+        self._stale_jobs = set()
+
+    @property
+    def conn(self):
+        """The connection in use, if there is one."""
+        return self._pooled.conn if self._pooled is not None else None
+
+    @property
+    def cursor(self):
+        """The cursor of the connection in use, if there is one."""
+        return self._pooled.cursor if self._pooled is not None else None
+
+    @property
+    def target(self):
+        """The host, db and schema, which identify the deploy target."""
+        return '/'.join([self.host, self.db, self.schema])
 
     def connect(self):
         """
-        Create a connection.
+        Take a connection from the pool, creating the pool if need be.
+        """
+        if self.pool is None:
+            self.pool = ConnectionPool(self._connect, self.db,
+                                       max_size=self.pool_size)
+        self._pooled = self.pool.acquire(self.db)
+
+    def _connect(self):
+        """
+        Open a new connection to the server.
+        """
+        return pymssql.connect(self.host, self.usr, self.pwd, self.db)
+
+    def clone(self):
+        """
+        Returns a copy of this deployer, which will take its own connection
+        from the shared pool.
+        """
+        if self.pool is None:
+            self.pool = ConnectionPool(self._connect, self.db,
+                                       max_size=self.pool_size)
+        other = super(PyMSSQLDeployer, self).clone()
+        other._owns_pool = False
+        other._pooled = None
+        other._pending = []
+        return other
+
+    def close(self):
+        """
+        Sends any queued objects, then gives back the connection. The pool is
+        closed too, if this deployer created it.
         """
-        self.conn = pymssql.connect(self.host, self.usr, self.pwd, self.db)
-        self.conn.autocommit(True)
-        self.cursor = self.conn.cursor()
+        try:
+            self.flush()
+        finally:
+            self._disconnect()
+            if self._owns_pool and self.pool is not None:
+                self.pool.close()
+
+    def _disconnect(self):
+        """
+        Returns the connection to the pool, if one was taken.
+        """
+        if self._pooled is not None:
+            self.pool.release(self._pooled)
+            self._pooled = None
 
     def _reset_db(self):
         """
-        Run a use statement on the default db.
+        Run a use statement on the default db, unless the connection is known
+        to be using it already.
         """
-        self._exec('USE %s;' % self.db)
+        if self._pooled is None:
+            self.connect()
+        if self._pooled.database != self.db:
+            self._exec('USE %s;' % self.db, fetch=False)
 
     def sync_view(self, path):
         """
         Drops the view if it already exists, then and recreates it.
         """
-        schema_dot_obj, sql = self._parse_path(path)[:2]
-        self.logger.debug('Syncing view: %s', schema_dot_obj)
-        drop_sql = _if_drop(schema_dot_obj)
-
-        # remove any ORDER BY statements
-        sql = '\n'.join([line for line in sql.split('\n')
-                         if 'ORDER BY' not in line])
-        build_sql = "CREATE VIEW %s AS \n%s;" % (schema_dot_obj, sql)
-        self._reset_db()
-        self._exec(drop_sql)
-        self._exec(build_sql)
-        #self._exec('SELECT TOP 1 * FROM %s' % schema_dot_obj)
-        self.logger.info('Deployed view: %s', schema_dot_obj)
+        self._deploy_module(read_unit(self, path, render=True))
 
     def sync_function(self, path):
         """
         Syncs a function.
         """
-        schema_dot_obj, sql = self._parse_path(path)[:2]
-        self.logger.debug('Syncing function: %s', schema_dot_obj)
-        drop_sql = _if_drop(schema_dot_obj, object_type='FUNCTION')
-        self._reset_db()
-        self._exec(drop_sql)
-        # nothing fancy required here, the sql is a create statement
-        self._exec(sql)
-        self.logger.info('Deployed function: %s', schema_dot_obj)
+        self._deploy_module(read_unit(self, path, render=True))
 
     def sync_stored_procedure(self, path):
         """
         Syncs a stored procedure.
         """
-        schema_dot_obj, sql = self._parse_path(path)[:2]
-        self.logger.debug('Syncing stored procedure: %s', schema_dot_obj)
-        drop_sql = _if_drop(schema_dot_obj, object_type='PROCEDURE')
+        self._deploy_module(read_unit(self, path, render=True))
+
+    def sync_script(self, path):
+        """
+        Runs a GO separated script, one batch at a time.
+        """
+        self._deploy_script(read_unit(self, path, render=False))
+
+    def sync_unit(self, unit):
+        """
+        Deploys a unit as the base deployer does, except for permission
+        scripts, which are neither run nor counted.
+        """
+        if unit.object_type == 'permissions' and not is_permissions_file(unit.path):
+            self.logger.warning('Not running "%s", permission scripts are run by hand',
+                                unit.path)
+            return None
+        return super(PyMSSQLDeployer, self).sync_unit(unit)
+
+    def deploy_unit(self, unit):
+        """
+        Deploys a unit, using the sql generated when it was read.
+        """
+        if unit.object_type in MODULE_FOLDERS:
+            if unit.create_sql is None:
+                unit = read_unit(self, unit.path, render=True)
+            self._deploy_module(unit)
+        elif unit.object_type == 'jobs':
+            self._deploy_job(unit)
+        elif unit.object_type == 'tables':
+            self._deploy_table(unit)
+        elif unit.object_type == 'scripts':
+            self._deploy_script(unit)
+        elif unit.object_type == 'permissions':
+            self._deploy_permissions(unit)
+        else:
+            super(PyMSSQLDeployer, self).deploy_unit(unit)
+
+    def _deploy_module(self, unit):
+        """
+        Drops and creates, or alters, the view, function or stored procedure
+        of a rendered unit.
+        """
+        drop_sql, create_sql, module = self._create_or_alter(
+            unit.object_type, unit.name, unit.drop_sql, unit.create_sql)
+        # a view is wrapped in a single CREATE VIEW, so cannot hold batches
+        self._apply(unit.path, drop_sql, create_sql, 'Deployed %s: %s' % (
+            MODULE_LABELS[unit.object_type], unit.name), module=module,
+                    script=unit.object_type != 'views')
+
+    def _deploy_script(self, unit):
+        """
+        Runs the script of a unit. A script may change its session, with USE,
+        SET or temporary tables, which would not last past sp_executesql, so
+        scripts are never queued, but run once anything queued has been sent.
+        """
+        self.flush()
         self._reset_db()
-        self._exec(drop_sql)
-        # nothing fancy required here, the sql is a create statement
-        self._exec(sql)
-        self.logger.info('Deployed sp: %s', schema_dot_obj)
+        with self._timed('create'):
+            self._run_script(unit.path, unit.source, retry=False)
+        self.logger.info('Ran script: %s', unit.name)
 
     def sync_job(self, path):
         """
         Takes a dict that could be interpreted from json, yaml, or python
         and creates a job, steps and schedule based on it.
+
+        A job which already exists is not deleted, which would lose its
+        history. Instead only the msdb calls needed to bring it in line are
+        made, in a single batch.
         """
-        with open(path, 'rb') as stream:
-            job = yaml.load(stream)
+        self._deploy_job(read_unit(self, path, render=False))
 
-        job_name, build_sql = read_job(job)
+    def _deploy_job(self, unit):
+        """
+        Creates the job of a unit, or brings the existing job in line.
+        """
+        job = unit.definition
+        if job is None:
+            with self._timed('parse'):
+                job = yaml.safe_load(unit.source)
+        job_name = list(job)[0]
+        current = self._current_job(job_name)
 
-        drop_sql = """DECLARE @job_id binary(16);
-        SELECT @job_id = job_id FROM msdb.dbo.sysjobs WHERE name = '%s'
-        IF (@job_id IS NOT NULL)
-        BEGIN
-            EXEC msdb.dbo.sp_delete_job @job_id
-        END""" % job_name
+        with self._timed('compile'):
+            if current is None and unit.create_sql is not None:
+                # compiled when the unit was rendered
+                build_sql = unit.create_sql
+            elif current is None:
+                job_name, build_sql = read_job(job)
+            else:
+                statements = diff_job(job, current)
+                build_sql = _msdb_batch(statements) if statements else None
+
+        if build_sql is None:
+            self.logger.info('Job unchanged: %s', job_name)
+            return
+        self._stale_jobs.add(normalize_value(job_name))
+        self._apply(unit.path, None, build_sql, '%s job: %s' % (
+            'Deployed' if current is None else 'Updated', job_name), module=False)
+
+    def _current_job(self, job_name):
+        """
+        Returns the job as it is in msdb, or None if there is no such job.
+        Every job is fetched in bulk on first use, and jobs which have been
+        changed since are fetched again.
+        """
+        name = normalize_value(job_name)
+        if self._jobs is None:
+            self._jobs = self.fetch_jobs()
+        elif name in self._stale_jobs:
+            self._jobs.pop(name, None)
+            self._jobs.update(self.fetch_jobs(name))
+            self._stale_jobs.discard(name)
+        return self._jobs.get(name)
+
+    def sync_table(self, path):
+        """
+        Creates a table if it does not exist yet. Otherwise the table is
+        altered in place to match its definition, in a single transaction.
+
+        Changes which are not online, such as those rewriting every row, are
+        only made if their impact is allowed. If any change is refused a
+        TableChangeError is raised, and the table is left as it was. When
+        rebuilds are on, a table needing size of data changes which are not
+        allowed, or changes which need a rebuild, is rebuilt instead.
+        """
+        self._deploy_table(read_unit(self, path, render=False))
+
+    def _deploy_table(self, unit):
+        """
+        Creates or alters the table of a unit, as sync_table describes.
+        """
+        path, sql = unit.path, unit.source
+        with self._timed('parse'):
+            table = parse_table(sql, self.schema)
+        current = self._current_table(table.name)
+        if current is None:
+            self._stale_tables.add(table.name.lower())
+            self._apply(path, None, sql, 'Created table: %s' % table.name, module=False)
+            return
+
+        with self._timed('generate'):
+            changes = diff_table(table, current, self.supports_metadata_defaults())
+        if not changes:
+            self.logger.info('Table unchanged: %s', table.name)
+            return
+        refused = [c for c in changes if c.impact not in self.allow]
+        rebuild = (self.rebuild_chunk_size is not None and
+                   any(c.impact in (SIZE_OF_DATA, REBUILD) for c in refused))
+        if rebuild:
+            refused = [c for c in refused if c.impact not in (SIZE_OF_DATA, REBUILD)]
+        if refused:
+            raise TableChangeError(table.name, refused)
+
+        if rebuild:
+            # the copy is run one chunk at a time, so it cannot be batched
+            self.flush()
+            self._reset_db()
+            self._stale_tables.add(table.name.lower())
+            copied = TableRebuild(self, table, current, unit.digest,
+                                  self.rebuild_chunk_size, self.rebuild_throttle).run()
+            self.logger.info('Rebuilt table: %s (%s), %d rows copied', table.name,
+                             ', '.join(c.description for c in changes), copied)
+            return
+        for change in changes:
+            if change.impact == SIZE_OF_DATA:
+                self.logger.warning('%s: %s will touch every row', table.name,
+                                    change.description)
+
+        self._stale_tables.add(table.name.lower())
+        self._apply(path, None, _transaction(c.sql for c in changes),
+                    'Altered table: %s (%s)' % (
+                        table.name, ', '.join(c.description for c in changes)),
+                    module=False)
+
+    def _current_table(self, name):
+        """
+        Returns a schema qualified table as it is on the server, or None if
+        there is no such table. The tables of each schema are fetched in bulk
+        on first use, and tables which have been changed since are fetched
+        again.
+        """
+        schema, table_name = name.split('.')
+        key = name.lower()
+        if schema.lower() not in self._tables:
+            self._tables[schema.lower()] = self.fetch_tables(schema)
+        elif key in self._stale_tables:
+            tables = self._tables[schema.lower()]
+            tables.pop(table_name.lower(), None)
+            tables.update(self.fetch_tables(schema, table_name))
+            self._stale_tables.discard(key)
+        return self._tables[schema.lower()].get(table_name.lower())
+
+    def drop_file(self, path, source):
+        """
+        Drops the object a deleted file used to define, given the file's last
+        content, and forgets it in the manifest.
+        """
+        folder = os.path.basename(os.path.dirname(path))
+        basename = os.path.splitext(os.path.basename(path))[0]
+        object_name = self._schema_path(basename)
+
+        if folder == 'jobs':
+            object_name = read_job_params(yaml.safe_load(source))[0]
+            drop_sql = _if_drop_job(object_name)
+        elif folder in DROP_TYPES:
+            drop_sql = _if_drop(object_name, object_type=DROP_TYPES[folder])
+        else:
+            self.logger.warning('Not dropping "%s", only modules and jobs are '
+                                'dropped', path)
+            return
+
+        self._reset_db()
+        self._exec(drop_sql, fetch=False)
+        self.manifest.forget(folder, self._schema_path(basename))
+        self._exec("DELETE FROM %s WHERE object_type = %s AND object_name = %s;" % (
+            self._schema_path(MANIFEST_TABLE), _quote(folder),
+            _quote(self._schema_path(basename))), fetch=False)
+        self.logger.info('Dropped %s: %s', folder, object_name)
+
+    def render(self, path, source=None):
+        """
+        Returns the object name, drop sql and create sql for a file, without
+        executing anything. The file is read, unless its source is given.
+        """
+        renderers = {
+            'views': self.render_view,
+            'functions': self.render_function,
+            'stored_procedures': self.render_stored_procedure,
+            'sps': self.render_stored_procedure,
+            'jobs': self.render_job,
+        }
+        return renderers[os.path.basename(os.path.dirname(path))](path, source)
+
+    def render_unit(self, object_type, path, source):
+        """
+        Returns the drop and create sql for the source of a module or job.
+        Tables are diffed against the server when they are deployed, so
+        there is nothing to generate for them up front.
+        """
+        if object_type in MODULE_FOLDERS or object_type == 'jobs':
+            return self.render(path, source)[1:]
+        if object_type == 'scripts':
+            return None, source
+        return None, None
 
-        self._exec(drop_sql)
-        self._exec(build_sql)
-        self.logger.info('Deployed job: %s', schema_dot_obj)
+    def render_view(self, path, source=None):
+        """
+        Wraps the select statement in a view in a CREATE VIEW statement.
+        """
+        schema_dot_obj, sql = self._parse_path(path, source)[:2]
+        self.logger.debug('Syncing view: %s', schema_dot_obj)
+        with self._timed('generate'):
+            drop_sql = _if_drop(schema_dot_obj)
+
+            # a view cannot be ordered, unless the order picks its rows
+            sql = remove_order_by(sql).rstrip().rstrip(';').rstrip()
+            build_sql = "CREATE VIEW %s AS \n%s;" % (schema_dot_obj, sql)
+        return schema_dot_obj, drop_sql, build_sql
+
+    def render_function(self, path, source=None):
+        """
+        Returns the sql for a function.
+        """
+        schema_dot_obj, sql = self._parse_path(path, source)[:2]
+        self.logger.debug('Syncing function: %s', schema_dot_obj)
+        with self._timed('generate'):
+            drop_sql = _if_drop(schema_dot_obj, object_type='FUNCTION')
+        # nothing fancy required here, the sql is a create statement
+        return schema_dot_obj, drop_sql, sql
+
+    def render_stored_procedure(self, path, source=None):
+        """
+        Returns the sql for a stored procedure.
+        """
+        schema_dot_obj, sql = self._parse_path(path, source)[:2]
+        self.logger.debug('Syncing stored procedure: %s', schema_dot_obj)
+        with self._timed('generate'):
+            drop_sql = _if_drop(schema_dot_obj, object_type='PROCEDURE')
+        # nothing fancy required here, the sql is a create statement
+        return schema_dot_obj, drop_sql, sql
+
+    def render_job(self, path, source=None):
+        """
+        Returns the job name, and sql to delete and add the job.
+        """
+        with self._timed('parse'):
+            job = load_job(path) if source is None else yaml.safe_load(source)
+        with self._timed('compile'):
+            job_name, build_sql = read_job(job)
+        return job_name, _if_drop_job(job_name), build_sql
+
+    def fetch_modules(self, names=None):
+        """
+        Returns the definition of every view, function and stored procedure
+        in the schema, or just those with the given schema_dot_obj names,
+        keyed by (folder, schema_dot_obj), in one query.
+        """
+        where = ''
+        if names is not None:
+            if not names:
+                return {}
+            where = ' AND o.name IN (%s)' % ', '.join(
+                sorted(set(_quote(name.split('.', 1)[-1]) for name in names)))
+        self._reset_db()
+        rows = self._exec("""SELECT o.type, s.name + '.' + o.name, m.definition
+        FROM sys.sql_modules m
+        JOIN sys.objects o ON o.object_id = m.object_id
+        JOIN sys.schemas s ON s.schema_id = o.schema_id
+        WHERE s.name = %s AND o.type IN (%s)%s;""" % (
+            _quote(self.schema), ', '.join("'%s'" % t for t in OBJECT_TYPES), where))
+        return dict(((OBJECT_TYPES[t.strip()], name), definition)
+                    for t, name, definition in rows or [])
+
+    def fetch_jobs(self, job_name=None):
+        """
+        Returns every agent job, or just the named one, with its settings as
+        a dict, and its steps, schedules and servers as lists of dicts, keyed
+        by column name, in one query per table.
+        """
+        where = '\n    WHERE j.name = %s' % _quote(job_name) if job_name else ''
+        jobs = {}
+        for label, columns, sql in JOB_CATALOG:
+            rows = self._exec(sql % {
+                'columns': ', '.join('s.%s' % column for column in columns),
+                'where': where,
+            })
+            for row in rows or []:
+                values = dict(zip(columns, row[1:]))
+                if label == 'settings':
+                    jobs[row[0]] = {'settings': values, 'steps': [],
+                                    'schedules': [], 'servers': []}
+                elif row[0] in jobs:
+                    jobs[row[0]][label].append(values)
+        return jobs
+
+    def fetch_tables(self, schema, table_name=None):
+        """
+        Returns every table in a schema, or just the named one, with its
+        columns and constraints, keyed by lowercased table name, in two
+        queries.
+        """
+        args = {
+            'schema': _quote(schema),
+            'where': ' AND t.name = %s' % _quote(table_name) if table_name else '',
+        }
+        self._reset_db()
+        columns = self._exec(TABLE_COLUMNS_SQL % args)
+        constraints = self._exec(TABLE_CONSTRAINTS_SQL % args)
+        return read_catalog(columns or [], constraints or [])
+
+    def server_properties(self):
+        """
+        Returns the version of the server, as a tuple of ints, and its engine
+        edition, which are only asked for once.
+        """
+        if self._server_properties is None:
+            rows = self._exec("""SELECT
+            CAST(SERVERPROPERTY('ProductVersion') AS varchar(32)),
+            CAST(SERVERPROPERTY('EngineEdition') AS int);""")
+            version, edition = rows[0]
+            self._server_properties = (_version_tuple(version), edition)
+        return self._server_properties
+
+    def supports_create_or_alter(self):
+        """
+        True if the server understands CREATE OR ALTER, which arrived in SQL
+        Server 2016 SP1, and has always been available on Azure.
+        """
+        if self._create_or_alter_supported is None:
+            version, edition = self.server_properties()
+            self._create_or_alter_supported = (
+                edition in AZURE_EDITIONS or version >= CREATE_OR_ALTER_VERSION)
+        return self._create_or_alter_supported
+
+    def supports_metadata_defaults(self):
+        """
+        True if adding a NOT NULL column with a default leaves existing rows
+        alone, as on Enterprise edition and Azure since SQL Server 2012.
+        """
+        version, edition = self.server_properties()
+        return ((edition == ENTERPRISE_EDITION or edition in AZURE_EDITIONS) and
+                version >= METADATA_DEFAULTS_VERSION)
+
+    def _create_or_alter(self, folder, schema_dot_obj, drop_sql, create_sql):
+        """
+        When create or alter mode is on for the folder, rewrites the CREATE
+        header of a module so that it is changed in place instead of being
+        dropped, keeping its permissions and extended properties. Older
+        servers get an ALTER if the object exists, and a CREATE otherwise.
+
+        In a GO separated file, only the first batch with a CREATE header is
+        rewritten, and the batches around it are kept.
+
+        Returns the drop sql, which may be None, the create sql, and whether
+        the create sql still needs to be wrapped when batched.
+        """
+        if folder not in self.create_or_alter:
+            return drop_sql, create_sql, True
+
+        batches = [batch.sql for batch in iter_batches(create_sql)]
+        supported = self.supports_create_or_alter()
+        for i, batch_sql in enumerate(batches):
+            if supported:
+                sql = rewrite_create(batch_sql, 'CREATE OR ALTER')
+            else:
+                sql = rewrite_create(batch_sql, 'ALTER')
+                if sql is not None:
+                    sql = """IF OBJECT_ID (%s) IS NULL
+    EXEC sp_executesql %s;
+ELSE
+    EXEC sp_executesql %s;""" % (_quote(schema_dot_obj), _quote(batch_sql),
+                                 _quote(sql))
+            if sql is not None:
+                batches[i] = sql
+                return None, '\nGO\n'.join(batches), supported
+
+        self.logger.warning('No CREATE header found in %s, dropping it instead',
+                            schema_dot_obj)
+        return drop_sql, create_sql, True
+
+    def _apply(self, label, drop_sql, create_sql, message, module=True,
+               script=False):
+        """
+        Drops and creates an object. In batched mode the statements are queued
+        instead, with module definitions wrapped in sp_executesql so that they
+        need not be the first statement in their batch.
+
+        When script is set, the create sql may hold several GO separated
+        batches, which are run one at a time, or each wrapped in
+        sp_executesql when queued.
+        """
+        if self.batch_size is None:
+            self._reset_db()
+            if drop_sql is not None:
+                with self._timed('drop'):
+                    # a single drop statement, which is undone if it fails
+                    self._exec(drop_sql, fetch=False, retry=True)
+            with self._timed('create'):
+                if script:
+                    self._run_script(label, create_sql)
+                else:
+                    self._exec(create_sql, fetch=False)
+            self.logger.info(message)
+            return
+
+        # flush before queueing, so the manifest update for this object can
+        # still join it in the same batch
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        if script:
+            create_sql = '\n'.join('EXEC sp_executesql %s;' % _quote(batch.sql)
+                                   for batch in iter_batches(create_sql))
+        elif module:
+            create_sql = 'EXEC sp_executesql %s;' % _quote(create_sql)
+        statements = ['USE %s;' % self.db, drop_sql, create_sql]
+        self._pending.append(_Pending(
+            label, '\n'.join(sql for sql in statements if sql is not None), message,
+            self._current))
+
+    def _run_script(self, label, sql, retry=None):
+        """
+        Runs the GO separated batches of a script one at a time, as they are
+        split from it. The first batch to fail stops the script, and is
+        raised as a ScriptError with the line of the file it starts on.
+
+        When pipeline_size is set, consecutive batches no longer than that
+        together are sent in one round trip. Batches which may change the
+        session, other than module definitions, are always sent on their own.
+
+        Pass retry=False for scripts, none of whose batches may be sent again
+        after a lock timeout or deadlock, as _exec describes.
+        """
+        group = []
+        size = 0
+        for number, batch in enumerate(iter_batches(sql), 1):
+            length = len(batch.sql)
+            if (self.pipeline_size and length <= self.pipeline_size and
+                    _self_contained(batch.sql)):
+                if size + length > self.pipeline_size:
+                    self._run_batches(label, group, retry)
+                    group, size = [], 0
+                group.append((number, batch))
+                size += length
+                continue
+            if group:
+                self._run_batches(label, group, retry)
+                group, size = [], 0
+            self._run_batches(label, [(number, batch)], retry)
+        if group:
+            self._run_batches(label, group, retry)
+
+    def _run_batches(self, label, group, retry=None):
+        """
+        Sends a group of numbered batches of a script in a single round trip,
+        raising a ScriptError for the batch which failed.
+        """
+        if len(group) == 1:
+            sql = group[0][1].sql
+        else:
+            sql = PIPELINE_SQL % '\n'.join(
+                '    SET @deployable_sql_batch = %d;\n    EXEC sp_executesql %s;' % (
+                    number, _quote(batch.sql)) for number, batch in group)
+        try:
+            self._exec(sql, fetch=False, retry=retry)
+        except pymssql.Error as error:
+            number, batch = group[0]
+            match = PIPELINE_ERROR_RE.search(str(error))
+            if len(group) > 1 and match:
+                number = int(match.group(1))
+                batch = dict(group).get(number, batch)
+            raise ScriptError(label, number, batch.line, error)
+
+    def flush(self):
+        """
+        Executes any queued objects in a single batch. If the batch fails, the
+        objects are retried one at a time to find out which of them failed,
+        and a BatchError is raised with the errors keyed by label.
+
+        The time taken by the batch is shared between its objects.
+        """
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        current, self._current = self._current, None
+        start = default_timer()
+        try:
+            self._exec('\n'.join(p.sql for p in pending), fetch=False)
+        except pymssql.Error as error:
+            if len(pending) == 1:
+                raise BatchError({pending[0].label: error})
+            self.logger.warning('Batch of %d objects failed, retrying them '
+                                'one at a time', len(pending))
+            errors = {}
+            for p in pending:
+                self._current = p.key
+                try:
+                    with self._timed('batch'):
+                        self._exec(p.sql, fetch=False)
+                except pymssql.Error as error:
+                    errors[p.label] = error
+                else:
+                    p.done(self)
+            if errors:
+                raise BatchError(errors)
+        else:
+            seconds = (default_timer() - start) / len(pending)
+            for p in pending:
+                self.report.add(p.key, 'batch', seconds)
+                p.done(self)
+        finally:
+            self._current = current
+
+    def is_transient(self, error):
+        """
+        True if an object failed on a lock timeout or deadlock in low impact
+        mode, so that it may succeed if deployed again later. A script is
+        never deployed again, as the batches before the one which failed
+        have already been run.
+        """
+        if (isinstance(error, ScriptError) and
+                os.path.basename(os.path.dirname(error.label)) == 'scripts'):
+            return False
+        error = getattr(error, 'error', error)
+        return self.lock_timeout is not None and _error_number(error) in LOCK_ERRORS
 
     def sync_permission(self, path):
-        """Ignore."""
-        self.logger.warning('Ignoring "%s". U do it!', path)
+        """
+        Grants the permissions a permissions file declares which are missing,
+        and revokes those of the principals it names which it does not
+        declare, in a few round trips. Permission scripts, such as the one
+        setup writes, are left to be run by hand.
+        """
+        self._deploy_permissions(read_unit(self, path, render=False))
+
+    def _deploy_permissions(self, unit):
+        """
+        Brings the permissions of a unit in line, as sync_permission
+        describes.
+        """
+        if not is_permissions_file(unit.path):
+            self.logger.warning('Not running "%s", permission scripts are run by hand',
+                                unit.path)
+            return
+        declared = unit.definition
+        if declared is None:
+            with self._timed('parse'):
+                declared = yaml.safe_load(unit.source)
+        declared = parse_permissions(declared, self.schema)
+        if not declared:
+            return
+        declared = merge_permissions(declared, [
+            parse_permissions(data, self.schema)
+            for data in self._other_permission_files(unit.path)])
+        # the catalog must reflect any permissions which are still queued
+        self.flush()
+        rows = self.fetch_permissions(declared)
+        with self._timed('generate'):
+            grants, revokes = diff_permissions(declared, rows)
+        if not grants and not revokes:
+            self.logger.info('Permissions unchanged: %s', unit.path)
+            return
+        batches = permission_batches(grants, revokes)
+        for i, sql in enumerate(batches):
+            message = 'Synced permissions: %s (%d granted, %d revoked)' % (
+                unit.path, len(grants), len(revokes))
+            if len(batches) > 1:
+                message += ', batch %d of %d' % (i + 1, len(batches))
+            self._apply(unit.path, None, sql, message, module=False)
+
+    def _other_permission_files(self, path):
+        """
+        Returns the parsed yaml of every permissions file but the one at
+        path, from permission_files if it was given, or else from the
+        folder of path.
+        """
+        files = self.permission_files
+        if files is None:
+            folder = os.path.dirname(path)
+            files = {}
+            for other in self.index.files(folder) if os.path.isdir(folder) else []:
+                if is_permissions_file(other):
+                    with open(other, 'rb') as stream:
+                        files[other] = yaml.safe_load(stream.read())
+        return [data for other, data in sorted(files.items())
+                if os.path.normpath(other) != os.path.normpath(path)]
+
+    def fetch_permissions(self, principals):
+        """
+        Returns the rows of PERMISSIONS_SQL for the named principals, in one
+        query.
+        """
+        self._reset_db()
+        return self._exec(PERMISSIONS_SQL % {
+            'principals': ', '.join(_quote(p) for p in sorted(principals))}) or []
+
+    def _load_manifest(self, manifest):
+        """
+        Replaces the local manifest cache with the entries from the manifest
+        table on the server, creating the table if it does not exist yet.
+        """
+        table = self._schema_path(MANIFEST_TABLE)
+        self._reset_db()
+        self._exec(_create_manifest(table))
+        rows = self._exec(
+            'SELECT object_type, object_name, content_hash FROM %s;' % table)
+        manifest.replace(((row[0], row[1]), row[2]) for row in rows or [])
+
+    def _record(self, object_type, object_name, digest):
+        """
+        Records the deploy in the manifest table as well as the local cache.
+        When the object is still queued, the manifest update goes into the
+        same batch, and the local cache is only updated once it has been sent.
+        """
+        upsert_sql = _upsert_manifest(self._schema_path(MANIFEST_TABLE),
+                                      object_type, object_name, digest)
+        if self._pending:
+            pending = self._pending[-1]
+            used = USE_RE.findall(pending.sql)
+            if used and used[-1].lower() != self.db.lower():
+                # jobs are changed from msdb, and the manifest is in db
+                pending.sql += '\nUSE %s;' % self.db
+            pending.sql += '\n' + upsert_sql
+            pending.record = (object_type, object_name, digest)
+            return
+
+        super(PyMSSQLDeployer, self)._record(object_type, object_name, digest)
+        self._reset_db()
+        self._exec(upsert_sql, fetch=False)
 
     def test(self):
         """
@@ -123,17 +1001,53 @@ class PyMSSQLDeployer(BaseDeployer):
         """
         return '.'.join([self.schema, name])
 
-    def _exec(self, sql):
+    def _exec(self, sql, fetch=True, retry=None):
         """
-        Executes some sql, with a little logging.
+        Executes some sql, with a little logging. Pass fetch=False for
+        statements that return no rows.
+
+        In low impact mode, sql which fails on a lock timeout or deadlock is
+        sent again if retry is set. By default only sql which is undone in
+        full when it fails is: a module definition, or a batch wrapped in a
+        transaction with XACT_ABORT on. Any other batch may have committed
+        some of its statements, which would be run twice.
         """
+        if retry is None:
+            retry = _retryable(sql)
         self.logger.debug('Executing sql:\n\n%s...\n\n', sql[:280])
-        if self.conn is None:
+        if self._pooled is None:
             self.connect()
 
-        self.cursor.execute(sql)
+        pooled = self._pooled
+        database = pooled.database
+        retries = 0
+        while True:
+            start = default_timer()
+            try:
+                self._send(pooled, sql, database)
+                break
+            except pymssql.Error as error:
+                if (self.lock_timeout is None or not retry or
+                        retries >= self.lock_retries or
+                        _error_number(error) not in LOCK_ERRORS):
+                    raise
+                retries += 1
+                delay = self.retry_backoff * 2 ** (retries - 1) * random.uniform(0.5, 1.5)
+                self.logger.warning('%s, retrying in %.1fs (%d of %d)', error, delay,
+                                    retries, self.lock_retries)
+                time.sleep(delay)
+                self.report.add_retry(self._current, default_timer() - start)
+                if database is not None:
+                    self._send(pooled, 'USE %s;' % database, None)
+                    pooled.database = database
+
+        used = USE_RE.findall(sql)
+        if used:
+            pooled.database = used[-1]
+        if not fetch:
+            return None
         try:
-            rows = self.cursor.fetchall()
+            rows = pooled.cursor.fetchall()
         except pymssql.OperationalError:
             self.logger.debug('0 rows')
         else:
@@ -143,6 +1057,62 @@ class PyMSSQLDeployer(BaseDeployer):
             self.logger.debug('%d rows', i)
             return rows
 
+    def _send(self, pooled, sql, database):
+        """
+        Executes sql on a connection, first bringing its session settings in
+        line. If the connection has gone away, it is reopened, switched back
+        to database, and the sql is sent again.
+        """
+        self._prepare_session(pooled)
+        self.report.add_round_trip(self._current)
+        try:
+            pooled.cursor.execute(sql)
+        except pymssql.Error:
+            # an error part way through a batch leaves the context unknown
+            pooled.database = None
+            if self.pool.ping(pooled):
+                raise
+            # the connection went away, so reconnect and try again
+            self.pool.reconnect(pooled)
+            if database is not None and database != pooled.database:
+                pooled.cursor.execute('USE %s;' % database)
+                pooled.database = database
+            self._prepare_session(pooled)
+            self.report.add_round_trip(self._current)
+            pooled.cursor.execute(sql)
+
+    def _prepare_session(self, pooled):
+        """
+        Sends the session settings of low impact mode on a connection, or
+        puts back the defaults on one which another deployer left them on.
+        """
+        if pooled.session != self._session_sql:
+            self.report.add_round_trip(self._current)
+            pooled.cursor.execute(self._session_sql or DEFAULT_SESSION_SQL)
+            pooled.session = self._session_sql
+
+class _Pending(object):
+    """
+    An object queued for the next batch.
+    """
+    __slots__ = ('label', 'sql', 'message', 'record', 'key')
+
+    def __init__(self, label, sql, message, key=None):
+        self.label = label
+        self.sql = sql
+        self.message = message
+        self.record = None
+        # the (object type, object name) the timings are reported under
+        self.key = key
+
+    def done(self, deployer):
+        """
+        Logs the deploy, and records it in the local manifest cache.
+        """
+        deployer.logger.info(self.message)
+        if self.record is not None:
+            BaseDeployer._record(deployer, *self.record)
+
 def _if_drop(schema_dot_obj, object_type='VIEW'):
     """
     Generates sql to check for object and drop if it exists.
@@ -155,19 +1125,122 @@ def _if_drop(schema_dot_obj, object_type='VIEW'):
     DROP %(object_type)s %(schema_dot_obj)s;"""
     return sql % args
 
+def _transaction(statements):
+    """
+    Wraps statements in a transaction which is rolled back if any fail.
+    """
+    return 'SET XACT_ABORT ON;\nBEGIN TRANSACTION;\n\n%s\nCOMMIT TRANSACTION;' % (
+        '\n'.join(statements))
+
+def _msdb_batch(statements):
+    """
+    Wraps the statements changing a job in a transaction in msdb.
+    """
+    return 'USE msdb;\n' + _transaction(statements)
+
+def _if_drop_job(job_name):
+    """
+    Generates sql to check for a job and delete it if it exists.
+    """
+    return """DECLARE @job_id binary(16);
+        SELECT @job_id = job_id FROM msdb.dbo.sysjobs WHERE name = '%s'
+        IF (@job_id IS NOT NULL)
+        BEGIN
+            EXEC msdb.dbo.sp_delete_job @job_id
+        END""" % job_name
+
+def _version_tuple(version):
+    """
+    Returns a version string like '13.0.4001.0' as a tuple of ints.
+    """
+    return tuple(int(part) for part in version.split('.') if part.isdigit())
+
+def _self_contained(sql):
+    """
+    True if a batch cannot change its session, and so can be run with
+    sp_executesql. A module definition is always self contained.
+    """
+    return rewrite_create(sql, '') is not None or not SESSION_RE.search(sql)
+
+def _retryable(sql):
+    """
+    True if sql can be sent again after it failed on a lock, without running
+    any of it twice: a single module definition, which must be alone in its
+    batch, or a batch wrapped in a transaction.
+    """
+    return rewrite_create(sql, '') is not None or TRANSACTION_RE.match(sql) is not None
+
+def _error_number(error):
+    """
+    Returns the server's number for a pymssql error, or None if it has none.
+    """
+    args = getattr(error, 'args', ())
+    if args and isinstance(args[0], int):
+        return args[0]
+    return None
+
+def _quote(value):
+    """
+    Returns value as a quoted T-SQL unicode literal.
+    """
+    return "N'%s'" % value.replace("'", "''")
+
+def _create_manifest(table):
+    """
+    Generates sql to create the manifest table if it does not exist.
+    """
+    return """IF OBJECT_ID ('%s') IS NULL
+        CREATE TABLE %s (
+            object_type varchar(32) NOT NULL,
+            object_name nvarchar(256) NOT NULL,
+            content_hash char(40) NOT NULL,
+            deployed_at datetime NOT NULL DEFAULT GETDATE(),
+            PRIMARY KEY (object_type, object_name)
+        );""" % (table, table)
+
+def _upsert_manifest(table, object_type, object_name, digest):
+    """
+    Generates sql to insert or update a row of the manifest table.
+    """
+    args = {
+        'table': table,
+        'object_type': _quote(object_type),
+        'object_name': _quote(object_name),
+        'digest': _quote(digest),
+    }
+    sql = """UPDATE %(table)s
+    SET content_hash = %(digest)s, deployed_at = GETDATE()
+    WHERE object_type = %(object_type)s AND object_name = %(object_name)s;
+    IF @@ROWCOUNT = 0
+        INSERT INTO %(table)s (object_type, object_name, content_hash)
+        VALUES (%(object_type)s, %(object_name)s, %(digest)s);"""
+    return sql % args
+
+def load_job(path):
+    """
+    Reads a job definition from a yaml file.
+    """
+    with open(path, 'rb') as stream:
+        return yaml.safe_load(stream)
+
 def read_job(job):
     """
     Parses a job object.
     """
     sql = 'USE msdb;\n\n'
 
-    job_template = """EXEC sp_add_job
-    @job_name = %s,
-    @notify_level_email = 3,
-    @notify_email_operator_name = N'Dan Cohen',
-    @notify_level_eventlog = 0
-    ;\n\n"""
+    job_name, calls = read_job_params(job)
+    sql += build_exec_wparams(
+        'sp_add_job', OrderedDict([('job_name', job_name)] + list(JOB_SETTINGS.items())))
+    for _, _, call_sql in calls:
+        sql += call_sql
+    return job_name, sql
 
+def read_job_params(job):
+    """
+    Parses a job object into the job name, and a list of the label, params
+    and sql of each call needed to build it, with defaults applied.
+    """
     formatters = OrderedDict([
         ('steps', format_step),
         ('schedules', format_sched),
@@ -179,7 +1252,7 @@ def read_job(job):
     assert len(job) == 1
 
     for job_name, settings in job.items():
-        sql += job_template % job_name
+        calls = []
 
         if 'servers' not in settings.keys():
             settings['servers'] = [{'job_name': job_name}]
@@ -214,9 +1287,119 @@ def read_job(job):
                 defaults.update(attrs)
 
                 defaults['job_name'] = job_name
-                sql += method(defaults)
+                # the formatters fill in defaults on the params they are given
+                calls.append((label, defaults, method(defaults)))
+
+        return job_name, calls
+
+def normalize_value(value):
+    """
+    Returns a job parameter or msdb column as a comparable string, dropping
+    any N'' quoting and leading zeros.
+    """
+    value = str(value).strip()
+    if value.startswith("N'") and value.endswith("'"):
+        value = value[2:-1].replace("''", "'")
+    elif len(value) > 1 and value[0] == value[-1] == "'":
+        value = value[1:-1].replace("''", "'")
+    if value.isdigit():
+        value = str(int(value))
+    return value
+
+def _changed(params, row, columns, ignore=()):
+    """
+    Returns the (column, value) of each of the columns set in params which
+    differs from the msdb row.
+    """
+    return [(column, params[column]) for column in columns
+            if column in params and column not in ignore and
+            normalize_value(params[column]) != normalize_value(row.get(column))]
 
-        return job_name, sql
+def _exec_call(executable, *params):
+    """
+    Returns an EXEC of an msdb procedure with the given (name, value) params.
+    """
+    return build_exec_wparams(executable, OrderedDict(params))
+
+def diff_job(job, current):
+    """
+    Returns the msdb calls needed to bring a job as returned by fetch_jobs in
+    line with its definition, or an empty list if it already matches. Steps
+    are matched by position, and schedules and servers by name. Parts of the
+    current job which were not fetched are not compared, and alerts are only
+    added along with a new job.
+    """
+    # the start date defaults to today, so it only counts when it is set
+    dated = set(normalize_value(s['name'])
+                for s in list(job.values())[0].get('schedules', [])
+                if 'active_start_date' in s and 'name' in s)
+    job_name, calls = read_job_params(job)
+    by_label = dict((label, [(params, call_sql) for kind, params, call_sql in calls
+                             if kind == label])
+                    for label in ('steps', 'schedules', 'servers'))
+    sql = []
+
+    if current.get('settings') is not None:
+        changed = _changed(JOB_SETTINGS, current['settings'], JOB_SETTINGS)
+        if changed:
+            sql.append(_exec_call('sp_update_job', ('job_name', job_name), *changed))
+
+    # steps are removed from the end first, so the others keep their ids
+    steps, rows = by_label['steps'], current['steps']
+    for step_id in range(len(rows), len(steps), -1):
+        sql.append(_exec_call('sp_delete_jobstep', ('job_name', job_name),
+                              ('step_id', step_id)))
+    for i, ((params, _), row) in enumerate(zip(steps, rows)):
+        changed = _changed(params, row, JOB_STEP_COLUMNS)
+        if changed:
+            sql.append(_exec_call('sp_update_jobstep', ('job_name', job_name),
+                                  ('step_id', i + 1), *changed))
+    sql.extend(call_sql for _, call_sql in steps[len(rows):])
+
+    rows = dict((normalize_value(row['name']), row) for row in current['schedules'])
+    for params, call_sql in by_label['schedules']:
+        name = normalize_value(params['name'])
+        row = rows.pop(name, None)
+        if row is None:
+            sql.append(call_sql)
+            continue
+        ignore = () if name in dated else ('active_start_date',)
+        changed = _changed(params, row, JOB_SCHEDULE_COLUMNS, ignore)
+        if not changed:
+            continue
+        if row.get('job_count', 1) > 1:
+            # the schedule is shared with other jobs, so this job gets its own
+            sql.append(_detach_schedule(job_name, row, delete_unused=0))
+            sql.append(call_sql)
+        elif row.get('schedule_id') is not None:
+            sql.append(_exec_call('sp_update_schedule',
+                                  ('schedule_id', row['schedule_id']), *changed))
+        else:
+            sql.append(_exec_call('sp_update_schedule', ('name', _quote(name)), *changed))
+    for row in rows.values():
+        sql.append(_detach_schedule(job_name, row, delete_unused=1))
+
+    if current.get('servers') is not None:
+        wanted = OrderedDict((normalize_value(params.get('server_name', '(local)')),
+                              call_sql) for params, call_sql in by_label['servers'])
+        existing = set(normalize_value(row['server_name']) for row in current['servers'])
+        for name in sorted(existing - set(wanted)):
+            sql.append(_exec_call('sp_delete_jobserver', ('job_name', job_name),
+                                  ('server_name', _quote(name))))
+        sql.extend(call_sql for name, call_sql in wanted.items() if name not in existing)
+
+    return sql
+
+def _detach_schedule(job_name, row, delete_unused):
+    """
+    Returns the call to detach a schedule from a job.
+    """
+    if row.get('schedule_id') is not None:
+        key = ('schedule_id', row['schedule_id'])
+    else:
+        key = ('schedule_name', _quote(normalize_value(row['name'])))
+    return _exec_call('sp_detach_schedule', ('job_name', job_name), key,
+                      ('delete_unused_schedule', delete_unused))
 
 def format_step(step):
     """
@@ -249,7 +1432,7 @@ def format_sched(schedule):
         'active_start_time': '0700'
     }
     validators = {
-        'active_start_date': lambda x: parse(x).strftime('%Y%m%d'),
+        'active_start_date': _format_date,
         'freq_type': lambda x: constants.FREQUENCY_TYPES[x],
         'freq_interval': format_freq_interval
     }
@@ -258,6 +1441,14 @@ def format_sched(schedule):
                               defaults=defaults,
                               validators=validators)
 
+def _format_date(value):
+    """
+    Returns a date in any format dateutil understands as YYYYMMDD. dateutil
+    is slow to import, and only needed for schedules, so it is imported here.
+    """
+    from dateutil.parser import parse
+    return parse(value).strftime('%Y%m%d')
+
 def format_alert(alert):
     """
     Returns a SQL formatted create alert command.
@@ -0,0 +1,294 @@
+"""
+Deploys files in dependency order, over a pool of workers which each have
+their own connection to the server.
+"""
+import logging
+import os
+import threading
+
+from .exc import BatchError
+from .index import ProjectIndex
+from .units import READ_WORKERS, UnitPipeline, dependency_names, find_dependencies
+
+try:
+    from queue import Queue
+except ImportError: # pragma: no cover
+    from Queue import Queue
+
+
+# the order in which folders are deployed for --all, also used to break ties
+DEPLOY_FOLDERS = ['tables', 'views', 'functions', 'stored_procedures', 'permissions',
+                  'scripts', 'jobs']
+
+
+def build_graph(paths):
+    """
+    Returns a dict of each path to the set of paths it depends on.
+    """
+    modules = dependency_names(paths)
+    graph = {}
+    for path in paths:
+        with open(path, 'r') as stream:
+            graph[path] = find_dependencies(path, stream.read(), modules)
+    return graph
+
+def topological_order(paths, graph=None):
+    """
+    Returns the paths ordered so that each comes after the paths it depends
+    on, keeping their given order where they are independent. Cycles are
+    broken at the first path in the cycle.
+    """
+    if graph is None:
+        graph = build_graph(paths)
+    order = dict((path, i) for i, path in enumerate(paths))
+    pending = dict((path, set(deps)) for path, deps in graph.items())
+    ordered = []
+    while pending:
+        ready = sorted((p for p, deps in pending.items() if not deps), key=order.get)
+        if not ready:
+            ready = [min(pending, key=order.get)]
+            logging.getLogger(__name__).warning(
+                'Dependency cycle involving %s: %s', ready[0],
+                ', '.join(sorted(pending[ready[0]])))
+        for path in ready:
+            del pending[path]
+        for deps in pending.values():
+            deps.difference_update(ready)
+        ordered.extend(ready)
+    return ordered
+
+def list_folders(folders, index=None):
+    """
+    Returns the files in each of the given folders, in folder order.
+    """
+    if index is None:
+        index = ProjectIndex()
+    paths = []
+    for folder in folders:
+        if os.path.isdir(folder):
+            paths.extend(index.files(folder))
+    return paths
+
+
+class DeployEngine(object):
+    """
+    Deploys a set of files topologically. Files are read into units by a
+    pipeline of readers, and each unit is deployed as soon as it and what it
+    depends on have been read. Independent objects are deployed concurrently
+    when there is more than one worker, and a failure only blocks the objects
+    that depend on the one which failed.
+
+    An object which fails on an error the deployer says is transient, such
+    as a lock timeout, is deployed once more after everything else which can
+    be, along with the objects which depend on it.
+    """
+    def __init__(self, deployer, workers=1, readers=READ_WORKERS):
+        self.deployer = deployer
+        self.workers = max(1, int(workers))
+        self.readers = readers
+        self.logger = logging.getLogger(__name__)
+        self.deployed = []
+        self.failed = {}
+        self.blocked = []
+        # the paths deployed again after a transient error
+        self.requeued = []
+        # the errors of dependent modules found invalid after the deploy
+        self.invalid = {}
+
+    @property
+    def ok(self):
+        """True if nothing failed, was blocked, or was found invalid."""
+        return not self.failed and not self.blocked and not self.invalid
+
+    def run(self, paths, read=None):
+        """
+        Deploys the paths, returning once every one has either been deployed,
+        failed or been blocked by a failed dependency. The files are read,
+        unless read gives the units already read from them, such as from a
+        bundle, keyed by path.
+        """
+        order = dict((path, i) for i, path in enumerate(paths))
+        dependents = dict((path, []) for path in order)
+        # the units read so far which are waiting on their dependencies
+        pending = {}
+        units = {}
+        succeeded = set()
+        # the paths which failed or were blocked, and so block their dependents
+        dead = set()
+        # the paths waiting to be deployed again once the rest are done
+        deferred = []
+
+        results = Queue()
+        tasks = Queue()
+        clones = []
+        ordered = sorted(order, key=order.get)
+        reader = UnitPipeline(self.deployer, ordered if read is None else [],
+                              lambda *read: results.put(('read', read)),
+                              workers=self.readers)
+        reader.start()
+        if read is not None:
+            for path in ordered:
+                results.put(('read', (path, read[path], None)))
+        threads = self._start(tasks, results, clones)
+        unread = len(order)
+        in_flight = 0
+
+        try:
+            while pending or in_flight or unread or deferred:
+                ready = sorted((p for p, deps in pending.items() if not deps),
+                               key=order.get)
+                if not ready and not in_flight and not unread and deferred:
+                    ready, deferred = deferred, []
+                    for path in ready:
+                        pending[path] = set()
+                if not ready and not in_flight and not unread:
+                    ready = [min(pending, key=order.get)]
+                    self.logger.warning(
+                        'Dependency cycle involving %s, deploying it anyway: %s',
+                        ready[0], ', '.join(sorted(pending[ready[0]])))
+
+                # ready paths do not depend on each other, so they can share
+                # a batch when the deployer queues its work
+                size = self.deployer.batch_size or 1
+                for i in range(0, len(ready), size):
+                    group = [units[path] for path in ready[i:i + size]]
+                    for unit in group:
+                        del pending[unit.path]
+                    in_flight += 1
+                    if threads:
+                        tasks.put(group)
+                    else:
+                        results.put(('deployed', self._deploy(self.deployer, group)))
+
+                kind, result = results.get()
+                if kind == 'read':
+                    unread -= 1
+                    path, unit, error = result
+                    if unit is not None:
+                        for dep in unit.dependencies:
+                            dependents[dep].append(path)
+                    if error is not None:
+                        self.failed[path] = error
+                    elif unit.dependencies & dead:
+                        self.blocked.append(path)
+                        self.logger.warning('Skipping %s, which depends on %s', path,
+                                            ', '.join(sorted(unit.dependencies & dead)))
+                    else:
+                        units[path] = unit
+                        pending[path] = set(unit.dependencies) - succeeded
+                        continue
+                    dead.add(path)
+                    self._block(path, dependents, pending, dead)
+                    continue
+
+                in_flight -= 1
+                for path, error in result:
+                    if (error is not None and path not in self.requeued and
+                            self.deployer.is_transient(error)):
+                        self.logger.warning('Deploying %s again at the end: %s',
+                                            path, error)
+                        self.requeued.append(path)
+                        deferred.append(path)
+                        continue
+                    units.pop(path)
+                    if error is None:
+                        self.deployed.append(path)
+                        succeeded.add(path)
+                        for dependent in dependents[path]:
+                            if dependent in pending:
+                                pending[dependent].discard(path)
+                    else:
+                        self.failed[path] = error
+                        dead.add(path)
+                        self._block(path, dependents, pending, dead)
+        finally:
+            reader.stop()
+            for _ in threads:
+                tasks.put(None)
+            for thread in threads:
+                thread.join()
+            for clone in clones:
+                self.deployer.merge_counts(clone)
+
+        if not self.ok:
+            self.logger.error('%d failed, %d blocked by a failed dependency',
+                              len(self.failed), len(self.blocked))
+        return self
+
+    def _start(self, tasks, results, clones):
+        """
+        Starts the worker threads, if there is more than one worker.
+        """
+        if self.workers == 1:
+            return []
+
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      args=(tasks, results, clones),
+                                      name='deploy-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _work(self, tasks, results, clones):
+        """
+        Deploys units from the task queue, with a cloned deployer, until told
+        to stop.
+        """
+        deployer = self.deployer.clone()
+        clones.append(deployer)
+        try:
+            while True:
+                group = tasks.get()
+                if group is None:
+                    break
+                results.put(('deployed', self._deploy(deployer, group)))
+        finally:
+            deployer.close()
+
+    def _deploy(self, deployer, group):
+        """
+        Deploys a group of units, then sends anything the deployer queued.
+        Returns a list of each path and its error, if it had one.
+        """
+        paths = [unit.path for unit in group]
+        errors = {}
+        for unit in group:
+            path = unit.path
+            try:
+                deployer.sync_unit(unit)
+            except Exception as error: # pylint: disable=broad-except
+                self.logger.exception('Failed to deploy: %s', path)
+                errors[path] = error
+
+        try:
+            deployer.flush()
+        except BatchError as error:
+            for path in paths:
+                if path in error.errors:
+                    errors[path] = error.errors[path]
+                    self.logger.error('Failed to deploy: %s\n%s', path, errors[path])
+        except Exception as error: # pylint: disable=broad-except
+            self.logger.exception('Failed to deploy: %s', ', '.join(paths))
+            for path in paths:
+                errors.setdefault(path, error)
+
+        return [(path, errors.get(path)) for path in paths]
+
+    def _block(self, path, dependents, pending, dead):
+        """
+        Removes everything downstream of a failed path from the pending set,
+        adding it to the dead set.
+        """
+        stack = list(dependents[path])
+        while stack:
+            dependent = stack.pop()
+            if dependent in pending:
+                del pending[dependent]
+                dead.add(dependent)
+                self.blocked.append(dependent)
+                self.logger.warning('Skipping %s, which depends on %s',
+                                    dependent, path)
+                stack.extend(dependents[dependent])
@@ -7,3 +7,57 @@ class DeployableSQLError(Exception):
 class IllegalPathError(DeployableSQLError):
     """To be raised when a file path is invalid."""
     pass
+
+class GitError(DeployableSQLError):
+    """To be raised when a git command fails."""
+    pass
+
+class BatchError(DeployableSQLError):
+    """
+    To be raised when objects in a batch fail, with the errors keyed by the
+    label of each failed object.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super(BatchError, self).__init__(
+            '%d objects failed: %s' % (len(errors), ', '.join(sorted(errors))))
+
+class TableDefinitionError(DeployableSQLError):
+    """To be raised when a table definition cannot be read."""
+    pass
+
+class TableChangeError(DeployableSQLError):
+    """
+    To be raised when a table needs changes which have not been allowed,
+    with the changes which were refused.
+    """
+    def __init__(self, table, changes):
+        self.table = table
+        self.changes = changes
+        super(TableChangeError, self).__init__(
+            'Not changing %s, which needs: %s' % (table, '; '.join(
+                '%s (%s)' % (c.description, c.impact) for c in changes)))
+
+class RebuildError(DeployableSQLError):
+    """To be raised when a table cannot be rebuilt."""
+    pass
+
+class ScriptError(DeployableSQLError):
+    """
+    To be raised when a batch of a GO separated script fails, with the
+    number of the batch, and the line of the file it starts on.
+    """
+    def __init__(self, label, batch, line, error):
+        self.label = label
+        self.batch = batch
+        self.line = line
+        self.error = error
+        super(ScriptError, self).__init__(
+            '%s: batch %d, from line %d: %s' % (label, batch, line, error))
+
+class PermissionDefinitionError(DeployableSQLError):
+    """
+    To be raised when a permissions file cannot be read, or grants to
+    principals which do not exist.
+    """
+    pass
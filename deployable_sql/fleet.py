@@ -0,0 +1,238 @@
+"""
+Deploys the same project to many hosts and databases concurrently.
+
+Targets are listed in a yaml file, which refers to credentials by name rather
+than holding them:
+
+    --- # targets.yml
+    defaults:
+      schema: dbo
+      credentials: prod
+    targets:
+      - host: sql01
+        db: tenant_a
+      - host: sql01
+        db: tenant_b
+      - host: sql02
+        db: tenant_c
+        credentials: other
+
+Credentials are looked up under `credentials` in ~/.deploy_sql.yml, then in
+DEPLOYABLE_<NAME>_USR and DEPLOYABLE_<NAME>_PWD environment variables.
+"""
+from collections import namedtuple
+import logging
+import os
+import re
+import threading
+import time
+
+import pymssql
+import yaml
+
+from .deployers.pool import ConnectionPool
+from .exc import DeployableSQLError
+
+
+CONFIG_PATH = os.path.expanduser('~/.deploy_sql.yml')
+
+Target = namedtuple('Target', ['host', 'db', 'schema', 'credentials'])
+TargetResult = namedtuple('TargetResult', ['target', 'ok', 'seconds', 'detail'])
+
+
+def load_targets(path):
+    """
+    Returns the list of targets in a targets file.
+    """
+    with open(path, 'rb') as stream:
+        content = yaml.safe_load(stream) or {}
+
+    defaults = {'schema': 'dbo', 'credentials': 'default'}
+    defaults.update(content.get('defaults') or {})
+
+    targets = []
+    for entry in content.get('targets') or []:
+        settings = dict(defaults)
+        settings.update(entry)
+        missing = [key for key in ('host', 'db') if not settings.get(key)]
+        if missing:
+            raise DeployableSQLError('Target %r is missing %s' % (entry, ', '.join(missing)))
+        targets.append(Target(settings['host'], settings['db'],
+                              settings['schema'], settings['credentials']))
+    return targets
+
+def resolve_credentials(name, config=None):
+    """
+    Returns the user and password for a named set of credentials, checking
+    the config file first, then environment variables. The name "default"
+    falls back to the usual usr and pwd settings.
+    """
+    if config is None:
+        config = _read_config()
+
+    found = (config.get('credentials') or {}).get(name) or {}
+    prefix = 'DEPLOYABLE_%s_' % re.sub(r'\W', '_', name).upper()
+    usr = found.get('usr', os.getenv(prefix + 'USR'))
+    pwd = found.get('pwd', os.getenv(prefix + 'PWD'))
+
+    if name == 'default':
+        usr = usr or config.get('usr', os.getenv('DEPLOYABLE_USR'))
+        pwd = pwd or config.get('pwd', os.getenv('DEPLOYABLE_PWD'))
+
+    if not usr or not pwd:
+        raise DeployableSQLError('No credentials found for "%s"' % name)
+    return usr, pwd
+
+def _read_config():
+    """
+    Returns the content of the config file, or an empty dict.
+    """
+    if not os.path.exists(CONFIG_PATH):
+        return {}
+    with open(CONFIG_PATH, 'rb') as stream:
+        return yaml.safe_load(stream) or {}
+
+
+class FleetRunner(object):
+    """
+    Runs a deploy against each target, with up to concurrency targets at once
+    and no more than per_host of them on the same host.
+
+    Targets on the same host with the same credentials share a connection
+    pool, and switch databases on a pooled connection rather than opening a
+    new one.
+
+    make_deployer is called with (usr, pwd, host, db, schema, pool), and
+    deploy with the deployer, returning True if the deploy succeeded.
+    """
+    def __init__(self, targets, make_deployer, deploy, concurrency=8,
+                 per_host=2, connect=None, config=None):
+        self.targets = targets
+        self.make_deployer = make_deployer
+        self.deploy = deploy
+        self.concurrency = max(1, int(concurrency))
+        self.per_host = max(1, int(per_host))
+        self.connect = connect
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._remaining = []
+        self._active = {}
+
+    def run(self):
+        """
+        Deploys to every target, and returns a TargetResult for each, in the
+        order of the targets.
+        """
+        self._remaining = list(self.targets)
+        results = {}
+        threads = []
+        for i in range(min(self.concurrency, len(self.targets))):
+            thread = threading.Thread(target=self._work, args=(results,),
+                                      name='fleet-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+        for pool in self._pools.values():
+            pool.close()
+
+        return [results[target] for target in self.targets]
+
+    def _work(self, results):
+        """
+        Deploys targets until there are none left.
+        """
+        while True:
+            target = self._next()
+            if target is None:
+                break
+            try:
+                results[target] = self._deploy(target)
+            finally:
+                with self._cond:
+                    self._active[target.host] -= 1
+                    self._cond.notify_all()
+
+    def _next(self):
+        """
+        Takes the first remaining target whose host is below its concurrency
+        cap, waiting for one if need be. Returns None when none are left.
+        """
+        with self._cond:
+            while self._remaining:
+                for i, target in enumerate(self._remaining):
+                    if self._active.get(target.host, 0) < self.per_host:
+                        self._active[target.host] = self._active.get(target.host, 0) + 1
+                        return self._remaining.pop(i)
+                self._cond.wait()
+        return None
+
+    def _deploy(self, target):
+        """
+        Deploys to a single target, timing it and catching any error.
+        """
+        label = '%s/%s' % (target.host, target.db)
+        start = time.time()
+        deployer = None
+        try:
+            usr, pwd = resolve_credentials(target.credentials, self.config)
+            pool = self._pool(target, usr, pwd)
+            deployer = self.make_deployer(usr, pwd, target.host, target.db,
+                                          target.schema, pool)
+            ok = self.deploy(deployer)
+            detail = deployer.summary()
+        except Exception as error: # pylint: disable=broad-except
+            self.logger.exception('Deploy to %s failed', label)
+            ok, detail = False, str(error)
+        finally:
+            if deployer is not None:
+                try:
+                    deployer.close()
+                except Exception: # pylint: disable=broad-except
+                    self.logger.exception('Closing %s failed', label)
+                    ok = False
+        seconds = time.time() - start
+        self.logger.info('%s %s in %.1fs', label, 'succeeded' if ok else 'failed', seconds)
+        return TargetResult(target, ok, seconds, detail)
+
+    def _pool(self, target, usr, pwd):
+        """
+        Returns the connection pool shared by targets on the same host with
+        the same credentials.
+        """
+        key = (target.host, usr)
+        with self._lock:
+            if key not in self._pools:
+                connect = self.connect or _connect
+                self._pools[key] = ConnectionPool(
+                    lambda: connect(target.host, usr, pwd, target.db),
+                    target.db, max_size=self.per_host)
+            return self._pools[key]
+
+
+def _connect(host, usr, pwd, db):
+    """
+    Opens a pymssql connection.
+    """
+    return pymssql.connect(host, usr, pwd, db)
+
+def format_report(results):
+    """
+    Returns a table of the results of a fleet deploy, with totals.
+    """
+    lines = []
+    for result in results:
+        lines.append('%-4s %-40s %8.1fs  %s' % (
+            'ok' if result.ok else 'FAIL',
+            '%s/%s' % (result.target.host, result.target.db),
+            result.seconds, result.detail))
+    failed = len([r for r in results if not r.ok])
+    lines.append('%d targets, %d succeeded, %d failed, %.1fs total deploy time' % (
+        len(results), len(results) - failed, failed,
+        sum(r.seconds for r in results)))
+    return '\n'.join(lines)
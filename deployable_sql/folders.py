@@ -5,13 +5,15 @@ import os
 from subprocess import call
 from datetime import datetime
 
-import yaml
-
 
 FOLDERS = [
-    'views', 'tables', 'functions', 'stored_procedures', 'permissions', 'jobs'
+    'views', 'tables', 'functions', 'stored_procedures', 'permissions', 'jobs',
+    'scripts'
 ]
 
+# the folders of modules, which other objects can depend on
+MODULE_FOLDERS = ['views', 'functions', 'stored_procedures']
+
 FILES = [os.path.join('permissions', 'grant_deployable.sql')]
 
 GRANTS = """
@@ -53,6 +55,9 @@ def create_job(jobname, recurrence='weekly'):
     """
     Creates a basic job from template.
     """
+    # imported here, so that setup does not have to load it
+    import yaml
+
     schedules = {
         'weekly': {
             'freq_type': 'weekly',
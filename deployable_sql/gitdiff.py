@@ -0,0 +1,111 @@
+"""
+Works out which objects to deploy, and which to drop, from the files changed
+in a range of git commits.
+"""
+from collections import namedtuple
+import logging
+import os
+import subprocess
+
+from .engine import DEPLOY_FOLDERS
+from .exc import GitError
+
+
+logger = logging.getLogger(__name__)
+
+Changes = namedtuple('Changes', ['deploy', 'delete'])
+
+
+def git(*args):
+    """
+    Runs a git command in the current directory, and returns its output.
+    """
+    try:
+        return subprocess.check_output(('git',) + args, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError) as error:
+        output = getattr(error, 'output', b'') or b''
+        raise GitError('git %s failed: %s' % (
+            ' '.join(args), output.decode('utf-8', 'replace').strip() or error))
+
+def git_changes(since=None, rev_range=None, folders=None):
+    """
+    Returns the files to deploy, and the files which were deleted along with
+    their last content, for the changes since a ref (including uncommitted
+    changes), or for a range like a..b.
+
+    A deleted file which defines the same object as a file to deploy, as
+    when a file is renamed to another folder for its type, or only in case,
+    is not dropped, as that would drop the object the deploy creates.
+    """
+    folders = DEPLOY_FOLDERS if folders is None else folders
+    if rev_range is not None:
+        old, _, new = rev_range.partition('..')
+        if not old or not new:
+            raise GitError('Expected a range like a..b, got "%s"' % rev_range)
+        revs = [old, new]
+        if git('rev-parse', new) != git('rev-parse', 'HEAD'):
+            logger.warning('%s is not checked out, so files will be deployed '
+                           'as they are in the working tree', new)
+    else:
+        old = since
+        revs = [since]
+
+    output = git('diff', '--name-status', '-z', '-M', '--relative',
+                 *(revs + ['--'] + folders))
+    fields = output.decode('utf-8').split('\0')
+
+    deploy, delete = [], []
+    i = 0
+    while i < len(fields) - 1:
+        status = fields[i]
+        if status[0] in 'RC':
+            src, dst = fields[i + 1], fields[i + 2]
+            i += 3
+        else:
+            src = dst = fields[i + 1]
+            i += 2
+
+        if status[0] in 'DR':
+            delete.append((src, _show(old, src)))
+        if status[0] != 'D':
+            deploy.append(dst)
+
+    if delete:
+        deployed = set(_object_key(path) for path in deploy)
+        kept = [(path, source) for path, source in delete
+                if _object_key(path, source) in deployed]
+        for path, _ in kept:
+            logger.info('Not dropping %s, as its object is deployed from '
+                        'another file', path)
+        delete = [change for change in delete if change not in kept]
+
+    logger.info('%d files to deploy, %d to drop', len(deploy), len(delete))
+    return Changes(deploy, delete)
+
+def _object_key(path, source=None):
+    """
+    Returns the type and lowercased name of the object a file defines, given
+    its content if it is no longer on disk. Jobs are named by their content.
+    """
+    folder = os.path.basename(os.path.dirname(path))
+    object_type = 'stored_procedures' if folder == 'sps' else folder
+    if object_type == 'jobs':
+        import yaml
+
+        if source is None:
+            with open(path, 'rb') as stream:
+                source = stream.read()
+        try:
+            job = yaml.safe_load(source)
+        except yaml.YAMLError:
+            job = None
+        if isinstance(job, dict) and len(job) == 1:
+            return object_type, str(list(job)[0]).lower()
+    return object_type, os.path.splitext(os.path.basename(path))[0].lower()
+
+def _show(rev, path):
+    """
+    Returns the content of a file at a revision.
+    """
+    path = './' + path.replace(os.path.sep, '/')
+    return git('show', '%s:%s' % (rev, path)).decode('utf-8')
@@ -0,0 +1,106 @@
+"""
+An index of the files in the project's object folders, so that files can be
+found by name without walking the whole working tree.
+
+The index is persisted along with the mtime of each folder, and a folder is
+only listed again once its mtime has changed.
+"""
+import json
+import logging
+import os
+
+from .atomic import atomic_write
+from .folders import FOLDERS
+
+
+INDEX_PATH = '.deploy_sql_index.json'
+
+
+class ProjectIndex(object):
+    """
+    Maps filenames and object names to the files in the object folders.
+    """
+    def __init__(self, root='.', folders=None, path=None):
+        self.root = root
+        self.folders = FOLDERS if folders is None else folders
+        self.path = os.path.join(root, INDEX_PATH) if path is None else path
+        self.logger = logging.getLogger(__name__)
+        self._listings = self._read_file()
+        self._by_name = None
+
+    def refresh(self):
+        """
+        Lists any folder which has changed since it was last indexed, and
+        saves the index if anything did.
+        """
+        changed = False
+        for folder in self.folders:
+            full_path = os.path.join(self.root, folder)
+            try:
+                mtime = os.stat(full_path).st_mtime
+            except OSError:
+                mtime = None
+
+            listing = self._listings.get(folder)
+            if listing is not None and listing['mtime'] == mtime:
+                continue
+
+            files = sorted(os.listdir(full_path)) if mtime is not None else []
+            self._listings[folder] = {'mtime': mtime, 'files': files}
+            changed = True
+
+        if changed or self._by_name is None:
+            self._by_name = {}
+            for folder in self.folders:
+                for filename in self._listings[folder]['files']:
+                    path = os.path.join(folder, filename)
+                    basename = os.path.splitext(filename)[0]
+                    for key in set([filename, basename]):
+                        self._by_name.setdefault(key, []).append(path)
+        if changed:
+            self.save()
+        return self
+
+    def lookup(self, name):
+        """
+        Returns every path, relative to the root, which has the given filename
+        or object name.
+        """
+        self.refresh()
+        return list(self._by_name.get(name, []))
+
+    def files(self, folder):
+        """
+        Returns the paths of the files in a folder. Folders which are not
+        indexed are listed directly.
+        """
+        relative = os.path.relpath(folder, self.root)
+        if relative not in self.folders:
+            return [os.path.join(folder, f) for f in sorted(os.listdir(folder))]
+
+        self.refresh()
+        return [os.path.join(folder, f) for f in self._listings[relative]['files']]
+
+    def save(self):
+        """
+        Writes the index to disk, replacing the old one only once it is
+        complete.
+        """
+        try:
+            with atomic_write(self.path) as stream:
+                json.dump(self._listings, stream, indent=1, sort_keys=True)
+        except (IOError, OSError):
+            self.logger.warning('Could not save the project index: %s', self.path)
+
+    def _read_file(self):
+        """
+        Returns the saved folder listings, or an empty dict.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as stream:
+                return json.load(stream)
+        except ValueError:
+            self.logger.warning('Ignoring unreadable index: %s', self.path)
+            return {}
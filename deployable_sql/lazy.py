@@ -0,0 +1,19 @@
+"""
+Exports names from modules which are slow to import, importing each module
+only when one of its names is first used.
+"""
+import importlib
+
+
+def lazy_exports(module_name, exports):
+    """
+    Returns a module level __getattr__ for the module module_name, which
+    imports the module behind each name in exports, a dict of names to the
+    modules they live in, on first use.
+    """
+    def __getattr__(name):
+        """Imports the module behind a lazy export on first use."""
+        if name in exports:
+            return getattr(importlib.import_module(exports[name]), name)
+        raise AttributeError('module %r has no attribute %r' % (module_name, name))
+    return __getattr__
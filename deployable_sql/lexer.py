@@ -0,0 +1,269 @@
+"""
+A single pass T-SQL lexer, which knows where comments, strings and quoted
+names start and end, so that rewriting sql never touches what is inside
+them. The transforms built on it, such as dropping a view's ORDER BY or
+splitting a script at GO, take time linear in the length of the sql.
+"""
+from collections import namedtuple
+import re
+
+
+COMMENT = 'comment'
+STRING = 'string'
+NAME = 'name'
+SYMBOL = 'symbol'
+
+# what is stepped over without looking inside, where unterminated strings,
+# names and comments run to the end of the sql
+LITERALS = r"""
+    (?P<string>N?'[^']*(?:''[^']*)*'?)
+  | (?P<quoted>\[[^\]]*(?:\]\][^\]]*)*\]?|"[^"]*(?:""[^"]*)*"?)
+  | (?P<comment>--[^\n]*)
+  | (?P<block>/\*)
+"""
+
+# whitespace separates tokens, and is not one itself
+TOKEN_RE = re.compile(LITERALS + r"""
+  | (?P<name>[\w@#$]+)
+  | (?P<symbol>\S)
+""", re.S | re.X | re.I)
+
+# GO on a line of its own, with an optional count and comment, is all that
+# splitting a script looks for, so the text between is skipped in bulk
+GO_RE = re.compile(LITERALS + r"""
+  | ^(?P<go>[ \t]*GO)\b[ \t]*(?P<count>\d*)[ \t]*(?:--[^\n]*)?(?:\n|\Z)
+""", re.S | re.X | re.M | re.I)
+
+# the keywords and symbols which decide what ORDER BY clauses a view has
+ORDER_RE = re.compile(LITERALS + r"""
+  | (?P<name>\b(?:TOP|ORDER|BY|OFFSET|FOR|OPTION)\b)
+  | (?P<symbol>[();])
+""", re.S | re.X | re.I)
+
+LITERAL_RE = re.compile(LITERALS, re.S | re.X | re.I)
+WORD_RE = re.compile(r'[\w@#$]+')
+
+# block comments nest in T-SQL
+BLOCK_RE = re.compile(r'/\*|\*/')
+
+# token kinds for the groups of the patterns which are not kinds themselves
+KINDS = {'quoted': NAME, 'block': COMMENT}
+
+# keywords after an ORDER BY which need it to stay
+ORDER_KEEPERS = ['OFFSET', 'FOR']
+
+MODULE_WORDS = ['VIEW', 'FUNCTION', 'PROC', 'PROCEDURE']
+
+
+class Token(namedtuple('Token', ['kind', 'text', 'start', 'end'])):
+    """
+    A token of sql, with its offsets in the text.
+    """
+    __slots__ = ()
+
+    @property
+    def word(self):
+        """The upper cased text of a bare name, which may be a keyword, or ''."""
+        return self.text.upper() if self.kind == NAME and self.text[:1] not in '["' else ''
+
+
+Batch = namedtuple('Batch', ['sql', 'line'])
+
+
+def _scan(sql, pattern):
+    """
+    Yields the group name, start, end and match of each match of a pattern
+    built on LITERALS through sql. A block comment, however deeply it nests,
+    is a single block, with no match.
+    """
+    pos = 0
+    length = len(sql)
+    while pos < length:
+        # the scan only restarts after a block comment
+        for match in pattern.finditer(sql, pos):
+            if match.lastgroup == 'block':
+                pos = _block_end(sql, match.end())
+                yield 'block', match.start(), pos, None
+                break
+            start, end = match.span()
+            yield match.lastgroup, start, end, match
+        else:
+            pos = length
+
+def _block_end(sql, pos):
+    """
+    Returns where the block comment opened just before pos ends.
+    """
+    depth = 1
+    while depth:
+        inner = BLOCK_RE.search(sql, pos)
+        if inner is None:
+            return len(sql)
+        depth += 1 if inner.group() == '/*' else -1
+        pos = inner.end()
+    return pos
+
+def tokenize(sql):
+    """
+    Yields the tokens of sql in order. Quoted names are names, and block
+    comments are comments like line comments.
+    """
+    new = tuple.__new__
+    for kind, start, end, _ in _scan(sql, TOKEN_RE):
+        yield new(Token, (KINDS.get(kind, kind), sql[start:end], start, end))
+
+def unquote(name):
+    """Returns a name without its brackets or double quotes."""
+    if name[:1] == '[' and len(name) > 1:
+        return name[1:-1].replace(']]', ']')
+    if name[:1] == '"' and len(name) > 1:
+        return name[1:-1].replace('""', '"')
+    return name
+
+def names(sql):
+    """
+    Returns the set of lowercased names in sql, unquoted, leaving out those
+    in comments and strings. Only the literals are stepped through one at a
+    time, the words between them are found in bulk.
+    """
+    found = set()
+    parts = []
+    pos = 0
+    for kind, start, end, _ in _scan(sql, LITERAL_RE):
+        parts.append(sql[pos:start])
+        parts.append(' ')
+        if kind == 'quoted':
+            found.add(unquote(sql[start:end]).lower())
+        pos = end
+    parts.append(sql[pos:])
+    found.update(WORD_RE.findall(''.join(parts).lower()))
+    return found
+
+def normalize(sql):
+    """
+    Returns sql with comments removed, and whitespace collapsed to single
+    spaces, outside of strings.
+    """
+    parts = []
+    end = 0
+    for token in tokenize(sql):
+        if token.kind == COMMENT:
+            continue
+        if parts and token.start > end:
+            parts.append(' ')
+        parts.append(token.text)
+        end = token.end
+    return ''.join(parts)
+
+def rewrite_create(sql, header):
+    """
+    Returns sql with the CREATE, CREATE OR ALTER or ALTER at the start of a
+    module definition replaced by header, or None if there is no such
+    statement at its start. Only the first few tokens are read.
+    """
+    words = []
+    start = end = None
+    for token in tokenize(sql):
+        if token.kind == COMMENT:
+            continue
+        word = token.word
+        if not words:
+            if word not in ('CREATE', 'ALTER'):
+                return None
+            start = token.start
+        elif word in MODULE_WORDS:
+            break
+        elif (words, word) not in ((['CREATE'], 'OR'), (['CREATE', 'OR'], 'ALTER')):
+            return None
+        words.append(word)
+        end = token.end
+    else:
+        return None
+    return sql[:start] + header + sql[end:]
+
+def remove_order_by(sql):
+    """
+    Returns sql with the ORDER BY of each outermost query removed, as a view
+    cannot have one. ORDER BYs inside parentheses, such as in OVER clauses
+    or subqueries, are left alone, as are those which go with a TOP, OFFSET
+    or FOR XML, whose results they change. Only the keywords and symbols
+    which decide this are looked at.
+    """
+    removed = []
+    depth = 0
+    top = False
+    previous = None
+    # the start of the ORDER BY being read, which runs to the end of its query
+    clause = None
+    new = tuple.__new__
+    for kind, start, end, _ in _scan(sql, ORDER_RE):
+        if kind not in (NAME, SYMBOL):
+            continue
+        token = new(Token, (kind, sql[start:end], start, end))
+        text = token.text
+        if depth == 0 and (text == ';' or token.word == 'OPTION'):
+            if clause is not None:
+                removed.append((clause, start))
+            clause = None
+            if text == ';':
+                top = False
+        elif text == '(':
+            depth += 1
+        elif text == ')':
+            depth -= 1
+        elif depth == 0:
+            word = token.word
+            if word == 'TOP':
+                top = True
+            elif word in ORDER_KEEPERS:
+                clause = None
+            elif word == 'BY' and not top and previous and previous.word == 'ORDER':
+                clause = previous.start
+        previous = token
+    if clause is not None:
+        removed.append((clause, len(sql)))
+
+    parts = []
+    pos = 0
+    for start, end in removed:
+        parts.append(sql[pos:start])
+        # whitespace after the clause is kept
+        pos = start + len(sql[start:end].rstrip())
+    parts.append(sql[pos:])
+    return ''.join(parts)
+
+def iter_batches(sql):
+    """
+    Yields the batches of a script separated by GO, each on a line of its
+    own, with the line of the script each batch starts on, as each GO is
+    found. GO followed by a count repeats its batch. Batches of only
+    whitespace and comments are left out.
+    """
+    start = 0
+    line = 1
+    for _, go_start, go_end, match in _scan(sql, GO_RE):
+        if match is None or match.group('go') is None:
+            continue
+        batch = Batch(sql[start:go_start], line)
+        if _significant(batch.sql):
+            for _ in range(int(match.group('count') or 1)):
+                yield batch
+        line += sql.count('\n', start, go_end)
+        start = go_end
+    batch = Batch(sql[start:], line)
+    if _significant(batch.sql):
+        yield batch
+
+def split_batches(sql):
+    """
+    Returns the batches of a script separated by GO, as iter_batches finds
+    them.
+    """
+    return list(iter_batches(sql))
+
+def _significant(sql):
+    """True if sql has anything but whitespace and comments in it."""
+    for token in tokenize(sql):
+        if token.kind != COMMENT:
+            return True
+    return False
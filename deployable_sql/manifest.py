@@ -0,0 +1,118 @@
+"""
+A deploy manifest, recording a content hash for every object that has been
+deployed so that unchanged objects can be skipped on the next run.
+
+The deployer owned table in the target database is the source of truth, and
+the local cache file is a mirror of it, keyed by target.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from .atomic import atomic_write
+
+MANIFEST_PATH = '.deploy_sql_manifest.json'
+
+# manifests for several targets may share the cache file
+_FILE_LOCK = threading.Lock()
+
+
+def content_hash(text, *salt):
+    """
+    Returns a hex digest for the given text, and any salt values which should
+    also invalidate the hash when they change (such as the schema).
+    """
+    digest = hashlib.sha1()
+    for part in salt + (text,):
+        if not isinstance(part, bytes):
+            part = part.encode('utf-8')
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    """
+    Content hashes for deployed objects, keyed by (object_type, object_name).
+    """
+    def __init__(self, target='default', path=MANIFEST_PATH):
+        self.target = target
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        Reads the entries for this target from the local cache file.
+        """
+        for key, digest in self._read_file().get(self.target, {}).items():
+            object_type, object_name = key.split('/', 1)
+            self.entries[(object_type, object_name)] = digest
+        self.logger.debug('Loaded %d manifest entries for %s',
+                          len(self.entries), self.target)
+
+    def replace(self, entries):
+        """
+        Replaces all entries, for instance with the ones read from the server.
+        """
+        with self._lock:
+            self.entries = dict(entries)
+            self.dirty = True
+
+    def get(self, object_type, object_name):
+        """Returns the recorded hash for an object, or None."""
+        return self.entries.get((object_type, object_name))
+
+    def is_current(self, object_type, object_name, digest):
+        """True if the object was last deployed with the given hash."""
+        return self.get(object_type, object_name) == digest
+
+    def record(self, object_type, object_name, digest):
+        """Records the hash an object was just deployed with."""
+        with self._lock:
+            self.entries[(object_type, object_name)] = digest
+            self.dirty = True
+
+    def forget(self, object_type, object_name):
+        """Removes an object, such that it will be deployed next time."""
+        with self._lock:
+            if self.entries.pop((object_type, object_name), None) is not None:
+                self.dirty = True
+
+    def save(self):
+        """
+        Writes the entries for this target back to the local cache file,
+        leaving the entries for any other targets alone.
+        """
+        if not self.dirty:
+            return
+
+        with self._lock, _FILE_LOCK:
+            content = self._read_file()
+            content[self.target] = dict(
+                ('/'.join(key), digest) for key, digest in self.entries.items()
+            )
+            with atomic_write(self.path) as stream:
+                json.dump(content, stream, indent=1, sort_keys=True)
+            self.dirty = False
+
+        self.logger.debug('Saved %d manifest entries to %s',
+                          len(self.entries), self.path)
+
+    def _read_file(self):
+        """
+        Returns the full content of the cache file, or an empty dict.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as stream:
+                return json.load(stream)
+        except ValueError:
+            self.logger.warning('Ignoring unreadable manifest: %s', self.path)
+            return {}
@@ -0,0 +1,207 @@
+"""
+Reads the permissions files in the permissions folder, and works out the
+GRANTs and REVOKEs which bring the server in line with them.
+
+Each file declares, for some principals, every permission they should have:
+
+    reporting:
+      database: [CREATE VIEW]
+      schemas:
+        reports: [SELECT, EXECUTE]
+      objects:
+        dbo.sales: [SELECT]
+
+The principals a file names are compared against the server in one query, so
+that only the permissions which are missing are granted, and only those
+which are no longer declared are revoked. A principal may be named in more
+than one file, in which case it is given what all of them declare.
+Principals which are not named in any file are left alone, as are denied
+and column permissions.
+"""
+from collections import namedtuple
+import os
+import re
+
+from .exc import PermissionDefinitionError
+
+
+# the securable classes which can be declared, by their key in a file
+CLASSES = [
+    ('database', 'DATABASE'),
+    ('schemas', 'SCHEMA'),
+    ('objects', 'OBJECT'),
+]
+
+# the classes of sys.database_permissions which are compared
+CATALOG_CLASSES = {0: 'DATABASE', 1: 'OBJECT', 3: 'SCHEMA'}
+
+# permissions which are never revoked, so that leaving them out of a file
+# does not lock a user out of the database
+NEVER_REVOKED = [('DATABASE', 'CONNECT')]
+
+# how many GRANT and REVOKE statements are sent in each round trip
+PERMISSIONS_BATCH_SIZE = 500
+
+# every granted permission of the given principals, with a row of nulls for
+# each principal without any, so that missing principals can be found too
+PERMISSIONS_SQL = """SELECT pr.name, p.class,
+    CASE p.class WHEN 3 THEN s.name WHEN 1 THEN os.name + N'.' + o.name END,
+    p.permission_name, p.state
+FROM sys.database_principals pr
+LEFT JOIN sys.database_permissions p ON p.grantee_principal_id = pr.principal_id
+    AND p.state IN ('G', 'W') AND p.class IN (0, 1, 3) AND p.minor_id = 0
+LEFT JOIN sys.schemas s ON p.class = 3 AND s.schema_id = p.major_id
+LEFT JOIN sys.objects o ON p.class = 1 AND o.object_id = p.major_id
+LEFT JOIN sys.schemas os ON os.schema_id = o.schema_id
+WHERE pr.name IN (%(principals)s);"""
+
+# a permission, on a securable of a class, granted to a principal. The
+# securable is empty for the database, and schema qualified for objects.
+Permission = namedtuple('Permission', ['principal', 'securable_class', 'securable',
+                                       'permission'])
+
+
+def is_permissions_file(path):
+    """
+    True if a file in the permissions folder declares permissions, rather
+    than being a script to run by hand.
+    """
+    return os.path.splitext(path)[1] in ('.yml', '.yaml')
+
+def _key(permission):
+    """Returns a permission lowercased, to compare it as the server would."""
+    return Permission(*[value.lower() for value in permission])
+
+def _bracket(name):
+    """Returns a name as a bracket quoted identifier."""
+    return '[%s]' % name.replace(']', ']]')
+
+def _permission_names(principal, value):
+    """Returns a list of permission names, uppercased."""
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise PermissionDefinitionError(
+            '%s: permissions must be a name or a list of names, not %r' % (
+                principal, value))
+    return [re.sub(r'\s+', ' ', v.strip()).upper() for v in value]
+
+
+def parse_permissions(data, schema='dbo'):
+    """
+    Returns the permissions declared by the parsed yaml of a permissions
+    file, keyed by principal. Objects without a schema are in schema.
+    """
+    if not isinstance(data, dict):
+        raise PermissionDefinitionError('A permissions file must map principals '
+                                        'to their permissions')
+    declared = {}
+    for principal, securables in data.items():
+        principal = str(principal)
+        securables = securables or {}
+        if not isinstance(securables, dict):
+            raise PermissionDefinitionError(
+                '%s: expected database, schemas or objects' % principal)
+        unknown = set(securables) - set(key for key, _ in CLASSES)
+        if unknown:
+            raise PermissionDefinitionError('%s: unknown keys %s' % (
+                principal, ', '.join(sorted(str(k) for k in unknown))))
+
+        permissions = set()
+        for key, securable_class in CLASSES:
+            if securable_class == 'DATABASE':
+                for name in _permission_names(principal, securables.get(key) or []):
+                    permissions.add(Permission(principal, securable_class, '', name))
+                continue
+            for securable, names in (securables.get(key) or {}).items():
+                securable = str(securable)
+                if securable_class == 'OBJECT' and '.' not in securable:
+                    securable = '%s.%s' % (schema, securable)
+                for name in _permission_names(principal, names):
+                    permissions.add(Permission(principal, securable_class, securable, name))
+        declared[principal] = permissions
+    return declared
+
+def merge_permissions(declared, others):
+    """
+    Adds the permissions which other files declare for the principals in
+    declared, so that files naming the same principal do not revoke each
+    other's permissions. Others is a list of what parse_permissions
+    returned for each of the other files.
+    """
+    names = dict((principal.lower(), principal) for principal in declared)
+    merged = dict((principal, set(permissions))
+                  for principal, permissions in declared.items())
+    for other in others:
+        for principal, permissions in other.items():
+            if principal.lower() in names:
+                merged[names[principal.lower()]].update(permissions)
+    return merged
+
+def read_catalog(rows):
+    """
+    Returns the principals which exist, lowercased, and their granted
+    permissions, keyed by their lowercased permission, each with whether it
+    was granted with the grant option, from the rows of PERMISSIONS_SQL.
+    """
+    principals = set()
+    granted = {}
+    for principal, class_id, securable, name, state in rows:
+        principals.add(principal.lower())
+        if name is None or class_id not in CATALOG_CLASSES:
+            continue
+        permission = Permission(principal, CATALOG_CLASSES[class_id], securable or '', name)
+        granted[_key(permission)] = (permission, state == 'W')
+    return principals, granted
+
+def diff_permissions(declared, rows):
+    """
+    Returns the permissions to grant, and those to revoke with whether the
+    revoke must cascade, which bring the principals declared in line, given
+    the rows of PERMISSIONS_SQL for them.
+
+    Raises a PermissionDefinitionError if a principal does not exist.
+    """
+    principals, granted = read_catalog(rows)
+    missing = sorted(p for p in declared if p.lower() not in principals)
+    if missing:
+        raise PermissionDefinitionError('Principals do not exist: %s' % ', '.join(missing))
+
+    wanted = {}
+    for permissions in declared.values():
+        for permission in permissions:
+            wanted[_key(permission)] = permission
+    grants = [wanted[key] for key in sorted(wanted) if key not in granted]
+    revokes = [granted[key] for key in sorted(granted)
+               if key not in wanted and
+               (key.securable_class.upper(), key.permission.upper()) not in NEVER_REVOKED]
+    return grants, revokes
+
+
+def _on(permission):
+    """Returns the permission and the securable it is on, for a statement."""
+    if permission.securable_class == 'DATABASE':
+        return permission.permission
+    return '%s ON %s::%s' % (permission.permission, permission.securable_class,
+                             '.'.join(_bracket(p) for p in permission.securable.split('.')))
+
+def grant_sql(permission):
+    """Returns the statement to grant a permission."""
+    return 'GRANT %s TO %s;' % (_on(permission), _bracket(permission.principal))
+
+def revoke_sql(permission, cascade=False):
+    """
+    Returns the statement to revoke a permission, which must cascade if it
+    was granted with the grant option.
+    """
+    return 'REVOKE %s FROM %s%s;' % (_on(permission), _bracket(permission.principal),
+                                     ' CASCADE' if cascade else '')
+
+def permission_batches(grants, revokes, size=PERMISSIONS_BATCH_SIZE):
+    """
+    Returns the statements to revoke and then grant permissions, joined into
+    batches of up to size statements.
+    """
+    statements = ([revoke_sql(p, cascade) for p, cascade in revokes] +
+                  [grant_sql(p) for p in grants])
+    return ['\n'.join(statements[i:i + size]) for i in range(0, len(statements), size)]
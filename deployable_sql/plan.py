@@ -0,0 +1,127 @@
+"""
+Compares what a deploy would create against what is on the server, using a
+few bulk catalog queries, without executing any DDL.
+"""
+from collections import namedtuple
+
+import yaml
+
+from .deployers.pymssql_deployer import diff_job, normalize_value
+from .lexer import iter_batches, normalize, rewrite_create
+from .tables import diff_table, parse_table
+from .units import read_units
+
+
+CREATE = 'create'
+ALTER = 'alter'
+UNCHANGED = 'unchanged'
+DRIFT = 'drift'
+
+ACTIONS = [CREATE, ALTER, DRIFT, UNCHANGED]
+
+
+PlanEntry = namedtuple('PlanEntry', ['path', 'object_type', 'object_name', 'action'])
+
+
+def normalize_sql(sql):
+    """
+    Returns sql with comments removed, whitespace collapsed, any trailing
+    semicolon dropped, and the header read as a plain CREATE, so that
+    formatting changes, or the way it was deployed, do not count as changes.
+    """
+    sql = normalize(sql)
+    sql = rewrite_create(sql, 'CREATE') or sql
+    return sql.rstrip('; ')
+
+def module_sql(sql):
+    """
+    Returns the batch of a GO separated file which defines its module, the
+    first with a CREATE header, or the whole file if none has one.
+    """
+    for batch in iter_batches(sql):
+        if rewrite_create(batch.sql, 'CREATE') is not None:
+            return batch.sql
+    return sql
+
+def job_differs(source, current):
+    """
+    True if the job defined by the source of a job file differs from the
+    current msdb job, as returned by fetch_jobs.
+    """
+    return bool(diff_job(yaml.safe_load(source), current))
+
+
+def build_plan(deployer, paths):
+    """
+    Returns a PlanEntry for each path, saying what deploying it would do.
+
+    An object which differs from the server is an alter if its file changed
+    since it was last deployed, and drift if the file is unchanged, meaning
+    the server was changed by hand. Permissions and scripts cannot be
+    compared with the server, so they are an alter if their file changed,
+    and unchanged otherwise.
+    """
+    modules = dict(((object_type, name.lower()), definition) for
+                   (object_type, name), definition in deployer.fetch_modules().items())
+    jobs = None
+    manifest = deployer.manifest
+    entries = []
+
+    for unit in read_units(deployer, paths, render=True):
+        path, object_type = unit.path, unit.object_type
+
+        if object_type == 'jobs':
+            if jobs is None:
+                jobs = deployer.fetch_jobs()
+            object_name = normalize_value(deployer.render_job(path, unit.source)[0])
+            current = jobs.get(object_name)
+            differs = current is not None and job_differs(unit.source, current)
+        elif object_type == 'tables':
+            table = parse_table(unit.source, deployer.schema)
+            object_name = table.name
+            current = deployer._current_table(object_name)
+            differs = current is not None and bool(diff_table(table, current))
+        elif object_type in ('views', 'functions', 'stored_procedures'):
+            object_name = unit.name
+            current = modules.get((object_type, object_name.lower()))
+            differs = (current is not None and
+                       normalize_sql(current) != normalize_sql(module_sql(unit.create_sql)))
+        else:
+            changed = not manifest.is_current(unit.folder, unit.name, unit.digest)
+            entries.append(PlanEntry(path, object_type, unit.name,
+                                     ALTER if changed else UNCHANGED))
+            continue
+
+        if current is None:
+            action = CREATE
+        elif not differs:
+            action = UNCHANGED
+        elif manifest.is_current(unit.folder, unit.name, unit.digest):
+            action = DRIFT
+        else:
+            action = ALTER
+        entries.append(PlanEntry(path, object_type, object_name, action))
+
+    return entries
+
+def format_plan(entries):
+    """
+    Returns a plan as a human readable report.
+    """
+    lines = []
+    for action in ACTIONS:
+        matching = [e for e in entries if e.action == action]
+        if action == UNCHANGED or not matching:
+            continue
+        lines.append('%s (%d):' % (action.capitalize(), len(matching)))
+        lines.extend('    %-20s %s' % (e.object_type, e.object_name) for e in matching)
+    lines.append(', '.join('%d %s' % (
+        len([e for e in entries if e.action == action]), action)
+                           for action in ACTIONS))
+    return '\n'.join(lines)
+
+def changed_paths(entries):
+    """
+    Returns the paths which need deploying for a plan.
+    """
+    return [e.path for e in entries if e.action != UNCHANGED]
@@ -0,0 +1,375 @@
+"""
+Rebuilds a table whose changes cannot be made in place, by copying it into a
+shadow table a chunk of keys at a time, then swapping the shadow in with
+sp_rename.
+
+Each chunk is copied in its own short transaction, so the log can be reused
+as the copy goes, and readers are only ever blocked for a chunk. Progress is
+checkpointed in a state table along with each chunk, so a rebuild which is
+stopped part way resumes where it left off. A trigger on the table keeps the
+rows which have already been copied up to date until the swap.
+
+What the definition of the table does not describe is carried over from the
+catalog: its other nonclustered indexes are built on the shadow table before
+the swap, and its permissions and extended properties are added back as it
+is swapped in. A table with triggers of its own is not rebuilt.
+"""
+import time
+
+from .exc import RebuildError
+from .tables import constraint_names, index_names, render_table
+
+
+STATE_TABLE = 'deployable_sql_rebuilds'
+
+# added to the names of the shadow table and its constraints
+SHADOW_SUFFIX = '__rebuild'
+
+CREATE_STATE_SQL = """IF OBJECT_ID ('%(state)s') IS NULL
+    CREATE TABLE %(state)s (
+        table_name nvarchar(256) NOT NULL PRIMARY KEY,
+        content_hash char(40) NOT NULL,
+        last_key sql_variant NULL,
+        rows_copied bigint NOT NULL DEFAULT 0,
+        started_at datetime NOT NULL DEFAULT GETDATE(),
+        updated_at datetime NOT NULL DEFAULT GETDATE()
+    );
+SELECT content_hash, rows_copied, OBJECT_ID (%(shadow_name)s)
+FROM %(state)s WHERE table_name = %(name)s;"""
+
+START_SQL = """SET XACT_ABORT ON;
+BEGIN TRANSACTION;
+IF OBJECT_ID (%(trigger_name)s) IS NOT NULL
+    DROP TRIGGER %(trigger)s;
+IF OBJECT_ID (%(shadow_name)s) IS NOT NULL
+    DROP TABLE %(shadow)s;
+DELETE FROM %(state)s WHERE table_name = %(name)s;
+%(create_shadow)s
+EXEC sp_executesql %(create_trigger)s;
+INSERT INTO %(state)s (table_name, content_hash) VALUES (%(name)s, %(digest)s);
+COMMIT TRANSACTION;"""
+
+# rows changed after they were copied are copied again, under the checkpoint
+TRIGGER_SQL = """CREATE TRIGGER %(trigger)s ON %(table)s AFTER INSERT, UPDATE, DELETE AS
+BEGIN
+    SET NOCOUNT ON;
+    DECLARE @last sql_variant;
+    SELECT @last = last_key FROM %(state)s WHERE table_name = %(name)s;
+    IF @last IS NULL RETURN;
+    DELETE s FROM %(shadow)s s JOIN deleted d ON s.%(key)s = d.%(key)s
+    WHERE d.%(key)s <= CAST(@last AS %(key_type)s);
+    %(identity_on)sINSERT INTO %(shadow)s (%(columns)s)
+    SELECT %(columns)s FROM inserted
+    WHERE %(key)s <= CAST(@last AS %(key_type)s);%(identity_off)s
+END"""
+
+# the checkpoint is moved first, so that the trigger of a writer waits for
+# the chunk to commit, then sees the rows it copied as copied. The first
+# chunk has its own statements, so that every later one is a range seek on
+# the key, rather than a scan from the start under an OR.
+CHUNK_SQL = """SET XACT_ABORT ON;
+SET DEADLOCK_PRIORITY LOW;
+DECLARE @last sql_variant, @from %(key_type)s, @next %(key_type)s, @rows int;
+BEGIN TRANSACTION;
+UPDATE %(state)s SET updated_at = GETDATE() WHERE table_name = %(name)s;
+SELECT @last = last_key FROM %(state)s WHERE table_name = %(name)s;
+SET @from = CAST(@last AS %(key_type)s);
+IF @last IS NULL
+    SELECT @next = MAX(k) FROM (
+        SELECT TOP (%(chunk_size)d) %(key)s AS k FROM %(table)s
+        ORDER BY %(key)s) chunk;
+ELSE
+    SELECT @next = MAX(k) FROM (
+        SELECT TOP (%(chunk_size)d) %(key)s AS k FROM %(table)s
+        WHERE %(key)s > @from
+        ORDER BY %(key)s) chunk;
+IF @next IS NOT NULL
+BEGIN
+    UPDATE %(state)s SET last_key = @next WHERE table_name = %(name)s;
+    %(identity_on)sIF @last IS NULL
+        INSERT INTO %(shadow)s (%(columns)s)
+        SELECT %(columns)s FROM %(table)s
+        WHERE %(key)s <= @next;
+    ELSE
+        INSERT INTO %(shadow)s (%(columns)s)
+        SELECT %(columns)s FROM %(table)s
+        WHERE %(key)s > @from AND %(key)s <= @next;
+    SET @rows = @@ROWCOUNT;%(identity_off)s
+    UPDATE %(state)s SET rows_copied = rows_copied + @rows WHERE table_name = %(name)s;
+END
+COMMIT TRANSACTION;
+SELECT CASE WHEN @next IS NULL THEN 1 ELSE 0 END, COALESCE(@rows, 0);"""
+
+SWAP_SQL = """SET XACT_ABORT ON;
+BEGIN TRANSACTION;
+DECLARE @last sql_variant, @from %(key_type)s;
+SELECT @last = last_key FROM %(state)s WITH (UPDLOCK) WHERE table_name = %(name)s;
+SET @from = CAST(@last AS %(key_type)s);
+-- writers wait from here until the swap commits
+SELECT TOP 0 1 FROM %(table)s WITH (TABLOCKX, HOLDLOCK);
+%(identity_on)sIF @last IS NULL
+    INSERT INTO %(shadow)s (%(columns)s)
+    SELECT %(columns)s FROM %(table)s;
+ELSE
+    INSERT INTO %(shadow)s (%(columns)s)
+    SELECT %(columns)s FROM %(table)s
+    WHERE %(key)s > @from;%(identity_off)s
+DROP TABLE %(table)s;
+EXEC sp_rename %(shadow_name)s, %(table_basename)s;
+%(renames)s%(carried)sDELETE FROM %(state)s WHERE table_name = %(name)s;
+COMMIT TRANSACTION;"""
+
+# the indexes of the table which are not behind a key constraint
+INDEXES_SQL = """SELECT i.name, i.type, i.is_unique,
+    STUFF((SELECT ',' + c.name + CASE WHEN ic.is_descending_key = 1 THEN ' DESC' ELSE '' END
+           FROM sys.index_columns ic
+           JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+           WHERE ic.object_id = i.object_id AND ic.index_id = i.index_id
+               AND ic.is_included_column = 0
+           ORDER BY ic.key_ordinal FOR XML PATH('')), 1, 1, ''),
+    STUFF((SELECT ',' + c.name FROM sys.index_columns ic
+           JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+           WHERE ic.object_id = i.object_id AND ic.index_id = i.index_id
+               AND ic.is_included_column = 1
+           ORDER BY ic.index_column_id FOR XML PATH('')), 1, 1, ''),
+    i.filter_definition
+FROM sys.indexes i
+WHERE i.object_id = OBJECT_ID (%(name)s) AND i.type > 0
+    AND i.is_primary_key = 0 AND i.is_unique_constraint = 0;"""
+
+# the permissions on the table, and on its columns
+OBJECT_PERMISSIONS_SQL = """SELECT pr.name, p.state, p.permission_name, c.name
+FROM sys.database_permissions p
+JOIN sys.database_principals pr ON pr.principal_id = p.grantee_principal_id
+LEFT JOIN sys.columns c ON c.object_id = p.major_id AND c.column_id = p.minor_id
+WHERE p.class = 1 AND p.major_id = OBJECT_ID (%(name)s);"""
+
+# the triggers on the table, other than the one a rebuild adds
+TRIGGERS_SQL = """SELECT name FROM sys.triggers
+WHERE parent_id = OBJECT_ID (%(name)s) AND name <> %(trigger_basename)s;"""
+
+# the objects which stop the table being dropped: the other tables with a
+# foreign key to it, and the views and functions bound to its schema
+DEPENDENTS_SQL = """SELECT OBJECT_SCHEMA_NAME (fk.parent_object_id) + '.' +
+    OBJECT_NAME (fk.parent_object_id)
+FROM sys.foreign_keys fk
+WHERE fk.referenced_object_id = OBJECT_ID (%(name)s)
+AND fk.parent_object_id <> fk.referenced_object_id
+UNION
+SELECT OBJECT_SCHEMA_NAME (d.referencing_id) + '.' + OBJECT_NAME (d.referencing_id)
+FROM sys.sql_expression_dependencies d
+WHERE d.referenced_id = OBJECT_ID (%(name)s) AND d.is_schema_bound_reference = 1;"""
+
+# the extended properties of the table, and of its columns
+PROPERTIES_SQL = """SELECT ep.name, CAST(ep.value AS nvarchar(4000)), c.name
+FROM sys.extended_properties ep
+LEFT JOIN sys.columns c ON c.object_id = ep.major_id AND c.column_id = ep.minor_id
+WHERE ep.class = 1 AND ep.major_id = OBJECT_ID (%(name)s);"""
+
+# the catalog's codes for the state of a permission
+PERMISSION_STATES = {'G': 'GRANT', 'W': 'GRANT', 'D': 'DENY'}
+
+
+def _literal(value):
+    """Returns value as a quoted T-SQL unicode literal."""
+    return "N'%s'" % value.replace("'", "''")
+
+def _bracket(name):
+    """Returns a name as a bracket quoted identifier."""
+    return '[%s]' % name.replace(']', ']]')
+
+def copy_key(table, current):
+    """
+    Returns the column the copy is chunked by, which is the single column
+    primary key, or unique key, of the current table, if the new table keeps
+    it.
+    """
+    for kind in ('PK', 'UQ'):
+        for constraint in current.constraints:
+            if (constraint.kind == kind and len(constraint.columns) == 1 and
+                    constraint.columns[0] in table.columns):
+                return constraint.columns[0]
+    raise RebuildError('Cannot rebuild %s, which has no single column key to copy '
+                       'it by' % table.name)
+
+
+class TableRebuild(object):
+    """
+    Rebuilds a table into its new definition, through a deployer.
+    """
+    def __init__(self, deployer, table, current, digest, chunk_size, throttle=0):
+        """
+        current is the table as it is on the server, and digest the content
+        hash of its file, which says whether a stopped rebuild can be
+        resumed. Up to chunk_size rows are copied at a time, waiting throttle
+        seconds after each chunk.
+        """
+        self.deployer = deployer
+        self.logger = deployer.logger
+        self.table = table
+        self.digest = digest
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+
+        schema, basename = table.name.split('.')
+        key = copy_key(table, current)
+        # columns which are new are left to their defaults
+        columns = [c.name for k, c in table.columns.items() if k in current.columns]
+        identity = any(c.identity for k, c in table.columns.items()
+                       if k in current.columns)
+        shadow = table.name + SHADOW_SUFFIX
+        self.args = {
+            'state': '%s.%s' % (schema, STATE_TABLE),
+            'name': _literal(table.name),
+            'digest': _literal(digest),
+            'table': table.name,
+            'table_basename': _literal(basename),
+            'shadow': shadow,
+            'shadow_name': _literal(shadow),
+            'trigger': table.name + SHADOW_SUFFIX + '_sync',
+            'trigger_name': _literal(table.name + SHADOW_SUFFIX + '_sync'),
+            'trigger_basename': _literal(basename + SHADOW_SUFFIX + '_sync'),
+            'key': '[%s]' % table.columns[key].name,
+            'key_type': current.columns[key].type_sql,
+            'columns': ', '.join('[%s]' % name for name in columns),
+            'chunk_size': chunk_size,
+            'identity_on': 'SET IDENTITY_INSERT %s ON;\n    ' % shadow if identity else '',
+            'identity_off': '\n    SET IDENTITY_INSERT %s OFF;' % shadow if identity else '',
+            'renames': ''.join(
+                "EXEC sp_rename %s, %s, N'OBJECT';\n" % (
+                    _literal('%s.%s%s' % (schema, name, SHADOW_SUFFIX)), _literal(name))
+                for name in constraint_names(table)),
+            'carried': '',
+        }
+
+    def sql(self, template):
+        """Returns one of the templates filled in for this table."""
+        return template % self.args
+
+    def run(self):
+        """
+        Starts or resumes the rebuild, copies the remaining rows, and swaps
+        the shadow table in. Returns the number of rows copied in chunks,
+        including any copied before a resume.
+        """
+        indexes, carried = self.carry_over()
+        copied = self.start()
+        with self.deployer._timed('copy'):
+            while True:
+                # each chunk is copied in a transaction, so may be sent again
+                done, rows = self.deployer._exec(self.sql(CHUNK_SQL), retry=True)[0]
+                if done:
+                    break
+                copied += rows
+                self.logger.debug('%s: %d rows copied', self.table.name, copied)
+                if self.throttle:
+                    time.sleep(self.throttle)
+            if indexes:
+                self.deployer._exec('\n'.join(indexes), fetch=False)
+        self.args['carried'] = ''.join(sql + '\n' for sql in carried)
+        with self.deployer._timed('swap'):
+            self.deployer._exec(self.sql(SWAP_SQL), fetch=False)
+        return copied
+
+    def carry_over(self):
+        """
+        Reads what the definition of the table cannot describe from the
+        catalog. Returns the statements which build its other indexes on the
+        shadow table, each skipped if the index was built before a resume,
+        and those which add its permissions and extended properties back
+        once it is swapped in. Anything on a column which the definition
+        drops is left behind.
+
+        Raises a RebuildError if the table has triggers, other objects which
+        would stop it being dropped, or an index other than a nonclustered
+        one which the definition does not declare.
+        """
+        triggers = self.deployer._exec(self.sql(TRIGGERS_SQL)) or []
+        if triggers:
+            raise RebuildError('Cannot rebuild %s, which has triggers: %s' % (
+                self.table.name, ', '.join(name for name, in triggers)))
+        dependents = self.deployer._exec(self.sql(DEPENDENTS_SQL)) or []
+        if dependents:
+            raise RebuildError('Cannot rebuild %s, which is referenced by: %s' % (
+                self.table.name, ', '.join(sorted(name for name, in dependents))))
+
+        schema, basename = self.table.name.split('.')
+        shadow = self.args['shadow']
+        declared = index_names(self.table)
+        indexes = []
+        for name, kind, unique, keys, included, where in (
+                self.deployer._exec(self.sql(INDEXES_SQL)) or []):
+            if name.lower() in declared:
+                continue
+            if kind != 2:
+                raise RebuildError('Cannot rebuild %s, as its definition does not '
+                                   'declare index %s' % (self.table.name, name))
+            keys = [key.rsplit(' ', 1) if key.endswith(' DESC') else [key]
+                    for key in keys.split(',')]
+            included = included.split(',') if included else []
+            if not self._kept(name, [key[0] for key in keys] + included):
+                continue
+            sql = 'CREATE %sNONCLUSTERED INDEX %s ON %s (%s)' % (
+                'UNIQUE ' if unique else '', _bracket(name), shadow,
+                ', '.join(' '.join([_bracket(key[0])] + key[1:]) for key in keys))
+            if included:
+                sql += ' INCLUDE (%s)' % ', '.join(_bracket(c) for c in included)
+            if where:
+                sql += ' WHERE %s' % where
+            indexes.append("IF INDEXPROPERTY (OBJECT_ID (%s), %s, 'IndexID') IS NULL\n"
+                           "    %s;" % (_literal(shadow), _literal(name), sql))
+
+        carried = []
+        for principal, state, permission, column in (
+                self.deployer._exec(self.sql(OBJECT_PERMISSIONS_SQL)) or []):
+            if column is not None and not self._kept(permission, [column]):
+                continue
+            carried.append('%s %s ON %s%s TO %s%s;' % (
+                PERMISSION_STATES[state], permission, self.table.name,
+                '' if column is None else ' (%s)' % _bracket(column),
+                _bracket(principal), ' WITH GRANT OPTION' if state == 'W' else ''))
+
+        for name, value, column in self.deployer._exec(self.sql(PROPERTIES_SQL)) or []:
+            if column is not None and not self._kept(name, [column]):
+                continue
+            args = [name, value, 'SCHEMA', schema, 'TABLE', basename]
+            if column is not None:
+                args.extend(['COLUMN', column])
+            carried.append('EXEC sp_addextendedproperty %s;' % ', '.join(
+                'NULL' if arg is None else _literal(arg) for arg in args))
+        return indexes, carried
+
+    def _kept(self, name, columns):
+        """
+        True if the definition keeps every one of the columns something on
+        the table is on, or else logs that it is left behind.
+        """
+        dropped = [c for c in columns if c.lower() not in self.table.columns]
+        if dropped:
+            self.logger.warning('%s: not carrying %s over, as %s is dropped',
+                                self.table.name, name, ', '.join(dropped))
+        return not dropped
+
+    def start(self):
+        """
+        Creates the shadow table, its trigger, and the checkpoint, unless a
+        rebuild of the same definition was stopped part way, which is resumed
+        instead. Returns the number of rows copied so far.
+        """
+        rows = self.deployer._exec(self.sql(CREATE_STATE_SQL))
+        if rows:
+            digest, copied, shadow_id = rows[0]
+            if digest == self.digest and shadow_id is not None:
+                self.logger.info('Resuming rebuild of %s after %d rows',
+                                 self.table.name, copied)
+                return copied
+            self.logger.info('Restarting rebuild of %s, as its definition changed',
+                             self.table.name)
+
+        args = dict(self.args)
+        args['create_shadow'] = render_table(self.table, self.args['shadow'], SHADOW_SUFFIX)
+        args['create_trigger'] = _literal(self.sql(TRIGGER_SQL))
+        self.deployer._exec(START_SQL % args, fetch=False)
+        self.logger.info('Rebuilding %s, %d rows at a time', self.table.name,
+                         self.chunk_size)
+        return 0
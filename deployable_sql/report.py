@@ -0,0 +1,222 @@
+"""
+Per object, per phase timings for a deploy, which can be written out as a
+JSON report or for the Prometheus textfile collector.
+"""
+from collections import OrderedDict
+import json
+import threading
+import time
+
+from .atomic import atomic_write
+
+PHASES = ['hash', 'parse', 'generate', 'compile', 'drop', 'create', 'batch', 'copy',
+          'swap', 'record']
+
+PROMETHEUS_PREFIX = 'deployable_sql'
+
+
+def percentile(values, pct):
+    """
+    Returns the nearest rank percentile of a list of numbers.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.499999)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class ObjectTiming(object):
+    """
+    The time spent in each phase of deploying one object.
+    """
+    __slots__ = ('object_type', 'object_name', 'phases', 'round_trips', 'skipped',
+                 'retries', 'lock_wait')
+
+    def __init__(self, object_type, object_name):
+        self.object_type = object_type
+        self.object_name = object_name
+        self.phases = {}
+        self.round_trips = 0
+        self.skipped = False
+        # statements retried after lock timeouts or deadlocks, and the time
+        # spent blocked and backing off before each retry
+        self.retries = 0
+        self.lock_wait = 0.0
+
+    @property
+    def seconds(self):
+        """The total time spent on the object."""
+        return sum(self.phases.values())
+
+    def to_dict(self):
+        """Returns the timing as a json friendly dict."""
+        return OrderedDict([
+            ('type', self.object_type),
+            ('name', self.object_name),
+            ('seconds', round(self.seconds, 6)),
+            ('round_trips', self.round_trips),
+            ('skipped', self.skipped),
+            ('retries', self.retries),
+            ('lock_wait', round(self.lock_wait, 6)),
+            ('phases', dict((k, round(v, 6)) for k, v in self.phases.items())),
+        ])
+
+
+class DeployReport(object):
+    """
+    Collects timings from a deployer, and any clones of it.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.objects = OrderedDict()
+        self.phases = dict((phase, 0.0) for phase in PHASES)
+        self.round_trips = 0
+        self.retries = 0
+        self.lock_wait = 0.0
+        self._lock = threading.Lock()
+
+    def _object(self, key):
+        """
+        Returns the timing for an object, creating it if need be. Must be
+        called with the lock held.
+        """
+        if key not in self.objects:
+            self.objects[key] = ObjectTiming(*key)
+        return self.objects[key]
+
+    def add(self, key, phase, seconds):
+        """
+        Adds time spent in a phase, for the object (type, name) key, if any.
+        """
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+            if key is not None:
+                timing = self._object(key)
+                timing.phases[phase] = timing.phases.get(phase, 0.0) + seconds
+
+    def add_round_trip(self, key):
+        """
+        Counts a round trip to the server, for the object key, if any.
+        """
+        with self._lock:
+            self.round_trips += 1
+            if key is not None:
+                self._object(key).round_trips += 1
+
+    def add_retry(self, key, seconds):
+        """
+        Counts a statement retried after a lock timeout or deadlock, and the
+        seconds spent waiting on locks and backing off, for the object key,
+        if any.
+        """
+        with self._lock:
+            self.retries += 1
+            self.lock_wait += seconds
+            if key is not None:
+                timing = self._object(key)
+                timing.retries += 1
+                timing.lock_wait += seconds
+
+    def skip(self, key):
+        """
+        Marks an object as skipped, because it was unchanged, unless it was
+        already deployed earlier in the run. Reading and hashing the file do
+        not count as deploying it.
+        """
+        with self._lock:
+            timing = self._object(key)
+            timing.skipped = set(timing.phases) <= set(['hash', 'parse'])
+
+    def finish(self):
+        """Marks the end of the deploy."""
+        self.finished = time.time()
+
+    def to_dict(self, slowest=10):
+        """
+        Returns the report as a json friendly dict, with totals, percentiles
+        per object type, and the slowest objects.
+        """
+        finished = self.finished or time.time()
+        deployed = [t for t in self.objects.values() if not t.skipped]
+
+        by_type = OrderedDict()
+        for timing in deployed:
+            by_type.setdefault(timing.object_type, []).append(timing.seconds)
+
+        return OrderedDict([
+            ('started', self.started),
+            ('seconds', round(finished - self.started, 6)),
+            ('deployed', len(deployed)),
+            ('skipped', len(self.objects) - len(deployed)),
+            ('round_trips', self.round_trips),
+            ('retries', self.retries),
+            ('lock_wait', round(self.lock_wait, 6)),
+            ('phases', dict((k, round(v, 6)) for k, v in self.phases.items())),
+            ('types', OrderedDict(
+                (object_type, OrderedDict([
+                    ('count', len(seconds)),
+                    ('seconds', round(sum(seconds), 6)),
+                    ('p50', round(percentile(seconds, 50), 6)),
+                    ('p95', round(percentile(seconds, 95), 6)),
+                ])) for object_type, seconds in by_type.items())),
+            ('slowest', [t.to_dict() for t in
+                         sorted(deployed, key=lambda t: -t.seconds)[:slowest]]),
+            ('objects', [t.to_dict() for t in self.objects.values()]),
+        ])
+
+    def write_json(self, path):
+        """
+        Writes the report as json.
+        """
+        with atomic_write(path) as stream:
+            stream.write(json.dumps(self.to_dict(), indent=2))
+
+    def write_prometheus(self, path):
+        """
+        Writes the report in the Prometheus text format, for the node
+        exporter's textfile collector.
+        """
+        report = self.to_dict(slowest=0)
+        prefix = PROMETHEUS_PREFIX
+        lines = [
+            '# HELP %s_deploy_seconds Wall time of the last deploy.' % prefix,
+            '# TYPE %s_deploy_seconds gauge' % prefix,
+            '%s_deploy_seconds %s' % (prefix, report['seconds']),
+            '# HELP %s_last_deploy_timestamp_seconds When the last deploy finished.' % prefix,
+            '# TYPE %s_last_deploy_timestamp_seconds gauge' % prefix,
+            '%s_last_deploy_timestamp_seconds %s' % (prefix, self.finished or time.time()),
+            '# HELP %s_round_trips Round trips to the server in the last deploy.' % prefix,
+            '# TYPE %s_round_trips gauge' % prefix,
+            '%s_round_trips %d' % (prefix, report['round_trips']),
+            '# HELP %s_skipped_objects Unchanged objects skipped in the last deploy.' % prefix,
+            '# TYPE %s_skipped_objects gauge' % prefix,
+            '%s_skipped_objects %d' % (prefix, report['skipped']),
+            '# HELP %s_retries Statements retried after lock timeouts or deadlocks.' % prefix,
+            '# TYPE %s_retries gauge' % prefix,
+            '%s_retries %d' % (prefix, report['retries']),
+            '# HELP %s_lock_wait_seconds Time spent waiting on locks before retrying.' % prefix,
+            '# TYPE %s_lock_wait_seconds gauge' % prefix,
+            '%s_lock_wait_seconds %s' % (prefix, report['lock_wait']),
+            '# HELP %s_phase_seconds Time spent in each phase of the last deploy.' % prefix,
+            '# TYPE %s_phase_seconds gauge' % prefix,
+        ]
+        for phase, seconds in sorted(report['phases'].items()):
+            lines.append('%s_phase_seconds{phase="%s"} %s' % (prefix, phase, seconds))
+
+        lines.extend([
+            '# HELP %s_object_seconds Time spent deploying each object, by type.' % prefix,
+            '# TYPE %s_object_seconds summary' % prefix,
+        ])
+        for object_type, stats in report['types'].items():
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95')):
+                lines.append('%s_object_seconds{type="%s",quantile="%s"} %s' % (
+                    prefix, object_type, quantile, stats[key]))
+            lines.append('%s_object_seconds_sum{type="%s"} %s' % (
+                prefix, object_type, stats['seconds']))
+            lines.append('%s_object_seconds_count{type="%s"} %d' % (
+                prefix, object_type, stats['count']))
+
+        with atomic_write(path) as stream:
+            stream.write('\n'.join(lines) + '\n')
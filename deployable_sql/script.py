@@ -0,0 +1,139 @@
+"""
+Compiles a project into a single GO separated release script, for servers
+which are deployed to by hand rather than by the deployer.
+
+The script starts with the content hash of every file it was built from, so
+that it can be checked against the repo later.
+"""
+from collections import namedtuple
+from datetime import datetime
+import os
+import re
+
+from .atomic import atomic_write
+from .deployers.pymssql_deployer import (MANIFEST_TABLE, _create_manifest,
+                                         _upsert_manifest)
+from .engine import topological_order
+from .units import read_unit
+
+
+HEADER = '-- deployable_sql release script'
+
+HASH_RE = re.compile(r'^-- ([0-9a-f]{40}) (\S.*)$')
+
+ScriptCheck = namedtuple('ScriptCheck', ['changed', 'missing', 'added'])
+
+
+def _relpath(path):
+    """Returns path relative to the project, with forward slashes."""
+    return os.path.relpath(path).replace(os.path.sep, '/')
+
+def _batch(stream, sql):
+    """Writes a batch of sql, followed by GO."""
+    stream.write(sql.rstrip())
+    stream.write('\nGO\n\n')
+
+
+def compile_script(deployer, paths, out, db=None):
+    """
+    Writes the sql to deploy paths to the file out, in dependency order, one
+    object at a time. Each object is recorded in the manifest table, so that
+    later deploys know it is current. The order is worked out from the files
+    first, so that each is only rendered as it is written, and none are held
+    in memory.
+
+    When db is given the script switches to it first. Jobs are created from
+    msdb, so they go last, and are only recorded in the manifest when the
+    script knows which database to switch back to.
+
+    Returns the number of objects written.
+    """
+    if deployer.create_or_alter:
+        # there is no server to ask, so the script assumes 2016 SP1 or later
+        deployer._create_or_alter_supported = True
+
+    paths = topological_order([p for p in paths if _folder(p) is not None])
+    paths.sort(key=lambda p: _folder(p) == 'jobs')
+    table = deployer._schema_path(MANIFEST_TABLE)
+
+    with atomic_write(out) as stream:
+        stream.write('%s\n-- generated %s, schema %s, %d objects\n' % (
+            HEADER, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            deployer.schema, len(paths)))
+        stream.write('-- content hashes, sha1 of each file salted with the schema:\n')
+        for path in paths:
+            stream.write('-- %s %s\n' % (deployer._hash_path(path), _relpath(path)))
+        if db is None and any(_folder(p) == 'jobs' for p in paths):
+            stream.write('-- jobs are not recorded in the manifest, as the '
+                         'database was not given\n')
+        stream.write('\n')
+
+        if db is not None:
+            _batch(stream, 'USE %s;' % db)
+        _batch(stream, _create_manifest(table))
+
+        for path in paths:
+            unit = read_unit(deployer, path, render=True)
+            stream.write('-- %s\n' % _relpath(path))
+            drop_sql, create_sql = unit.drop_sql, unit.create_sql
+            if unit.object_type != 'jobs':
+                drop_sql, create_sql, _ = deployer._create_or_alter(
+                    unit.object_type, unit.name, drop_sql, create_sql)
+            if drop_sql is not None:
+                _batch(stream, drop_sql)
+            _batch(stream, create_sql)
+
+            if unit.object_type == 'jobs':
+                if db is None:
+                    continue
+                _batch(stream, 'USE %s;' % db)
+            elif unit.object_type == 'scripts' and db is not None:
+                # a script may have switched to another database
+                _batch(stream, 'USE %s;' % db)
+            _batch(stream, _upsert_manifest(table, unit.folder, unit.name, unit.digest))
+
+    return len(paths)
+
+def _folder(path):
+    """
+    Returns the folder a path is compiled as, or None if it cannot be.
+    """
+    folder = os.path.basename(os.path.dirname(path))
+    if folder == 'sps':
+        return 'stored_procedures'
+    if folder in ('views', 'functions', 'stored_procedures', 'scripts', 'jobs'):
+        return folder
+    return None
+
+
+def script_hashes(path):
+    """
+    Returns the content hashes in the header of a release script, keyed by
+    the path of each file.
+    """
+    hashes = {}
+    with open(path, 'r') as stream:
+        if stream.readline().rstrip('\n') != HEADER:
+            return hashes
+        for line in stream:
+            if not line.startswith('--'):
+                break
+            match = HASH_RE.match(line.rstrip('\n'))
+            if match:
+                hashes[match.group(2)] = match.group(1)
+    return hashes
+
+def check_script(deployer, script_path, paths):
+    """
+    Compares the hashes in a release script against the files in the repo,
+    and returns the files which have changed since it was compiled, those in
+    the script but no longer in the repo, and those in the repo but not in
+    the script.
+    """
+    compiled = script_hashes(script_path)
+    current = dict((_relpath(p), deployer._hash_path(p)) for p in paths
+                   if _folder(p) is not None)
+    return ScriptCheck(
+        sorted(p for p in compiled if p in current and compiled[p] != current[p]),
+        sorted(p for p in compiled if p not in current),
+        sorted(p for p in current if p not in compiled))
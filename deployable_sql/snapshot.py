@@ -0,0 +1,304 @@
+"""
+Snapshots of the objects a deploy is about to change, taken before it runs,
+so that a bad release can be rolled back by restoring just those objects,
+rather than deploying an old commit in full.
+
+Module definitions are read in one query over sys.sql_modules, and jobs in
+the usual handful of msdb queries. Each snapshot is written as compressed
+json to a local file, and to a history table on the server, so that it can
+be rolled back from anywhere.
+"""
+from collections import namedtuple
+import binascii
+from datetime import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import random
+
+import yaml
+
+from .deployers import constants
+from .deployers.pymssql_deployer import (
+    DROP_TYPES, JOB_SCHEDULE_COLUMNS, JOB_STEP_COLUMNS, MANIFEST_TABLE, _if_drop,
+    _if_drop_job, _msdb_batch, _quote, _upsert_manifest, diff_job,
+    normalize_value, read_job, read_job_params)
+from .engine import topological_order
+from .exc import DeployableSQLError
+from .folders import MODULE_FOLDERS
+from .lexer import rewrite_create
+from .manifest import content_hash
+from .plan import normalize_sql
+from .units import find_references
+
+
+SNAPSHOT_DIR = '.deploy_sql_snapshots'
+SNAPSHOT_TABLE = 'deployable_sql_snapshots'
+
+# the parts of an msdb job which are restored, and the columns of each
+JOB_PARTS = [
+    ('steps', JOB_STEP_COLUMNS),
+    ('schedules', JOB_SCHEDULE_COLUMNS),
+    ('servers', ['server_name']),
+]
+
+# msdb stores schedule frequencies by number, and job files name them
+FREQUENCY_NAMES = dict((v, k) for k, v in constants.FREQUENCY_TYPES.items())
+
+# modules are keyed by (folder, name), and jobs by name. A definition of
+# None means the object did not exist, and a digest of None that the object
+# was not in the manifest.
+Snapshot = namedtuple('Snapshot', ['deploy_id', 'created', 'schema', 'modules',
+                                   'jobs', 'manifest'])
+
+
+def new_deploy_id():
+    """Returns a unique, sortable id for a deploy."""
+    return '%s-%04x' % (datetime.now().strftime('%Y%m%d%H%M%S'),
+                        random.randint(0, 0xffff))
+
+def _snapshot_table(deployer):
+    """Returns the schema qualified name of the snapshot history table."""
+    return deployer._schema_path(SNAPSHOT_TABLE)
+
+def _local_path(deploy_id):
+    """Returns the path of the local copy of a snapshot."""
+    return os.path.join(SNAPSHOT_DIR, deploy_id + '.json.gz')
+
+
+def take_snapshot(deployer, paths, deleted=(), deploy_id=None, sources=None,
+                  digests=None):
+    """
+    Captures the views, functions, stored procedures and jobs defined by
+    paths, and by the (path, last content) of each deleted file, as they are
+    on the server now, along with their manifest entries. The snapshot is
+    saved locally and on the server, and returned.
+
+    Paths which the manifest says are current are left out, as the deploy
+    will skip them, unless the deployer is forced. Their content hash is
+    taken from digests, keyed by path, and files are read for it, and for
+    the names of their jobs, unless their content is in sources, as it is
+    for a bundle, whose files are not on disk.
+
+    Tables and scripts are left out, as they cannot be put back by
+    redefining them.
+    """
+    modules = []
+    job_names = []
+    sources = sources or {}
+    digests = digests or {}
+    manifest = deployer.manifest
+    for path, source, changed in ([(p, sources.get(p), True) for p in paths] +
+                                  [(p, s, False) for p, s in deleted]):
+        folder = os.path.basename(os.path.dirname(path))
+        object_type = 'stored_procedures' if folder == 'sps' else folder
+        name = deployer._schema_path(os.path.splitext(os.path.basename(path))[0])
+        if object_type not in MODULE_FOLDERS and object_type != 'jobs':
+            continue
+        if changed and not deployer.force:
+            digest = digests.get(path)
+            if digest is None:
+                if source is None:
+                    with open(path, 'rb') as stream:
+                        source = stream.read()
+                digest = content_hash(source, deployer.schema)
+            if manifest.is_current(folder, name, digest):
+                continue
+        if object_type in MODULE_FOLDERS:
+            modules.append((folder, object_type, name))
+        else:
+            if source is None:
+                with open(path, 'rb') as stream:
+                    source = stream.read()
+            job_name = read_job_params(yaml.safe_load(source))[0]
+            job_names.append((folder, name, normalize_value(job_name)))
+
+    current = {}
+    if modules:
+        current = dict(((t, n.lower()), d) for (t, n), d in deployer.fetch_modules(
+            [n for _, _, n in modules]).items())
+    jobs = {}
+    if len(job_names) == 1:
+        jobs = deployer.fetch_jobs(job_names[0][2])
+    elif job_names:
+        jobs = deployer.fetch_jobs()
+
+    snapshot = Snapshot(
+        deploy_id or new_deploy_id(), datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        deployer.schema,
+        [[t, n, current.get((t, n.lower()))] for _, t, n in modules],
+        [[job_name, jobs.get(job_name)] for _, _, job_name in job_names],
+        [[f, n, manifest.get(f, n)] for f, _, n in modules] +
+        [[f, n, manifest.get(f, n)] for f, n, _ in job_names])
+    save_snapshot(deployer, snapshot)
+    logging.getLogger(__name__).info(
+        'Snapshot %s of %d modules and %d jobs', snapshot.deploy_id,
+        len(snapshot.modules), len(snapshot.jobs))
+    return snapshot
+
+def _compress(snapshot):
+    """Returns a snapshot as gzipped json."""
+    data = json.dumps(snapshot._asdict(), separators=(',', ':'), default=str)
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as stream:
+        stream.write(data.encode('utf-8'))
+    return buf.getvalue()
+
+def _decompress(data):
+    """Returns a snapshot from gzipped json."""
+    with gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb') as stream:
+        return Snapshot(**json.loads(stream.read().decode('utf-8')))
+
+def save_snapshot(deployer, snapshot):
+    """
+    Writes a snapshot to the local snapshot folder, and to the history table
+    on the server in one round trip, creating the table if need be.
+    """
+    data = _compress(snapshot)
+    if not os.path.isdir(SNAPSHOT_DIR):
+        os.mkdir(SNAPSHOT_DIR)
+    with open(_local_path(snapshot.deploy_id), 'wb') as stream:
+        stream.write(data)
+
+    table = _snapshot_table(deployer)
+    deployer._reset_db()
+    deployer._exec("""IF OBJECT_ID(%(quoted)s) IS NULL
+    CREATE TABLE %(table)s (
+        deploy_id nvarchar(64) NOT NULL PRIMARY KEY,
+        created datetime NOT NULL DEFAULT GETDATE(),
+        snapshot varbinary(max) NOT NULL
+    );
+INSERT INTO %(table)s (deploy_id, snapshot) VALUES (%(id)s, 0x%(data)s);""" % {
+        'quoted': _quote(table),
+        'table': table,
+        'id': _quote(snapshot.deploy_id),
+        'data': binascii.hexlify(data).decode('ascii'),
+    }, fetch=False)
+
+def load_snapshot(deployer, deploy_id):
+    """
+    Returns the snapshot taken before a deploy, from the local snapshot
+    folder if it is there, or else from the server.
+    """
+    path = _local_path(deploy_id)
+    if os.path.exists(path):
+        with open(path, 'rb') as stream:
+            return _decompress(stream.read())
+
+    deployer._reset_db()
+    rows = deployer._exec("""IF OBJECT_ID(%s) IS NOT NULL
+    SELECT snapshot FROM %s WHERE deploy_id = %s;""" % (
+        _quote(_snapshot_table(deployer)), _snapshot_table(deployer), _quote(deploy_id)))
+    if not rows:
+        raise DeployableSQLError('No snapshot found for deploy %s' % deploy_id)
+    return _decompress(bytes(rows[0][0]))
+
+
+def job_definition(job_name, current):
+    """
+    Returns a job as fetch_jobs returned it, as the dict a job file holds,
+    with its values quoted for msdb calls.
+    """
+    settings = {}
+    for part, columns in JOB_PARTS:
+        settings[part] = []
+        for row in current[part]:
+            params = {}
+            for column in columns:
+                value = row.get(column)
+                if value is None:
+                    continue
+                if column == 'freq_type':
+                    value = FREQUENCY_NAMES.get(value, value)
+                elif column == 'active_start_date':
+                    value = str(value)
+                elif not isinstance(value, int):
+                    value = _quote(str(value))
+                params[column] = value
+            settings[part].append(params)
+    return {_quote(job_name): settings}
+
+def rollback(deployer, deploy_id):
+    """
+    Puts back the objects a deploy changed, as its snapshot recorded them,
+    and their manifest entries. Only objects which differ from the snapshot
+    now are touched: those which did not exist are dropped, and the rest
+    are recreated in dependency order, then jobs are brought back in line.
+
+    Returns the number of objects restored.
+    """
+    logger = logging.getLogger(__name__)
+    snapshot = load_snapshot(deployer, deploy_id)
+    if snapshot.schema != deployer.schema:
+        raise DeployableSQLError('Snapshot %s was taken of schema %s, not %s' % (
+            deploy_id, snapshot.schema, deployer.schema))
+
+    current = dict(((t, n.lower()), d) for (t, n), d in deployer.fetch_modules().items())
+    restored = 0
+
+    # what the deploy created is dropped first, then the rest put back
+    definitions = {}
+    for object_type, name, definition in snapshot.modules:
+        now = current.get((object_type, name.lower()))
+        if definition is None:
+            if now is not None:
+                deployer._current = (object_type, name)
+                deployer._apply(name, None, _if_drop(name, DROP_TYPES[object_type]),
+                                'Dropped %s: %s' % (object_type, name), module=False)
+                restored += 1
+        elif now is None or normalize_sql(now) != normalize_sql(definition):
+            definitions[(object_type, name)] = definition
+
+    names = dict((key[1].split('.')[-1].lower(), key) for key in definitions)
+    keys = sorted(definitions)
+    graph = dict((key, set(names[n] for n in find_references(definitions[key], names)
+                           if names[n] != key)) for key in keys)
+    for object_type, name in topological_order(keys, graph):
+        definition = definitions[(object_type, name)]
+        deployer._current = (object_type, name)
+        drop_sql, create_sql, module = deployer._create_or_alter(
+            object_type, name, _if_drop(name, DROP_TYPES[object_type]),
+            rewrite_create(definition, 'CREATE') or definition)
+        deployer._apply(name, drop_sql, create_sql, 'Restored %s: %s' % (
+            object_type, name), module=module)
+        restored += 1
+
+    jobs = deployer.fetch_jobs() if snapshot.jobs else {}
+    for job_name, previous in snapshot.jobs:
+        deployer._current = ('jobs', job_name)
+        now = jobs.get(job_name)
+        if previous is None:
+            if now is None:
+                continue
+            sql, message = _if_drop_job(job_name), 'Deleted job: %s' % job_name
+        elif now is None:
+            sql = read_job(job_definition(job_name, previous))[1]
+            message = 'Restored job: %s' % job_name
+        else:
+            statements = diff_job(job_definition(job_name, previous), now)
+            if not statements:
+                continue
+            sql, message = _msdb_batch(statements), 'Restored job: %s' % job_name
+        deployer._apply(job_name, None, sql, message, module=False)
+        restored += 1
+    deployer._current = None
+    deployer.flush()
+
+    table = deployer._schema_path(MANIFEST_TABLE)
+    statements = []
+    for folder, name, digest in snapshot.manifest:
+        if digest is None:
+            deployer.manifest.forget(folder, name)
+            statements.append('DELETE FROM %s WHERE object_type = %s AND '
+                              'object_name = %s;' % (table, _quote(folder), _quote(name)))
+        else:
+            deployer.manifest.record(folder, name, digest)
+            statements.append(_upsert_manifest(table, folder, name, digest))
+    if statements:
+        deployer._reset_db()
+        deployer._exec('\n'.join(statements), fetch=False)
+
+    logger.info('Rolled back %d objects to before deploy %s', restored, deploy_id)
+    return restored
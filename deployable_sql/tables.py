@@ -0,0 +1,635 @@
+"""
+Reads the CREATE TABLE statements in the tables folder, and works out the
+ALTERs which bring an existing table in line with its definition, without
+dropping it.
+
+Each change is rated by its impact, so that changes which touch every row of
+a large table, or lose data, are only made when they are asked for.
+"""
+from collections import namedtuple, OrderedDict
+import re
+
+from .exc import TableDefinitionError
+from .lexer import COMMENT, SYMBOL, tokenize, unquote
+
+
+# changes which only touch metadata, or are otherwise quick on any size of table
+ONLINE = 'online'
+# changes which read or rewrite every row
+SIZE_OF_DATA = 'size of data'
+# changes which lose data
+DESTRUCTIVE = 'destructive'
+# changes which ALTER TABLE cannot make, so the table must be rebuilt
+REBUILD = 'rebuild'
+# changes which cannot be made to a table with rows in it
+UNSUPPORTED = 'unsupported'
+
+IMPACTS = [ONLINE, SIZE_OF_DATA, DESTRUCTIVE, REBUILD, UNSUPPORTED]
+
+# indexes are the INDEX items of a definition, which are only rendered
+Table = namedtuple('Table', ['name', 'columns', 'constraints', 'indexes'])
+# seed is the seed and increment of an identity column, as written
+Column = namedtuple('Column', ['name', 'type', 'type_sql', 'nullable', 'identity',
+                               'seed', 'default', 'default_name'])
+Constraint = namedtuple('Constraint', ['name', 'kind', 'columns', 'definition', 'sql'])
+TableChange = namedtuple('TableChange', ['sql', 'impact', 'description'])
+
+TYPE_RE = re.compile(r'^(\w+)\s*(?:\(\s*(max|\d+)\s*(?:,\s*(\d+)\s*)?\))?$', re.I)
+
+TYPE_SYNONYMS = {
+    'integer': 'int',
+    'dec': 'decimal',
+    'character': 'char',
+    'rowversion': 'timestamp',
+}
+
+LENGTH_TYPES = ['char', 'varchar', 'binary', 'varbinary', 'nchar', 'nvarchar']
+# types whose values move out of row when they grow, so widening is metadata only
+VARIABLE_TYPES = ['varchar', 'varbinary', 'nvarchar']
+SCALE_TYPES = ['datetime2', 'time', 'datetimeoffset']
+
+CONSTRAINT_WORDS = ['CONSTRAINT', 'PRIMARY', 'UNIQUE', 'CHECK', 'FOREIGN']
+
+TABLE_COLUMNS_SQL = """SELECT t.name, c.name, ty.name, c.max_length, c.precision,
+    c.scale, c.is_nullable, c.is_identity, dc.name, dc.definition
+FROM sys.tables t
+JOIN sys.schemas s ON s.schema_id = t.schema_id
+JOIN sys.columns c ON c.object_id = t.object_id
+JOIN sys.types ty ON ty.user_type_id = c.user_type_id
+LEFT JOIN sys.default_constraints dc ON dc.object_id = c.default_object_id
+WHERE s.name = %(schema)s%(where)s
+ORDER BY t.name, c.column_id;"""
+
+TABLE_CONSTRAINTS_SQL = """SELECT t.name, k.name, k.type,
+    STUFF((SELECT ',' + c.name FROM sys.index_columns ic
+           JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+           WHERE ic.object_id = k.parent_object_id AND ic.index_id = k.unique_index_id
+           ORDER BY ic.key_ordinal FOR XML PATH('')), 1, 1, ''),
+    NULL
+FROM sys.key_constraints k
+JOIN sys.tables t ON t.object_id = k.parent_object_id
+JOIN sys.schemas s ON s.schema_id = t.schema_id
+WHERE s.name = %(schema)s%(where)s
+UNION ALL
+SELECT t.name, cc.name, cc.type, NULL, cc.definition
+FROM sys.check_constraints cc
+JOIN sys.tables t ON t.object_id = cc.parent_object_id
+JOIN sys.schemas s ON s.schema_id = t.schema_id
+WHERE s.name = %(schema)s%(where)s
+UNION ALL
+SELECT t.name, fk.name, fk.type,
+    STUFF((SELECT ',' + c.name FROM sys.foreign_key_columns fkc
+           JOIN sys.columns c ON c.object_id = fkc.parent_object_id
+                             AND c.column_id = fkc.parent_column_id
+           WHERE fkc.constraint_object_id = fk.object_id
+           ORDER BY fkc.constraint_column_id FOR XML PATH('')), 1, 1, ''),
+    OBJECT_SCHEMA_NAME(fk.referenced_object_id) + '.' + OBJECT_NAME(fk.referenced_object_id)
+FROM sys.foreign_keys fk
+JOIN sys.tables t ON t.object_id = fk.parent_object_id
+JOIN sys.schemas s ON s.schema_id = t.schema_id
+WHERE s.name = %(schema)s%(where)s;"""
+
+
+def normalize_expression(sql):
+    """
+    Returns an expression with whitespace, brackets and parentheses removed,
+    and lowercased, to compare it with the way the catalog stores it.
+    """
+    return re.sub(r'[\s\[\]()"]', '', sql or '').lower()
+
+def canonical_type(type_sql):
+    """
+    Returns a type as written in a table definition in the form the catalog
+    gives it, with default lengths filled in, such as varchar(1).
+    """
+    match = TYPE_RE.match(re.sub(r'[\[\]]', '', type_sql).strip())
+    if match is None:
+        return ' '.join(type_sql.lower().split())
+    name, first, second = match.groups()
+    name = TYPE_SYNONYMS.get(name.lower(), name.lower())
+    if name in LENGTH_TYPES:
+        return '%s(%s)' % (name, (first or '1').lower())
+    if name in ('decimal', 'numeric'):
+        return '%s(%s,%s)' % (name, first or 18, second or 0)
+    if name in SCALE_TYPES:
+        return '%s(%s)' % (name, first or 7)
+    if name == 'float':
+        return 'real' if first and int(first) <= 24 else 'float'
+    return name
+
+def catalog_type(name, max_length, precision, scale):
+    """
+    Returns a type from sys.columns in the form canonical_type gives.
+    """
+    name = name.lower()
+    if name in LENGTH_TYPES:
+        if max_length == -1:
+            return '%s(max)' % name
+        return '%s(%d)' % (name, max_length // 2 if name.startswith('n') else max_length)
+    if name in ('decimal', 'numeric'):
+        return '%s(%d,%d)' % (name, precision, scale)
+    if name in SCALE_TYPES:
+        return '%s(%d)' % (name, scale)
+    if name == 'float':
+        return 'real' if precision <= 24 else 'float'
+    return name
+
+def _type_parts(type_name):
+    """Returns the name and length of a canonical type."""
+    match = re.match(r'^(\w+)(?:\((\w+)\))?$', type_name)
+    if match is None:
+        return type_name, None
+    return match.group(1), match.group(2)
+
+
+class _Tokens(object):
+    """
+    The tokens of some sql, with comments dropped, which can be read one at a
+    time and sliced back into the original text.
+    """
+    def __init__(self, sql):
+        self.sql = sql
+        self.tokens = [t for t in tokenize(sql) if t.kind != COMMENT]
+        self.i = 0
+
+    def peek(self, offset=0):
+        """Returns the upper cased text of a token ahead, or ''."""
+        i = self.i + offset
+        return self.tokens[i].text.upper() if i < len(self.tokens) else ''
+
+    def next(self):
+        """Returns the next token's text and moves past it."""
+        token = self.tokens[self.i].text
+        self.i += 1
+        return token
+
+    def done(self):
+        """True when every token has been read."""
+        return self.i >= len(self.tokens)
+
+    def accept(self, *words):
+        """Moves past the next tokens if they are the given words."""
+        if all(self.peek(i) == word for i, word in enumerate(words)):
+            self.i += len(words)
+            return True
+        return False
+
+    def group(self):
+        """
+        Reads a parenthesized group, returning the text inside it.
+        """
+        if self.peek() != '(':
+            raise TableDefinitionError('Expected ( near "%s"' % self.peek())
+        start = self.tokens[self.i].end
+        depth = 0
+        while not self.done():
+            token = self.next()
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+                if depth == 0:
+                    return self.sql[start:self.tokens[self.i - 1].start].strip()
+        raise TableDefinitionError('Unbalanced parentheses')
+
+    def split(self):
+        """
+        Reads a parenthesized group, returning its text split at commas
+        which are not nested in further parentheses.
+        """
+        items = []
+        body = self.group()
+        depth = 0
+        start = 0
+        for token in tokenize(body):
+            if token.kind != SYMBOL:
+                continue
+            if token.text == '(':
+                depth += 1
+            elif token.text == ')':
+                depth -= 1
+            elif token.text == ',' and depth == 0:
+                items.append(body[start:token.start].strip())
+                start = token.end
+        items.append(body[start:].strip())
+        return [item for item in items if item]
+
+    def expression(self):
+        """
+        Reads a DEFAULT expression: a parenthesized group, or a literal or
+        function call, and returns its text.
+        """
+        start = self.tokens[self.i].start
+        if self.peek() == '(':
+            self.group()
+        else:
+            while self.peek() in ('-', '+'):
+                self.next()
+            self.next()
+            if self.peek() == '(':
+                self.group()
+        return self.sql[start:self.tokens[self.i - 1].end].strip()
+
+
+def _names(text):
+    """
+    Returns the column names in a list of columns, dropping any ASC or DESC.
+    """
+    return tuple(unquote(item.split()[0]).lower() for item in text.split(',') if item.strip())
+
+def _qualify(name, schema):
+    """Returns a table name with the schema added if it has none."""
+    parts = [unquote(part) for part in re.findall(r'\[[^\]]*\]|"[^"]*"|[^.]+', name)]
+    if len(parts) == 1:
+        parts.insert(0, schema)
+    return '.'.join(parts[-2:])
+
+def parse_table(sql, schema='dbo'):
+    """
+    Returns the Table defined by the CREATE TABLE statement in sql.
+    """
+    tokens = _Tokens(sql)
+    while not tokens.done() and not tokens.accept('CREATE', 'TABLE'):
+        tokens.next()
+    if tokens.done():
+        raise TableDefinitionError('No CREATE TABLE statement found')
+
+    name = tokens.next()
+    while tokens.peek() == '.':
+        name += tokens.next() + tokens.next()
+    name = _qualify(name, schema)
+
+    columns = OrderedDict()
+    constraints = []
+    indexes = []
+    for item in tokens.split():
+        first = _Tokens(item).peek()
+        if first in CONSTRAINT_WORDS:
+            constraints.append(_parse_constraint(item, schema))
+        elif first == 'INDEX':
+            indexes.append(item)
+        else:
+            column, inline = _parse_column(item, schema)
+            columns[column.name.lower()] = column
+            constraints.extend(inline)
+
+    # primary key columns are never nullable
+    for constraint in constraints:
+        if constraint.kind == 'PK':
+            for key in constraint.columns:
+                if key in columns:
+                    columns[key] = columns[key]._replace(nullable=False)
+    return Table(name, columns, constraints, indexes)
+
+def _parse_column(item, schema):
+    """
+    Returns a Column, and any constraints defined along with it.
+    """
+    tokens = _Tokens(item)
+    name = unquote(tokens.next())
+    start = tokens.tokens[tokens.i].start
+    tokens.next()
+    while tokens.peek() == '.':
+        tokens.next()
+        tokens.next()
+    if tokens.peek() == '(':
+        tokens.group()
+    type_sql = item[start:tokens.tokens[tokens.i - 1].end]
+
+    nullable = None
+    identity = False
+    seed = None
+    default = default_name = None
+    constraint_name = None
+    constraints = []
+    while not tokens.done():
+        if tokens.accept('NOT', 'NULL'):
+            nullable = False
+        elif tokens.accept('NULL'):
+            nullable = True
+        elif tokens.accept('IDENTITY'):
+            identity = True
+            if tokens.peek() == '(':
+                seed = tokens.group()
+        elif tokens.accept('CONSTRAINT'):
+            constraint_name = unquote(tokens.next())
+            continue
+        elif tokens.accept('DEFAULT'):
+            default = tokens.expression()
+            default_name = constraint_name
+        elif tokens.peek() in ('PRIMARY', 'UNIQUE'):
+            kind = 'PK' if tokens.accept('PRIMARY', 'KEY') else 'UQ'
+            tokens.accept('UNIQUE')
+            clustered = ''
+            if tokens.peek() in ('CLUSTERED', 'NONCLUSTERED'):
+                clustered = ' ' + tokens.next().upper()
+            constraints.append(_constraint(
+                constraint_name, kind, (name.lower(),), None,
+                '%s%s ([%s])' % ('PRIMARY KEY' if kind == 'PK' else 'UNIQUE',
+                                 clustered, name)))
+        elif tokens.accept('CHECK'):
+            tokens.accept('NOT', 'FOR', 'REPLICATION')
+            definition = tokens.group()
+            constraints.append(_constraint(
+                constraint_name, 'C', (), normalize_expression(definition),
+                'CHECK (%s)' % definition))
+        elif tokens.accept('FOREIGN', 'KEY') or tokens.peek() == 'REFERENCES':
+            tokens.accept('REFERENCES')
+            start = tokens.tokens[tokens.i].start
+            ref = tokens.next()
+            while tokens.peek() == '.':
+                ref += tokens.next() + tokens.next()
+            if tokens.peek() == '(':
+                tokens.group()
+            _skip_actions(tokens)
+            constraints.append(_constraint(
+                constraint_name, 'F', (name.lower(),), _qualify(ref, schema).lower(),
+                'FOREIGN KEY ([%s]) REFERENCES %s' % (
+                    name, item[start:tokens.tokens[tokens.i - 1].end])))
+        else:
+            # collations, sparse and the like are not compared
+            tokens.next()
+        constraint_name = None
+
+    if nullable is None:
+        nullable = not identity
+    column = Column(name, canonical_type(type_sql), type_sql, nullable, identity,
+                    seed, default, default_name)
+    return column, constraints
+
+def _skip_actions(tokens):
+    """
+    Moves past the ON DELETE and ON UPDATE actions of a foreign key.
+    """
+    while tokens.accept('ON'):
+        tokens.next()
+        if not (tokens.accept('NO', 'ACTION') or tokens.accept('CASCADE') or
+                tokens.accept('SET', 'NULL') or tokens.accept('SET', 'DEFAULT')):
+            raise TableDefinitionError('Unknown foreign key action near "%s"'
+                                       % tokens.peek())
+    tokens.accept('NOT', 'FOR', 'REPLICATION')
+
+def _parse_constraint(item, schema):
+    """
+    Returns the Constraint for a table constraint.
+    """
+    tokens = _Tokens(item)
+    name = unquote(tokens.next()) if tokens.accept('CONSTRAINT') else None
+    body = item[tokens.tokens[tokens.i].start:]
+    if tokens.peek() in ('PRIMARY', 'UNIQUE'):
+        kind = 'PK' if tokens.accept('PRIMARY', 'KEY') else 'UQ'
+        tokens.accept('UNIQUE')
+        if tokens.peek() in ('CLUSTERED', 'NONCLUSTERED'):
+            tokens.next()
+        return _constraint(name, kind, _names(tokens.group()), None, body)
+    if tokens.accept('CHECK'):
+        tokens.accept('NOT', 'FOR', 'REPLICATION')
+        return _constraint(name, 'C', (), normalize_expression(tokens.group()), body)
+    if tokens.accept('FOREIGN', 'KEY'):
+        columns = _names(tokens.group())
+        tokens.accept('REFERENCES')
+        ref = tokens.next()
+        while tokens.peek() == '.':
+            ref += tokens.next() + tokens.next()
+        return _constraint(name, 'F', columns, _qualify(ref, schema).lower(), body)
+    raise TableDefinitionError('Could not read constraint: %s' % item)
+
+def _constraint(name, kind, columns, definition, sql):
+    """
+    Returns a Constraint, with the CONSTRAINT name in its sql if it has one.
+    """
+    if name:
+        sql = 'CONSTRAINT [%s] %s' % (name, sql)
+    return Constraint(name, kind, columns, definition, sql)
+
+
+def read_catalog(column_rows, constraint_rows):
+    """
+    Returns the tables described by rows of the catalog queries, keyed by
+    their lowercased names.
+    """
+    tables = OrderedDict()
+    for (table, name, type_name, max_length, precision, scale, nullable,
+         identity, default_name, default) in column_rows:
+        columns = tables.setdefault(table.lower(), (table, OrderedDict(), []))[1]
+        type_sql = catalog_type(type_name, max_length, precision, scale)
+        columns[name.lower()] = Column(name, type_sql, type_sql, bool(nullable),
+                                       bool(identity), None, default, default_name)
+
+    for table, name, kind, columns, definition in constraint_rows:
+        if table.lower() not in tables:
+            continue
+        kind = kind.strip()
+        if kind == 'C':
+            definition = normalize_expression(definition)
+        elif definition is not None:
+            definition = definition.lower()
+        tables[table.lower()][2].append(Constraint(
+            name, kind, _names(columns or ''), definition, None))
+
+    return dict((key, Table(name, columns, constraints, []))
+                for key, (name, columns, constraints) in tables.items())
+
+def _same_constraint(wanted, existing):
+    """
+    True if an existing constraint is the one wanted. Check constraints are
+    stored rewritten, so named ones are matched by name, and others by their
+    definition. Keys are matched by their columns, whatever they are named.
+    """
+    if wanted.kind == 'C' and wanted.name:
+        return existing.kind == 'C' and existing.name.lower() == wanted.name.lower()
+    return ((wanted.kind, wanted.columns, wanted.definition) ==
+            (existing.kind, existing.columns, existing.definition))
+
+def _match_constraints(wanted, existing):
+    """
+    Returns the existing constraints which are not wanted, and the wanted
+    constraints which do not exist.
+    """
+    unmatched = list(existing)
+    missing = []
+    for constraint in wanted:
+        match = next((c for c in unmatched if _same_constraint(constraint, c)), None)
+        if match is None:
+            missing.append(constraint)
+        else:
+            unmatched.remove(match)
+    return unmatched, missing
+
+
+def diff_table(table, current, metadata_defaults=True):
+    """
+    Returns the changes needed to bring the current table in line with its
+    definition, in the order they should be made. Constraints are dropped
+    before columns change, and added after.
+
+    metadata_defaults says whether the server can add a NOT NULL column with
+    a default without writing to every row, as Enterprise edition and Azure
+    can since SQL Server 2012.
+
+    A named check constraint is only replaced when its name changes, as the
+    server keeps its own rewriting of the definition.
+    """
+    name = table.name
+    changes = []
+    dropped, added = _match_constraints(table.constraints, current.constraints)
+
+    for constraint in dropped:
+        impact = SIZE_OF_DATA if constraint.kind == 'PK' else ONLINE
+        changes.append(TableChange(
+            'ALTER TABLE %s DROP CONSTRAINT [%s];' % (name, constraint.name),
+            impact, 'drop constraint %s' % constraint.name))
+
+    for key, column in table.columns.items():
+        old = current.columns.get(key)
+        if old is None:
+            changes.append(_add_column(name, column, metadata_defaults))
+        else:
+            changes.extend(_alter_column(name, column, old))
+
+    for key, old in current.columns.items():
+        if key not in table.columns:
+            sql = 'ALTER TABLE %s DROP COLUMN [%s];' % (name, old.name)
+            if old.default_name:
+                sql = 'ALTER TABLE %s DROP CONSTRAINT [%s];\n%s' % (
+                    name, old.default_name, sql)
+            changes.append(TableChange(sql, DESTRUCTIVE, 'drop column %s' % old.name))
+
+    for constraint in added:
+        changes.append(TableChange(
+            'ALTER TABLE %s ADD %s;' % (name, constraint.sql), SIZE_OF_DATA,
+            'add constraint %s' % (constraint.name or constraint.sql)))
+
+    return changes
+
+def _default_name(table, column):
+    """Returns the name of a column's default constraint."""
+    return column.default_name or 'DF_%s_%s' % (table.split('.')[-1], column.name)
+
+def _default_sql(table, column, suffix=''):
+    """Returns the clause naming and adding a column's default."""
+    return 'CONSTRAINT [%s%s] DEFAULT %s' % (_default_name(table, column), suffix,
+                                             column.default)
+
+def _identity_sql(column):
+    """Returns the IDENTITY clause of a column, with its seed, or ''."""
+    if not column.identity:
+        return ''
+    return ' IDENTITY(%s)' % column.seed if column.seed else ' IDENTITY'
+
+def _add_column(table, column, metadata_defaults):
+    """
+    Returns the change adding a column.
+    """
+    sql = 'ALTER TABLE %s ADD [%s] %s%s %s' % (
+        table, column.name, column.type_sql, _identity_sql(column),
+        'NULL' if column.nullable else 'NOT NULL')
+    if column.default is not None:
+        sql += ' ' + _default_sql(table, column)
+    sql += ';'
+    description = 'add column %s' % column.name
+
+    if column.identity:
+        return TableChange(sql, SIZE_OF_DATA, description + ', numbering every row')
+    if column.nullable:
+        return TableChange(sql, ONLINE, description)
+    if column.default is None:
+        return TableChange(sql, UNSUPPORTED, description +
+                           ', which is NOT NULL without a default')
+    if metadata_defaults:
+        return TableChange(sql, ONLINE, description)
+    return TableChange(sql, SIZE_OF_DATA, description + ', writing its default to every row')
+
+def _alter_column(table, column, old):
+    """
+    Returns the changes to a column which exists already.
+    """
+    changes = []
+    if column.identity != old.identity:
+        return [TableChange(None, REBUILD, 'change identity of %s' % column.name)]
+
+    if column.type != old.type or column.nullable != old.nullable:
+        impact = ONLINE
+        details = []
+        if column.type != old.type:
+            details.append('%s to %s' % (old.type, column.type))
+            impact = max(impact, _type_impact(old.type, column.type), key=IMPACTS.index)
+        if column.nullable != old.nullable:
+            details.append('NULL' if column.nullable else 'NOT NULL')
+            if not column.nullable:
+                # every row is checked for nulls
+                impact = max(impact, SIZE_OF_DATA, key=IMPACTS.index)
+        changes.append(TableChange(
+            'ALTER TABLE %s ALTER COLUMN [%s] %s %s;' % (
+                table, column.name, column.type_sql,
+                'NULL' if column.nullable else 'NOT NULL'),
+            impact, 'alter column %s, %s' % (column.name, ', '.join(details))))
+
+    if normalize_expression(column.default) != normalize_expression(old.default):
+        sql = []
+        if old.default_name:
+            sql.append('ALTER TABLE %s DROP CONSTRAINT [%s];' % (table, old.default_name))
+        if column.default is not None:
+            sql.append('ALTER TABLE %s ADD %s FOR [%s];' % (
+                table, _default_sql(table, column), column.name))
+        changes.append(TableChange('\n'.join(sql), ONLINE,
+                                   'change default of %s' % column.name))
+    return changes
+
+def _type_impact(old, new):
+    """
+    Returns the impact of changing a column from one type to another. Only
+    widening a variable length column is metadata only.
+    """
+    old_name, old_length = _type_parts(old)
+    new_name, new_length = _type_parts(new)
+    if (old_name == new_name and old_name in VARIABLE_TYPES and
+            old_length != 'max' and new_length != 'max' and
+            int(new_length) >= int(old_length)):
+        return ONLINE
+    return SIZE_OF_DATA
+
+def render_table(table, name, suffix=''):
+    """
+    Returns a CREATE TABLE statement for a table under another name, with
+    suffix added to the names of its constraints, so that it can be built
+    alongside the table it will replace. Index names belong to their table,
+    so are kept.
+    """
+    lines = []
+    for column in table.columns.values():
+        line = '[%s] %s%s %s' % (column.name, column.type_sql, _identity_sql(column),
+                                 'NULL' if column.nullable else 'NOT NULL')
+        if column.default is not None:
+            line += ' ' + _default_sql(table.name, column, suffix)
+        lines.append(line)
+    for constraint in table.constraints:
+        sql = constraint.sql
+        if constraint.name:
+            sql = sql.replace('CONSTRAINT [%s]' % constraint.name,
+                              'CONSTRAINT [%s%s]' % (constraint.name, suffix), 1)
+        lines.append(sql)
+    lines.extend(table.indexes)
+    return 'CREATE TABLE %s (\n    %s\n);' % (name, ',\n    '.join(lines))
+
+def constraint_names(table):
+    """
+    Returns the names of a table's named constraints, including defaults.
+    """
+    names = [_default_name(table.name, c) for c in table.columns.values()
+             if c.default is not None]
+    return names + [c.name for c in table.constraints if c.name]
+
+def index_names(table):
+    """
+    Returns the names of the indexes a table's definition declares,
+    lowercased.
+    """
+    return set(unquote(_Tokens(index).tokens[1].text).lower() for index in table.indexes)
+
+def format_changes(changes):
+    """
+    Returns a list of changes as human readable lines.
+    """
+    return '\n'.join('    %-12s %s' % (change.impact, change.description)
+                     for change in changes)
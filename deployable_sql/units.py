@@ -0,0 +1,209 @@
+"""
+Deploy units, the one representation of a file shared by deploys, plans and
+release scripts: what the file defines, its content hash, the sql generated
+for it, and the other files it depends on.
+
+Units are read by a pipeline of threads, and handed on as each one is ready,
+so that on large projects reading files overlaps with deploying them.
+"""
+from collections import namedtuple
+import logging
+import os
+import threading
+
+from .folders import MODULE_FOLDERS
+from .lexer import names as sql_names
+from .manifest import content_hash
+
+try:
+    from queue import Queue
+except ImportError: # pragma: no cover
+    from Queue import Queue
+
+
+# the folders of objects which other objects can depend on
+DEPENDENCY_FOLDERS = ['tables'] + MODULE_FOLDERS
+
+# how many files are read at once
+READ_WORKERS = 4
+
+
+class DeployUnit(namedtuple('DeployUnit', [
+        'path', 'folder', 'object_type', 'name', 'digest', 'source', 'drop_sql',
+        'create_sql', 'dependencies', 'definition'])):
+    """
+    A file read for deploying. The folder and name key the manifest, and the
+    object type keys the report. The drop and create sql are None when the
+    unit was not rendered, and dependencies is a frozenset of paths. The
+    definition is the parsed yaml of a job or permissions unit loaded from a
+    bundle, and None otherwise.
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """The (object type, name) the report times the unit under."""
+        return self.object_type, self.name
+
+
+def object_name(path):
+    """
+    Returns the lowercased object name for a path, which is its basename.
+    """
+    return os.path.splitext(os.path.basename(path))[0].lower()
+
+def find_references(sql, names):
+    """
+    Returns the subset of names which are referenced in the sql, ignoring
+    anything in comments and strings.
+    """
+    return sql_names(sql) & set(names)
+
+def dependency_names(paths):
+    """
+    Returns the paths of objects which can be depended on, keyed by their
+    lowercased object name.
+    """
+    modules = {}
+    for path in paths:
+        if os.path.basename(os.path.dirname(path)) in DEPENDENCY_FOLDERS:
+            modules.setdefault(object_name(path), []).append(path)
+    return modules
+
+def find_dependencies(path, sql, modules):
+    """
+    Returns the set of paths, out of those in modules, which the sql at path
+    refers to.
+    """
+    deps = set()
+    for name in find_references(sql, modules):
+        deps.update(p for p in modules[name] if p != path)
+    return deps
+
+
+def read_unit(deployer, path, modules=None, render=None):
+    """
+    Reads the file at path into a DeployUnit, with its dependencies out of
+    modules, as returned by dependency_names. When render is None the sql is
+    only generated if the manifest says the file has changed.
+    """
+    folder = os.path.basename(os.path.dirname(path))
+    object_type = 'stored_procedures' if folder == 'sps' else folder
+    name = deployer._schema_path(os.path.splitext(os.path.basename(path))[0])
+
+    # the manifest is loaded before timing, as it is not this unit's work
+    manifest = deployer.manifest if render is None else None
+    previous = deployer._current
+    deployer._current = (object_type, name)
+    try:
+        with deployer._timed('parse'):
+            with open(path, 'rb') as stream:
+                data = stream.read()
+        with deployer._timed('hash'):
+            digest = content_hash(data, deployer.schema)
+        source = data.decode('utf-8').replace('\r\n', '\n')
+
+        dependencies = frozenset(find_dependencies(path, source, modules or {}))
+        if render is None:
+            render = deployer.force or not manifest.is_current(folder, name, digest)
+        drop_sql, create_sql = (deployer.render_unit(object_type, path, source)
+                                if render else (None, None))
+    finally:
+        deployer._current = previous
+
+    return DeployUnit(path, folder, object_type, name, digest, source, drop_sql,
+                      create_sql, dependencies, None)
+
+
+class UnitPipeline(object):
+    """
+    Reads paths into units on a pool of threads, each with its own clone of
+    the deployer, calling emit with each path, its unit and any error as
+    soon as it has been read. Units come out in the order they finish.
+    """
+    def __init__(self, deployer, paths, emit, workers=READ_WORKERS, render=None):
+        self.deployer = deployer
+        self.paths = list(paths)
+        self.emit = emit
+        self.workers = max(1, min(int(workers), len(self.paths)))
+        self.render = render
+        self.logger = logging.getLogger(__name__)
+        self._tasks = Queue()
+        self._threads = []
+        self._stopped = False
+
+    def start(self):
+        """
+        Starts reading, returning straight away.
+        """
+        if self.render is None:
+            # load the manifest up front, so the readers can share it
+            self.deployer.manifest # pylint: disable=pointless-statement
+        modules = dependency_names(self.paths)
+        for path in self.paths:
+            self._tasks.put(path)
+        for i in range(self.workers if self.paths else 0):
+            self._tasks.put(None)
+            thread = threading.Thread(target=self._work, args=(modules,),
+                                      name='unit-reader-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def join(self):
+        """
+        Waits for every path to be read.
+        """
+        for thread in self._threads:
+            thread.join()
+
+    def stop(self):
+        """
+        Stops reading once the files being read are done, and waits for the
+        readers to finish.
+        """
+        self._stopped = True
+        self.join()
+
+    def _work(self, modules):
+        """
+        Reads paths from the task queue, with a cloned deployer, until told
+        to stop.
+        """
+        deployer = self.deployer.clone()
+        try:
+            while not self._stopped:
+                path = self._tasks.get()
+                if path is None:
+                    break
+                try:
+                    unit = read_unit(deployer, path, modules, self.render)
+                except Exception as error: # pylint: disable=broad-except
+                    self.logger.exception('Failed to read: %s', path)
+                    self.emit(path, None, error)
+                else:
+                    self.emit(path, unit, None)
+        finally:
+            deployer.close()
+
+
+def read_units(deployer, paths, workers=READ_WORKERS, render=None):
+    """
+    Reads every path into a unit in parallel, returning them in the order of
+    paths. Raises the first error, if any file could not be read.
+    """
+    read = {}
+
+    def emit(path, unit, error):
+        read[path] = unit, error
+
+    pipeline = UnitPipeline(deployer, paths, emit, workers=workers, render=render)
+    try:
+        pipeline.start().join()
+    finally:
+        pipeline.stop()
+    for path in paths:
+        if read[path][1] is not None:
+            raise read[path][1]
+    return [read[path][0] for path in paths]
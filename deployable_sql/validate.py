@@ -0,0 +1,182 @@
+"""
+Checks the modules which depend on the objects a deploy changed, which can
+break, or keep stale metadata, when the objects under them are recreated.
+
+Dependents are found in one query, and refreshed with sp_refreshsqlmodule,
+which recompiles their metadata without running them.
+"""
+from collections import namedtuple
+import logging
+import os
+import threading
+
+from .deployers.pymssql_deployer import _quote
+from .units import DEPENDENCY_FOLDERS
+
+try:
+    from queue import Queue
+except ImportError: # pragma: no cover
+    from Queue import Queue
+
+
+# the dependents of objects, and their dependents in turn, by name, as the
+# ids of dependencies on recreated objects may not have been resolved yet.
+# Each level holds the distinct dependents of the level before, so that a
+# module reached by many paths is only followed once per level, and its
+# deepest level is the one it is refreshed at.
+DEPENDENTS_SQL = """SET NOCOUNT ON;
+DECLARE @deployed TABLE (schema_name sysname NULL, name sysname NULL, object_id int NULL);
+DECLARE @dependents TABLE (object_id int NOT NULL, depth int NOT NULL,
+    PRIMARY KEY (depth, object_id));
+DECLARE @depth int, @rows int;
+INSERT INTO @deployed (schema_name, name, object_id)
+SELECT PARSENAME(v.name, 2), PARSENAME(v.name, 1), OBJECT_ID(v.name)
+FROM (VALUES %(names)s) v (name);
+INSERT INTO @dependents (object_id, depth)
+SELECT DISTINCT d.referencing_id, 1
+FROM sys.sql_expression_dependencies d
+JOIN @deployed p ON d.referenced_id = p.object_id OR (
+    d.referenced_id IS NULL AND d.referenced_entity_name = p.name AND
+    COALESCE(d.referenced_schema_name,
+             OBJECT_SCHEMA_NAME(d.referencing_id)) = p.schema_name);
+SELECT @rows = @@ROWCOUNT, @depth = 1;
+WHILE @rows > 0 AND @depth < %(max_depth)d
+BEGIN
+    INSERT INTO @dependents (object_id, depth)
+    SELECT DISTINCT d.referencing_id, @depth + 1
+    FROM sys.sql_expression_dependencies d
+    JOIN @dependents c ON d.referenced_id = c.object_id
+    WHERE c.depth = @depth;
+    SELECT @rows = @@ROWCOUNT, @depth = @depth + 1;
+END
+SELECT OBJECT_SCHEMA_NAME(m.object_id) + '.' + OBJECT_NAME(m.object_id),
+    MAX(c.depth)
+FROM @dependents c
+JOIN sys.sql_modules m ON m.object_id = c.object_id
+WHERE m.is_schema_bound = 0 AND m.object_id NOT IN (
+    SELECT object_id FROM @deployed WHERE object_id IS NOT NULL)
+GROUP BY m.object_id
+ORDER BY MAX(c.depth), 1;"""
+
+# how far down a chain of dependents to look, which also stops cycles
+MAX_DEPTH = 32
+
+Validation = namedtuple('Validation', ['checked', 'invalid'])
+
+
+def deployed_names(deployer, paths):
+    """
+    Returns the names of the tables and modules deployed from paths, leaving
+    out any which were skipped as unchanged.
+    """
+    skipped = set(key for key, timing in deployer.report.objects.items()
+                  if timing.skipped)
+    names = []
+    for path in paths:
+        folder = os.path.basename(os.path.dirname(path))
+        folder = 'stored_procedures' if folder == 'sps' else folder
+        name = deployer._schema_path(os.path.splitext(os.path.basename(path))[0])
+        if folder in DEPENDENCY_FOLDERS and (folder, name) not in skipped:
+            names.append(name)
+    return names
+
+def fetch_dependents(deployer, names):
+    """
+    Returns the modules which depend on the named objects, directly or not,
+    as a list of lists, each of which only depends on the lists before it.
+    Schema bound modules are left out, as they cannot have been broken.
+    """
+    if not names:
+        return []
+    deployer._reset_db()
+    rows = deployer._exec(DEPENDENTS_SQL % {
+        'names': ', '.join('(%s)' % _quote(name) for name in names),
+        'max_depth': MAX_DEPTH,
+    })
+    levels = []
+    for name, depth in rows or []:
+        while len(levels) < depth:
+            levels.append([])
+        levels[depth - 1].append(name)
+    return [level for level in levels if level]
+
+
+def validate(deployer, names, workers=1):
+    """
+    Refreshes every module which depends on the named objects, a level of
+    dependents at a time, over up to workers connections. Returns how many
+    modules were checked, and the error of each invalid one, keyed by name.
+    """
+    logger = logging.getLogger(__name__)
+    invalid = {}
+    checked = 0
+    levels = fetch_dependents(deployer, names)
+
+    clones = []
+    tasks = Queue()
+    results = Queue()
+    threads = []
+    if workers > 1:
+        for i in range(workers):
+            clone = deployer.clone()
+            clones.append(clone)
+            thread = threading.Thread(target=_work, args=(clone, tasks, results),
+                                      name='validate-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+    try:
+        for level in levels:
+            for name in level:
+                if threads:
+                    tasks.put(name)
+                else:
+                    results.put(_refresh(deployer, name))
+            for _ in level:
+                name, error = results.get()
+                checked += 1
+                if error is not None:
+                    logger.error('Invalid module: %s\n%s', name, error)
+                    invalid[name] = error
+    finally:
+        for _ in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+        for clone in clones:
+            clone.close()
+
+    logger.info('Validated %d dependent modules, %d invalid', checked, len(invalid))
+    return Validation(checked, invalid)
+
+def _work(deployer, tasks, results):
+    """
+    Refreshes modules from the task queue until told to stop.
+    """
+    while True:
+        name = tasks.get()
+        if name is None:
+            break
+        results.put(_refresh(deployer, name))
+
+def _refresh(deployer, name):
+    """
+    Refreshes a module, returning its name and error, if it had one.
+    """
+    try:
+        deployer._reset_db()
+        deployer._exec('EXEC sp_refreshsqlmodule %s;' % _quote(name), fetch=False)
+    except Exception as error: # pylint: disable=broad-except
+        return name, error
+    return name, None
+
+def format_validation(validation):
+    """
+    Returns the result of a validation as a human readable report.
+    """
+    lines = ['Validated %d dependent modules, %d invalid' % (
+        validation.checked, len(validation.invalid))]
+    for name in sorted(validation.invalid):
+        lines.append('    %s: %s' % (name, validation.invalid[name]))
+    return '\n'.join(lines)
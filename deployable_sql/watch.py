@@ -0,0 +1,194 @@
+"""
+Watches the object folders, and deploys files as they are saved.
+
+Uses inotify where it is available, and polls the folders otherwise. Bursts
+of saves are debounced, so that each burst is deployed once.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+from .engine import DeployEngine
+
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def ignored(filename):
+    """
+    True for hidden files, and the swap and backup files editors leave behind.
+    """
+    return (filename.startswith('.') or filename.endswith('~') or
+            os.path.splitext(filename)[1] in ('.swp', '.swx', '.tmp'))
+
+
+class InotifyWatcher(object):
+    """
+    Reports changed files in a set of folders using inotify.
+    """
+    def __init__(self, folders):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, 'libc not found')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self.folders = {}
+        for folder in folders:
+            wd = self._libc.inotify_add_watch(self.fd, folder.encode('utf-8'), WATCH_MASK)
+            if wd < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(), 'Could not watch %s' % folder)
+            self.folders[wd] = folder
+
+    def changes(self, timeout):
+        """
+        Waits up to timeout seconds for changes, and returns the paths of any
+        files which changed.
+        """
+        ready = select.select([self.fd], [], [], timeout)[0]
+        if not ready:
+            return set()
+
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as error:
+            if error.errno == errno.EAGAIN:
+                return set()
+            raise
+
+        paths = set()
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8')
+            offset += length
+            if wd in self.folders and name and not ignored(name):
+                paths.add(os.path.join(self.folders[wd], name))
+        return paths
+
+    def close(self):
+        """Stops watching."""
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """
+    Reports changed files in a set of folders by comparing mtimes.
+    """
+    def __init__(self, folders, interval=0.5):
+        self.folders = list(folders)
+        self.interval = interval
+        self._mtimes = self._snapshot()
+
+    def changes(self, timeout):
+        """
+        Waits up to timeout seconds, checking for changes every interval, and
+        returns the paths of any files which changed.
+        """
+        deadline = time.time() + (timeout if timeout is not None else float('inf'))
+        while True:
+            time.sleep(max(0, min(self.interval, deadline - time.time())))
+            mtimes = self._snapshot()
+            paths = set(path for path in set(mtimes) | set(self._mtimes)
+                        if mtimes.get(path) != self._mtimes.get(path))
+            self._mtimes = mtimes
+            if paths or time.time() >= deadline:
+                return paths
+
+    def close(self):
+        """Stops watching."""
+        pass
+
+    def _snapshot(self):
+        """
+        Returns the mtime of every file in the folders.
+        """
+        mtimes = {}
+        for folder in self.folders:
+            for filename in os.listdir(folder):
+                if not ignored(filename):
+                    path = os.path.join(folder, filename)
+                    try:
+                        mtimes[path] = os.stat(path).st_mtime
+                    except OSError:
+                        pass
+        return mtimes
+
+
+def make_watcher(folders, poll=False):
+    """
+    Returns an inotify watcher for the folders, or a polling one if inotify
+    is unavailable or poll is set.
+    """
+    if not poll:
+        try:
+            return InotifyWatcher(folders)
+        except OSError as error:
+            logger.info('Falling back to polling: %s', error)
+    return PollingWatcher(folders)
+
+def wait_for_burst(watcher, debounce):
+    """
+    Blocks until something changes, then keeps collecting changes until none
+    have arrived for debounce seconds, and returns them all.
+    """
+    paths = set()
+    while not paths:
+        paths = watcher.changes(None)
+    while True:
+        more = watcher.changes(debounce)
+        if not more:
+            return paths
+        paths |= more
+
+def watch(deployer, folders, debounce=0.3, poll=False, bursts=None, before=None):
+    """
+    Deploys files in the folders as they change, over the deployer's warm
+    connection, until interrupted or after a number of bursts. If given,
+    before is called with the paths of each burst before they are deployed.
+    """
+    folders = [f for f in folders if os.path.isdir(f)]
+    watcher = make_watcher(folders, poll=poll)
+    logger.info('Watching %s', ', '.join(folders))
+    try:
+        while bursts is None or bursts > 0:
+            paths = wait_for_burst(watcher, debounce)
+            existing = sorted(p for p in paths if os.path.exists(p))
+            for path in sorted(paths - set(existing)):
+                logger.info('Ignoring deleted file: %s', path)
+
+            if existing:
+                if before is not None:
+                    before(existing)
+                DeployEngine(deployer).run(existing)
+                deployer.save_manifest()
+                logger.info(deployer.summary())
+            if bursts is not None:
+                bursts -= 1
+    except KeyboardInterrupt:
+        logger.info('Stopped watching')
+    finally:
+        watcher.close()
@@ -0,0 +1,46 @@
+"""
+Tests for writing files atomically
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from deployable_sql.atomic import atomic_write
+
+
+PATH = 'atomic.txt'
+
+
+class TestAtomicWrite(TestDeployableSql):
+    def teardown(self):
+        if os.path.exists(PATH):
+            os.remove(PATH)
+        super(TestAtomicWrite, self).teardown()
+
+    def read(self):
+        with open(PATH) as stream:
+            return stream.read()
+
+    def test_write(self):
+        for content in ('old', 'new'):
+            with atomic_write(PATH) as stream:
+                stream.write(content)
+            eq_(self.read(), content)
+        ok_(not os.path.exists(PATH + '.tmp'))
+
+    def test_failed_write(self):
+        with atomic_write(PATH) as stream:
+            stream.write('old')
+
+        def fail():
+            with atomic_write(PATH) as stream:
+                stream.write('partial')
+                raise ValueError('failed')
+        assert_raises(ValueError, fail)
+        eq_(self.read(), 'old')
+        ok_(not os.path.exists(PATH + '.tmp'))
@@ -0,0 +1,56 @@
+"""
+Tests for the benchmark harness
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from benchmarks import fake_pymssql
+from benchmarks.run import (format_results, load_results, run_size,
+                            save_results)
+from deployable_sql.deployers import pymssql_deployer
+
+
+RESULTS_PATH = 'bench_results.jsonl'
+
+
+class TestBenchmarks(TestDeployableSql):
+    def teardown(self):
+        if os.path.exists(RESULTS_PATH):
+            os.remove(RESULTS_PATH)
+        super(TestBenchmarks, self).teardown()
+
+    def test_installed(self):
+        original = pymssql_deployer.pymssql
+        with fake_pymssql.installed(0) as server:
+            eq_(pymssql_deployer.pymssql, fake_pymssql)
+            d = pymssql_deployer.PyMSSQLDeployer('usr', 'pwd', 'host', 'db')
+            d.test()
+            eq_(server.round_trips, 1)
+        eq_(pymssql_deployer.pymssql, original)
+
+    def test_run_size(self):
+        results = dict((r['bench'], r) for r in run_size(8, 0, None))
+        eq_(sorted(results), ['read_job', 'sync_file', 'sync_folder', 'sync_unchanged'])
+        eq_(results['sync_folder']['count'], 8)
+        eq_(results['sync_unchanged']['round_trips'], 0)
+        eq_(results['read_job']['count'], 2)
+        assert not os.path.exists(os.path.join('views', 'v_00000.sql'))
+
+    def test_batched_round_trips(self):
+        unbatched = run_size(8, 0, None)[0]
+        batched = run_size(8, 0, 10)[0]
+        assert batched['round_trips'] < unbatched['round_trips']
+
+    def test_results(self):
+        results = [dict(bench='sync_folder', size=8, latency_ms=1.0, batch=None,
+                        count=8, seconds=s, per_object_ms=1.0, round_trips=30,
+                        peak_kb=10, commit=c) for s, c in [(2.0, 'abc'), (1.0, 'def')]]
+        save_results(results[:1], RESULTS_PATH)
+        eq_(load_results(RESULTS_PATH), results[:1])
+        assert '-50.0% vs abc' in format_results(results[1:], results[:1])
@@ -0,0 +1,159 @@
+"""
+Tests for building release bundles and deploying from them
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+import shutil
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from .test_pymssql import FakeConnection, FakeCursor
+from deployable_sql.bundle import MAGIC, Bundle, build_bundle, load_bundle
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.engine import DEPLOY_FOLDERS, DeployEngine, list_folders
+from deployable_sql.exc import DeployableSQLError
+
+
+BUNDLE = 'release.bundle'
+
+
+class TestBundle(TestDeployableSql):
+    def setup(self):
+        super(TestBundle, self).setup()
+        # the jobs folder holds the test job already
+        for folder in ('views', 'functions', 'tables'):
+            os.mkdir(folder)
+        for folder, name, sql in [
+                ('views', 'a_top', 'SELECT x FROM dbo.b_base'),
+                ('views', 'b_base', 'SELECT 1 AS x'),
+                ('functions', 'f', 'CREATE FUNCTION dbo.f() RETURNS int AS BEGIN RETURN 1 END'),
+                ('tables', 't', 'CREATE TABLE dbo.t (a int)')]:
+            with open(os.path.join(folder, name + '.sql'), 'w') as stream:
+                stream.write(sql)
+
+    def teardown(self):
+        for path in (BUNDLE, BUNDLE + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+        super(TestBundle, self).teardown()
+
+    def deployer(self):
+        self.cursor = FakeCursor()
+        pool = ConnectionPool(lambda: FakeConnection(self.cursor), 'db')
+        d = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool)
+        d._load_manifest = lambda manifest: None
+        d.fetch_jobs = lambda job_name=None: {}
+        return d
+
+    def build(self):
+        paths = list_folders([os.path.join('.', f) for f in DEPLOY_FOLDERS])
+        return build_bundle(self.deployer(), paths, BUNDLE)
+
+    def test_round_trip(self):
+        bundle_id = self.build()
+        bundle = load_bundle(BUNDLE, self.deployer())
+        try:
+            eq_(bundle.id, bundle_id)
+            units = bundle.units()
+            paths = [unit.path for unit in units]
+            # tables first, and each view after what it selects from
+            eq_(sorted(paths), ['functions/f.sql', 'jobs/testjob.yml', 'tables/t.sql',
+                                'views/a_top.sql', 'views/b_base.sql'])
+            eq_(paths[0], 'tables/t.sql')
+            ok_(paths.index('views/b_base.sql') < paths.index('views/a_top.sql'))
+            top = units[paths.index('views/a_top.sql')]
+            eq_(top.name, 'dbo.a_top')
+            eq_(top.dependencies, frozenset(['views/b_base.sql']))
+            ok_(top.create_sql.startswith('CREATE VIEW dbo.a_top AS'))
+            ok_('DROP VIEW' in top.drop_sql)
+            eq_(units[0].create_sql, None)
+            job = units[paths.index('jobs/testjob.yml')]
+            eq_(list(job.definition), ['testjob'])
+            ok_('sp_add_job' in job.create_sql)
+        finally:
+            bundle.close()
+
+    def test_read_when_used(self):
+        self.build()
+        bundle = load_bundle(BUNDLE)
+        read = []
+        original = bundle.read
+        bundle.read = lambda key: read.append(key) or original(key)
+        try:
+            units = bundle.units(['views'])
+            eq_(read, [])
+            ok_(units[0].create_sql.startswith('CREATE VIEW dbo.b_base'))
+            eq_(len(read), 1)
+        finally:
+            bundle.close()
+
+    def test_blobs_stored_once(self):
+        self.build()
+        bundle = Bundle(BUNDLE)
+        try:
+            entries = dict((e['path'], e) for e in bundle.index['objects'])
+            # a function's source is deployed as is
+            function = entries['functions/f.sql']
+            eq_(function['source'], function['create_sql'])
+            eq_(len(bundle.index['blobs']), len(set(
+                e[field] for e in entries.values()
+                for field in ('source', 'drop_sql', 'create_sql', 'definition')
+                if field in e)))
+        finally:
+            bundle.close()
+
+    def test_id_stable(self):
+        first = self.build()
+        eq_(self.build(), first)
+        with open(os.path.join('views', 'b_base.sql'), 'w') as stream:
+            stream.write('SELECT 2 AS x')
+        ok_(self.build() != first)
+
+    def test_folders(self):
+        self.build()
+        bundle = load_bundle(BUNDLE)
+        try:
+            units = bundle.units(['views'])
+        finally:
+            bundle.close()
+        eq_([unit.name for unit in units], ['dbo.b_base', 'dbo.a_top'])
+
+    def test_not_a_bundle(self):
+        with open(BUNDLE, 'wb') as stream:
+            stream.write(b'CREATE VIEW nope')
+        assert_raises(DeployableSQLError, load_bundle, BUNDLE)
+
+    def test_wrong_schema(self):
+        self.build()
+        d = self.deployer()
+        d.schema = 'other'
+        assert_raises(DeployableSQLError, load_bundle, BUNDLE, d)
+        with open(BUNDLE, 'rb') as stream:
+            eq_(stream.read(len(MAGIC)), MAGIC)
+
+    def test_deploy(self):
+        self.build()
+        for folder in ('views', 'functions', 'tables'):
+            shutil.rmtree(folder)
+        os.remove(os.path.join('jobs', 'testjob.yml'))
+
+        d = self.deployer()
+        bundle = load_bundle(BUNDLE, d)
+        try:
+            units = bundle.units(['views', 'functions', 'jobs'])
+            engine = DeployEngine(d).run([unit.path for unit in units],
+                                         dict((unit.path, unit) for unit in units))
+            d.flush()
+        finally:
+            bundle.close()
+        ok_(engine.ok)
+        eq_(d.deployed, 4)
+        statements = self.cursor.statements
+        ok_(any(s.startswith('CREATE VIEW dbo.a_top AS') for s in statements))
+        ok_(any('sp_add_job' in s for s in statements))
+        eq_(d.manifest.get('views', 'dbo.b_base'), units[0].digest)
@@ -0,0 +1,118 @@
+"""
+Tests for the command line, run against the simulated server
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import copy
+import os
+import runpy
+import shutil
+import sys
+import threading
+
+from nose.tools import *
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from .tests import TestDeployableSql
+from benchmarks import fake_pymssql
+from deployable_sql.snapshot import SNAPSHOT_DIR
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI_PATH = os.path.join(ROOT, 'bin', 'deploy_sql.py')
+
+# how long a command may take before it is taken to be stuck
+TIMEOUT = 10
+
+
+class TestCli(TestDeployableSql):
+    def setup(self):
+        super(TestCli, self).setup()
+        os.mkdir('views')
+        for name, sql in [('a_base', 'SELECT 1 AS x'),
+                          ('b_top', 'SELECT x FROM dbo.a_base'),
+                          ('c_alone', 'SELECT 2 AS y'),
+                          ('d_alone', 'SELECT 3 AS z')]:
+            with open(os.path.join('views', name + '.sql'), 'w') as stream:
+                stream.write(sql)
+        self.main = runpy.run_path(CLI_PATH, run_name='deploy_sql')['main']
+        # leave the loggers of the other tests alone
+        loggers = copy.deepcopy(self.main.__globals__['LOGGERS'])
+        loggers['disable_existing_loggers'] = False
+        self.main.__globals__['LOGGERS'] = loggers
+
+    def teardown(self):
+        if os.path.exists(SNAPSHOT_DIR):
+            shutil.rmtree(SNAPSHOT_DIR)
+        super(TestCli, self).teardown()
+
+    def run(self, *argv):
+        """
+        Runs the command line with argv on the simulated server, failing if
+        it does not finish in time. Returns the simulated server, and keeps
+        what was printed in self.output.
+        """
+        outcome = {}
+
+        def target():
+            try:
+                self.main()
+            except SystemExit as exit:
+                outcome['exit'] = exit.code
+            except Exception as error: # pylint: disable=broad-except
+                outcome['error'] = error
+
+        previous = sys.argv, sys.stdout
+        sys.argv = ['deploy_sql.py', 'usr', 'pwd', 'host', 'db'] + list(argv)
+        sys.stdout = StringIO()
+        try:
+            with fake_pymssql.installed(0) as server:
+                thread = threading.Thread(target=target)
+                thread.daemon = True
+                thread.start()
+                thread.join(TIMEOUT)
+            self.output = sys.stdout.getvalue()
+        finally:
+            sys.argv, sys.stdout = previous
+        ok_(not thread.is_alive(), 'deploy_sql.py %s did not finish' % ' '.join(argv))
+        eq_(outcome.get('error'), None)
+        eq_(outcome.get('exit'), None)
+        return server
+
+    def test_workers(self):
+        server = self.run('--views', '-j', '2')
+        ok_(server.round_trips > 0)
+
+    def test_validate(self):
+        for argv in (['--views', '--validate'], ['--views', '--validate', '-j', '2']):
+            self.run(*argv)
+
+    def test_plan(self):
+        self.run('--views', '--plan')
+        ok_('4 create' in self.output)
+        ok_('Deployed' not in self.output)
+
+    def test_snapshots(self):
+        for argv in (['--views'], ['-f', 'a_base'],
+                     ['-f', os.path.join('views', 'c_alone.sql')]):
+            self.run(*argv)
+            ok_('To roll back this deploy' in self.output, argv)
+        eq_(len(os.listdir(SNAPSHOT_DIR)), 3)
+
+    def test_bundle(self):
+        sys.argv = ['deploy_sql.py', 'bundle', '--out=release.bundle']
+        try:
+            self.main()
+        finally:
+            sys.argv = sys.argv[:1]
+        shutil.rmtree('views')
+        server = self.run('--bundle=release.bundle')
+        ok_('Deployed 5 objects' in self.output, self.output)
+        ok_(server.round_trips > 0)
+        os.remove('release.bundle')
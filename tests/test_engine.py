@@ -0,0 +1,108 @@
+"""
+Tests for the dependency ordered deploy engine
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+import threading
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from deployable_sql.deployers.base_deployer import BaseDeployer
+from deployable_sql.engine import (DeployEngine, build_graph, list_folders,
+                                   topological_order)
+from deployable_sql.units import find_references
+
+
+class RecordingDeployer(BaseDeployer):
+    def __init__(self, fail=(), **kwargs):
+        super(RecordingDeployer, self).__init__(force=True, **kwargs)
+        self.fail = fail
+        self.synced = []
+        self.lock = threading.Lock()
+
+    def sync_view(self, path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in self.fail:
+            raise ValueError(name)
+        with self.lock:
+            self.synced.append(name)
+
+    sync_function = sync_view
+
+
+class TestDeployEngine(TestDeployableSql):
+    def write(self, folder, name, sql):
+        if not os.path.exists(folder):
+            os.mkdir(folder)
+        path = os.path.join(folder, name + '.sql')
+        with open(path, 'w') as stream:
+            stream.write(sql)
+        return path
+
+    def write_project(self):
+        self.write('views', 'a_top', 'SELECT * FROM dbo.b_middle')
+        self.write('views', 'b_middle', 'SELECT dbo.c_func(x) FROM [dbo].[d_base]')
+        self.write('views', 'd_base', 'SELECT 1 AS x -- not c_func')
+        self.write('views', 'e_alone', 'SELECT 2 AS y')
+        self.write('functions', 'c_func', 'CREATE FUNCTION dbo.c_func() ...')
+        return list_folders(['views', 'functions'])
+
+    def test_find_references(self):
+        refs = find_references('SELECT * FROM [dbo].[Foo] /* bar */ -- baz',
+                               ['foo', 'bar', 'baz'])
+        eq_(refs, set(['foo']))
+
+    def test_build_graph(self):
+        paths = self.write_project()
+        graph = build_graph(paths)
+        eq_(graph[os.path.join('views', 'b_middle.sql')],
+            set([os.path.join('views', 'd_base.sql'),
+                 os.path.join('functions', 'c_func.sql')]))
+        eq_(graph[os.path.join('views', 'd_base.sql')], set())
+
+    def check_order(self, synced):
+        for dep, obj in [('b_middle', 'a_top'), ('d_base', 'b_middle'),
+                         ('c_func', 'b_middle')]:
+            assert_less(synced.index(dep), synced.index(obj))
+
+    def test_topological_order(self):
+        paths = self.write_project()
+        names = [os.path.splitext(os.path.basename(p))[0]
+                 for p in topological_order(paths)]
+        eq_(names, ['d_base', 'e_alone', 'c_func', 'b_middle', 'a_top'])
+
+    def test_serial_order(self):
+        d = RecordingDeployer()
+        engine = DeployEngine(d).run(self.write_project())
+        ok_(engine.ok)
+        eq_(len(d.synced), 5)
+        self.check_order(d.synced)
+
+    def test_parallel_order(self):
+        d = RecordingDeployer()
+        engine = DeployEngine(d, workers=3).run(self.write_project())
+        ok_(engine.ok)
+        eq_(sorted(d.synced), ['a_top', 'b_middle', 'c_func', 'd_base', 'e_alone'])
+        self.check_order(d.synced)
+        eq_(d.deployed, 5)
+
+    def test_failure_blocks_dependents(self):
+        d = RecordingDeployer(fail=('d_base',))
+        engine = DeployEngine(d, workers=2).run(self.write_project())
+        assert_false(engine.ok)
+        eq_(list(engine.failed), [os.path.join('views', 'd_base.sql')])
+        eq_(sorted(engine.blocked), [os.path.join('views', 'a_top.sql'),
+                                     os.path.join('views', 'b_middle.sql')])
+        eq_(sorted(d.synced), ['c_func', 'e_alone'])
+
+    def test_cycle(self):
+        self.write('views', 'x', 'SELECT * FROM y')
+        self.write('views', 'y', 'SELECT * FROM x')
+        d = RecordingDeployer()
+        engine = DeployEngine(d).run(list_folders(['views']))
+        eq_(sorted(d.synced), ['x', 'y'])
+        ok_(engine.ok)
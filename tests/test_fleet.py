@@ -0,0 +1,105 @@
+"""
+Tests for fleet deploys
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+import threading
+import time
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from .test_pymssql import FakeConnection, FakeCursor
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.exc import DeployableSQLError
+from deployable_sql.fleet import (FleetRunner, Target, format_report,
+                                  load_targets, resolve_credentials)
+
+
+TARGETS = """
+defaults:
+  credentials: prod
+targets:
+  - host: sql01
+    db: tenant_a
+  - host: sql01
+    db: tenant_b
+  - host: sql01
+    db: tenant_c
+  - host: sql02
+    db: tenant_d
+    schema: cu
+    credentials: other
+"""
+
+CONFIG = {'credentials': {'prod': {'usr': 'deployer', 'pwd': 'secret'},
+                          'other': {'usr': 'other', 'pwd': 'secret'}}}
+
+
+class TestFleet(TestDeployableSql):
+    def setup(self):
+        super(TestFleet, self).setup()
+        with open('targets.yml', 'w') as stream:
+            stream.write(TARGETS)
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+        self.connections = []
+
+    def teardown(self):
+        super(TestFleet, self).teardown()
+        os.remove('targets.yml')
+
+    def test_load_targets(self):
+        targets = load_targets('targets.yml')
+        eq_(len(targets), 4)
+        eq_(targets[0], Target('sql01', 'tenant_a', 'dbo', 'prod'))
+        eq_(targets[3], Target('sql02', 'tenant_d', 'cu', 'other'))
+
+    def test_resolve_credentials(self):
+        eq_(resolve_credentials('prod', CONFIG), ('deployer', 'secret'))
+        os.environ['DEPLOYABLE_ENV_CREDS_USR'] = 'env_user'
+        os.environ['DEPLOYABLE_ENV_CREDS_PWD'] = 'env_pwd'
+        try:
+            eq_(resolve_credentials('env-creds', {}), ('env_user', 'env_pwd'))
+        finally:
+            del os.environ['DEPLOYABLE_ENV_CREDS_USR']
+            del os.environ['DEPLOYABLE_ENV_CREDS_PWD']
+        assert_raises(DeployableSQLError, resolve_credentials, 'missing', {})
+
+    def connect(self, host, usr, pwd, db):
+        conn = FakeConnection(FakeCursor())
+        with self.lock:
+            self.connections.append((host, db))
+        return conn
+
+    def deploy(self, d):
+        d._reset_db()
+        with self.lock:
+            self.active[d.host] = self.active.get(d.host, 0) + 1
+            self.peak[d.host] = max(self.peak.get(d.host, 0), self.active[d.host])
+        time.sleep(0.05)
+        with self.lock:
+            self.active[d.host] -= 1
+        if d.db == 'tenant_c':
+            raise ValueError('tenant_c is broken')
+        return True
+
+    def make_deployer(self, usr, pwd, host, db, schema, pool):
+        return PyMSSQLDeployer(usr, pwd, host, db, schema=schema, pool=pool)
+
+    def test_run(self):
+        runner = FleetRunner(load_targets('targets.yml'), self.make_deployer,
+                             self.deploy, concurrency=4, per_host=2,
+                             connect=self.connect, config=CONFIG)
+        results = runner.run()
+        eq_([r.ok for r in results], [True, True, False, True])
+        eq_(self.peak['sql01'], 2)
+        # the third sql01 target reuses a connection, switching databases
+        eq_(len([c for c in self.connections if c[0] == 'sql01']), 2)
+        report = format_report(results)
+        ok_('tenant_c is broken' in report)
+        ok_('4 targets, 3 succeeded, 1 failed' in report)
@@ -0,0 +1,110 @@
+"""
+Tests for git range driven deploys
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from .test_pymssql import FakeConnection, FakeCursor
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.exc import GitError
+from deployable_sql.folders import run_setup
+from deployable_sql.gitdiff import git, git_changes
+
+
+class TestGitChanges(TestDeployableSql):
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        super(TestGitChanges, self).setup()
+        run_setup('blank', 'whatever', gitinit=False)
+        git('init', '-q')
+        git('config', 'user.email', 'test@example.com')
+        git('config', 'user.name', 'test')
+        for name in ['keep', 'edit', 'remove', 'old_name']:
+            self.write(os.path.join('views', name + '.sql'), 'SELECT 1 AS %s' % name)
+        self.commit()
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def write(self, path, sql):
+        with open(path, 'w') as stream:
+            stream.write(sql)
+
+    def commit(self):
+        git('add', '-A')
+        git('commit', '-q', '-m', 'commit')
+
+    def test_changes(self):
+        self.write(os.path.join('views', 'edit.sql'), 'SELECT 2 AS edit')
+        self.write(os.path.join('views', 'added.sql'), 'SELECT 3 AS added')
+        os.remove(os.path.join('views', 'remove.sql'))
+        git('mv', os.path.join('views', 'old_name.sql'),
+            os.path.join('views', 'new_name.sql'))
+        self.commit()
+
+        changes = git_changes(rev_range='HEAD~1..HEAD')
+        eq_(sorted(changes.deploy), [os.path.join('views', f) for f in
+                                     ['added.sql', 'edit.sql', 'new_name.sql']])
+        eq_(sorted(changes.delete), [
+            (os.path.join('views', 'old_name.sql'), 'SELECT 1 AS old_name'),
+            (os.path.join('views', 'remove.sql'), 'SELECT 1 AS remove'),
+        ])
+
+    def test_rename_keeps_object(self):
+        os.mkdir('sps')
+        self.write(os.path.join('sps', 'get_things.sql'),
+                   'CREATE PROCEDURE dbo.get_things AS SELECT 1')
+        self.commit()
+        git('mv', os.path.join('sps', 'get_things.sql'),
+            os.path.join('stored_procedures', 'get_things.sql'))
+        git('mv', os.path.join('views', 'keep.sql'), os.path.join('views', 'KEEP.sql'))
+        self.commit()
+
+        changes = git_changes(rev_range='HEAD~1..HEAD', folders=[
+            'sps', 'stored_procedures', 'views'])
+        eq_(sorted(changes.deploy), [os.path.join('stored_procedures', 'get_things.sql'),
+                                     os.path.join('views', 'KEEP.sql')])
+        eq_(changes.delete, [])
+
+    def test_since_includes_uncommitted(self):
+        self.write(os.path.join('views', 'edit.sql'), 'SELECT 2 AS edit')
+        eq_(git_changes(since='HEAD').deploy, [os.path.join('views', 'edit.sql')])
+
+    @raises(GitError)
+    def test_bad_ref(self):
+        git_changes(since='no_such_ref')
+
+    @raises(GitError)
+    def test_bad_range(self):
+        git_changes(rev_range='HEAD')
+
+
+class TestDropFile(TestDeployableSql):
+    def setup(self):
+        super(TestDropFile, self).setup()
+        self.cursor = FakeCursor()
+        pool = ConnectionPool(lambda: FakeConnection(self.cursor), 'db')
+        self.d = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool)
+
+    def test_drop_view(self):
+        self.d.drop_file(os.path.join('views', 'gone.sql'), 'SELECT 1')
+        ok_(any('DROP VIEW dbo.gone' in sql for sql in self.cursor.statements))
+
+    def test_drop_job(self):
+        with open(os.path.join('jobs', 'testjob.yml')) as stream:
+            source = stream.read()
+        self.d.drop_file(os.path.join('jobs', 'renamed.yml'), source)
+        ok_(any("name = 'testjob'" in sql and 'sp_delete_job' in sql
+                for sql in self.cursor.statements))
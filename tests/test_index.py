@@ -0,0 +1,65 @@
+"""
+Tests for the project index
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+import time
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from deployable_sql.deployers.base_deployer import BaseDeployer
+from deployable_sql.folders import run_setup
+from deployable_sql.index import ProjectIndex, INDEX_PATH
+
+
+class TestProjectIndex(TestDeployableSql):
+    def setup(self):
+        super(TestProjectIndex, self).setup()
+        run_setup('blank', 'whatever', gitinit=False)
+        self.touch('views', 'my_view.sql')
+        self.touch('functions', 'my_func.sql')
+
+    def touch(self, folder, filename):
+        with open(os.path.join(folder, filename), 'w') as stream:
+            stream.write('SELECT 1')
+
+    def test_lookup(self):
+        index = ProjectIndex()
+        eq_(index.lookup('my_view.sql'), [os.path.join('views', 'my_view.sql')])
+        eq_(index.lookup('my_func'), [os.path.join('functions', 'my_func.sql')])
+        eq_(index.lookup('nope.sql'), [])
+
+    def test_persisted(self):
+        ProjectIndex().refresh()
+        assert os.path.exists(INDEX_PATH)
+        index = ProjectIndex()
+        eq_(index._listings['views']['files'], ['my_view.sql'])
+
+    def test_failed_save(self):
+        index = ProjectIndex()
+        index.refresh()
+        index._listings['views']['files'].append(object())
+        assert_raises(TypeError, index.save)
+        eq_(ProjectIndex()._listings['views']['files'], ['my_view.sql'])
+        assert not os.path.exists(INDEX_PATH + '.tmp')
+
+    def test_invalidated(self):
+        index = ProjectIndex()
+        eq_(index.lookup('new_view'), [])
+        time.sleep(0.01)
+        self.touch('views', 'new_view.sql')
+        eq_(ProjectIndex().lookup('new_view'), [os.path.join('views', 'new_view.sql')])
+
+    def test_files(self):
+        eq_(ProjectIndex().files(os.path.join('.', 'views')),
+            [os.path.join('.', 'views', 'my_view.sql')])
+
+    def test_ambiguous(self):
+        self.touch('stored_procedures', 'my_view.sql')
+        d = BaseDeployer()
+        assert_is_none(d._detect_path('my_view.sql'))
+        eq_(d._detect_path('my_func')[0], 'functions')
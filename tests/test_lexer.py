@@ -0,0 +1,90 @@
+"""
+Tests for the T-SQL lexer
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+from timeit import default_timer
+
+from nose.tools import *
+
+from deployable_sql.lexer import (Batch, iter_batches, names, normalize,
+                                  remove_order_by, rewrite_create, split_batches,
+                                  tokenize)
+
+
+class TestLexer(object):
+    def test_tokenize(self):
+        sql = "SELECT N'it''s' AS [a]]b] /* x /* nested */ y */ FROM \"t\" -- end"
+        eq_([(t.kind, t.text) for t in tokenize(sql)], [
+            ('name', 'SELECT'), ('string', "N'it''s'"), ('name', 'AS'),
+            ('name', '[a]]b]'), ('comment', '/* x /* nested */ y */'),
+            ('name', 'FROM'), ('name', '"t"'), ('comment', '-- end')])
+        eq_([sql[t.start:t.end] for t in tokenize(sql)], [t.text for t in tokenize(sql)])
+
+    def test_unterminated(self):
+        eq_([t.kind for t in tokenize("SELECT 'open")], ['name', 'string'])
+        eq_([t.kind for t in tokenize('SELECT /* open */ /* still')],
+            ['name', 'comment', 'comment'])
+
+    def test_names(self):
+        sql = "SELECT * FROM [dbo].[Foo] /* bar */ -- baz\nWHERE x = 'qux'"
+        eq_(names(sql) & set(['foo', 'bar', 'baz', 'qux']), set(['foo']))
+
+    def test_normalize(self):
+        eq_(normalize("SELECT  'a  b' -- c\n , x /* d */FROM y"),
+            "SELECT 'a  b' , x FROM y")
+
+    def test_remove_order_by(self):
+        sql = ("SELECT a, ROW_NUMBER() OVER (ORDER BY b) AS n\n"
+               "FROM t -- ORDER BY in a comment\n"
+               "WHERE c = 'ORDER BY' AND d IN (SELECT TOP 1 d FROM u ORDER BY d)\n"
+               "ORDER BY a DESC, b\n")
+        eq_(remove_order_by(sql), sql.replace('ORDER BY a DESC, b', ''))
+        eq_(remove_order_by('SELECT a FROM t ORDER BY a OPTION (MAXDOP 1)'),
+            'SELECT a FROM t  OPTION (MAXDOP 1)')
+
+    def test_keep_order_by(self):
+        for sql in ['SELECT TOP 10 a FROM t ORDER BY a',
+                    'SELECT a FROM t ORDER BY a OFFSET 10 ROWS',
+                    'SELECT a FROM t ORDER BY a FOR XML PATH']:
+            eq_(remove_order_by(sql), sql)
+        eq_(remove_order_by('SELECT TOP 1 a FROM t ORDER BY a; SELECT b FROM u ORDER BY b'),
+            'SELECT TOP 1 a FROM t ORDER BY a; SELECT b FROM u ')
+
+    def test_split_batches(self):
+        sql = ("CREATE PROC a AS SELECT 1\n"
+               "GO\n"
+               "-- only a comment\n"
+               "go 2 -- twice\n"
+               "/* GO\n*/ SELECT 'GO\nGO'\n"
+               "GO\n\n")
+        eq_(split_batches(sql), [
+            Batch('CREATE PROC a AS SELECT 1\n', 1),
+            Batch("/* GO\n*/ SELECT 'GO\nGO'\n", 5)])
+        eq_(split_batches('SELECT 1\nGO 2\nSELECT 2'), [
+            Batch('SELECT 1\n', 1), Batch('SELECT 1\n', 1), Batch('SELECT 2', 3)])
+        eq_(split_batches('SELECT go FROM t'), [Batch('SELECT go FROM t', 1)])
+
+    def test_iter_batches(self):
+        batches = iter_batches('SELECT 1\nGO\nSELECT 2\nGO\n')
+        eq_(next(batches), Batch('SELECT 1\n', 1))
+        eq_(list(batches), [Batch('SELECT 2\n', 3)])
+
+    def test_rewrite_create(self):
+        eq_(rewrite_create('/* a /* b */ */\ncreate or alter view v as select 1', 'ALTER'),
+            '/* a /* b */ */\nALTER view v as select 1')
+        assert_is_none(rewrite_create('CREATE TABLE t (a int)', 'ALTER'))
+        assert_is_none(rewrite_create('', 'ALTER'))
+
+    def test_linear(self):
+        body = "SELECT a, 'x' FROM t /* c */ WHERE b = 1 -- d\nORDER BY a\n"
+        small, large = body * 2000, body * 20000
+        timings = []
+        for sql in (small, large):
+            start = default_timer()
+            remove_order_by(sql)
+            timings.append(default_timer() - start)
+        # ten times the sql, allowing for noise, but not a quadratic blow up
+        assert_less(timings[1], timings[0] * 30)
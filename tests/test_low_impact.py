@@ -0,0 +1,165 @@
+"""
+Tests for low impact deploys, which give up on locks and retry
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+
+from nose.tools import *
+import pymssql
+
+from .tests import TestDeployableSql
+from .test_engine import RecordingDeployer
+from .test_pymssql import FakeConnection, FakeCursor
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import (PyMSSQLDeployer, _msdb_batch,
+                                                       _retryable, _transaction)
+from deployable_sql.engine import DeployEngine, list_folders
+from deployable_sql.exc import ScriptError
+
+
+class LockedCursor(FakeCursor):
+    """Times out on sql containing a string, the given number of times."""
+    def __init__(self, locked_on, times, number=1222):
+        super(LockedCursor, self).__init__()
+        self.locked_on = locked_on
+        self.times = times
+        self.number = number
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        if self.times and self.locked_on in sql:
+            self.times -= 1
+            raise pymssql.OperationalError(self.number, b'Lock request time out')
+
+
+class FlakyDeployer(RecordingDeployer):
+    """Fails views as a deadlock victim, once unless told otherwise."""
+    def __init__(self, flaky, once=True, **kwargs):
+        super(FlakyDeployer, self).__init__(**kwargs)
+        self.flaky = set(flaky)
+        self.once = once
+
+    def sync_view(self, path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in self.flaky:
+            if self.once:
+                self.flaky.discard(name)
+            raise pymssql.OperationalError(1205, b'Chosen as deadlock victim')
+        super(FlakyDeployer, self).sync_view(path)
+
+    def is_transient(self, error):
+        return getattr(error, 'args', (None,))[0] == 1205
+
+
+class TestLowImpact(TestDeployableSql):
+    def setup(self):
+        super(TestLowImpact, self).setup()
+        os.mkdir('views')
+        for name, sql in [('a_base', 'SELECT 1 AS x'),
+                          ('b_top', 'SELECT x FROM dbo.a_base'),
+                          ('c_alone', 'SELECT 2 AS y')]:
+            with open(os.path.join('views', name + '.sql'), 'w') as stream:
+                stream.write(sql)
+
+    def deployer(self, cursor, **kwargs):
+        self.cursor = cursor
+        pool = ConnectionPool(lambda: FakeConnection(cursor), 'db')
+        d = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool,
+                            retry_backoff=0, **kwargs)
+        d._load_manifest = lambda manifest: None
+        return d
+
+    def test_session_settings(self):
+        d = self.deployer(FakeCursor(), lock_timeout=2000)
+        d.sync_file(os.path.join('views', 'c_alone.sql'))
+        eq_(self.cursor.statements[0], 'SET LOCK_TIMEOUT 2000;\nSET DEADLOCK_PRIORITY LOW;')
+        eq_(len([s for s in self.cursor.statements if 'LOCK_TIMEOUT' in s]), 1)
+
+    def test_default_session_restored(self):
+        d = self.deployer(FakeCursor(), lock_timeout=2000)
+        d.test()
+        d._disconnect()
+        other = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=d.pool)
+        other.test()
+        ok_('SET LOCK_TIMEOUT -1;\nSET DEADLOCK_PRIORITY NORMAL;' in self.cursor.statements)
+
+    def test_no_settings_by_default(self):
+        d = self.deployer(FakeCursor())
+        d.sync_file(os.path.join('views', 'c_alone.sql'))
+        ok_(not any('LOCK_TIMEOUT' in s for s in self.cursor.statements))
+
+    def test_retry(self):
+        d = self.deployer(LockedCursor('DROP VIEW', 2), lock_timeout=100)
+        d.sync_file(os.path.join('views', 'c_alone.sql'))
+        eq_(d.deployed, 1)
+        timing = d.report.objects[('views', 'dbo.c_alone')]
+        eq_(timing.retries, 2)
+        eq_(d.report.to_dict()['retries'], 2)
+        # the database is switched back to before each retry
+        eq_(len([s for s in self.cursor.statements if 'DROP VIEW' in s]), 3)
+
+    def test_retries_run_out(self):
+        d = self.deployer(LockedCursor('DROP VIEW', 5), lock_timeout=100, lock_retries=2)
+        assert_raises(pymssql.OperationalError, d.sync_file,
+                      os.path.join('views', 'c_alone.sql'))
+        eq_(d.report.retries, 2)
+
+    def test_script_not_retried(self):
+        os.mkdir('scripts')
+        path = os.path.join('scripts', 'backfill.sql')
+        with open(path, 'w') as stream:
+            stream.write("INSERT INTO dbo.log VALUES (1);\nUPDATE dbo.t SET x = 1;")
+        d = self.deployer(LockedCursor('UPDATE dbo.t', 1), lock_timeout=100)
+        assert_raises(ScriptError, d.sync_file, path)
+        # the insert may have committed, so the batch is not sent again
+        eq_(len([s for s in self.cursor.statements if 'INSERT INTO dbo.log' in s]), 1)
+        eq_(d.report.retries, 0)
+
+    def test_transaction_retried(self):
+        d = self.deployer(LockedCursor('UPDATE dbo.t', 1), lock_timeout=100)
+        d._exec(_transaction(['INSERT INTO dbo.log VALUES (1);',
+                              'UPDATE dbo.t SET x = 1;']), fetch=False)
+        eq_(d.report.retries, 1)
+        d._exec('USE msdb;\n' + _transaction(['UPDATE dbo.t SET x = 1;']), fetch=False)
+        self.cursor.times = 1
+        assert_raises(pymssql.OperationalError, d._exec,
+                      'INSERT INTO dbo.log VALUES (1);\nUPDATE dbo.t SET x = 1;', fetch=False)
+        eq_(d.report.retries, 1)
+
+    def test_retryable(self):
+        ok_(_retryable('CREATE VIEW dbo.v AS SELECT 1 AS x'))
+        ok_(_retryable(_msdb_batch(['EXEC sp_update_job @job_name = N\'j\';'])))
+        ok_(not _retryable('UPDATE dbo.t SET x = 1;\nCOMMIT TRANSACTION;'))
+        ok_(not _retryable('SET XACT_ABORT ON;\nBEGIN TRANSACTION;\nUPDATE dbo.t SET x = 1;'))
+
+    def test_not_retried_by_default(self):
+        d = self.deployer(LockedCursor('DROP VIEW', 1))
+        assert_raises(pymssql.OperationalError, d.sync_file,
+                      os.path.join('views', 'c_alone.sql'))
+        ok_(not d.is_transient(pymssql.OperationalError(1222, b'')))
+
+    def test_transient(self):
+        d = self.deployer(FakeCursor(), lock_timeout=100)
+        ok_(d.is_transient(pymssql.OperationalError(1205, b'')))
+        ok_(not d.is_transient(pymssql.OperationalError(208, b'')))
+        ok_(not d.is_transient(ValueError('x')))
+        locked = pymssql.OperationalError(1222, b'')
+        ok_(d.is_transient(ScriptError(os.path.join('functions', 'f.sql'), 1, 1, locked)))
+        ok_(not d.is_transient(ScriptError(os.path.join('scripts', 's.sql'), 2, 5, locked)))
+
+    def test_requeued_at_end(self):
+        d = FlakyDeployer(['a_base'])
+        engine = DeployEngine(d).run(list_folders(['views']))
+        ok_(engine.ok)
+        eq_(engine.requeued, [os.path.join('views', 'a_base.sql')])
+        # the dependent waits for it, the independent view does not
+        eq_(d.synced, ['c_alone', 'a_base', 'b_top'])
+
+    def test_requeued_once(self):
+        d = FlakyDeployer(['c_alone'], once=False)
+        engine = DeployEngine(d).run(list_folders(['views']))
+        eq_(engine.requeued, [os.path.join('views', 'c_alone.sql')])
+        eq_(list(engine.failed), [os.path.join('views', 'c_alone.sql')])
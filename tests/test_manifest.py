@@ -0,0 +1,66 @@
+"""
+Tests for the deploy manifest
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from deployable_sql.deployers.base_deployer import BaseDeployer
+from deployable_sql.manifest import Manifest, MANIFEST_PATH, content_hash
+
+
+class CountingDeployer(BaseDeployer):
+    def __init__(self, **kwargs):
+        super(CountingDeployer, self).__init__(**kwargs)
+        self.synced = []
+
+    def sync_view(self, path):
+        self.synced.append(path)
+
+
+class TestManifest(TestDeployableSql):
+    def write_view(self, sql='SELECT 1 AS one'):
+        if not os.path.exists('views'):
+            os.mkdir('views')
+        with open(os.path.join('views', 'test.sql'), 'w') as stream:
+            stream.write(sql)
+        return os.path.join('views', 'test.sql')
+
+    def test_content_hash(self):
+        eq_(content_hash('SELECT 1', 'dbo'), content_hash(b'SELECT 1', 'dbo'))
+        assert_not_equal(content_hash('SELECT 1', 'dbo'),
+                         content_hash('SELECT 1', 'cu'))
+
+    def test_save_and_load(self):
+        m = Manifest('target')
+        m.record('views', 'dbo.test', 'abc')
+        m.save()
+        assert os.path.exists(MANIFEST_PATH)
+
+        ok_(Manifest('target').is_current('views', 'dbo.test', 'abc'))
+        assert_is_none(Manifest('other').get('views', 'dbo.test'))
+
+    def test_skip_unchanged(self):
+        path = self.write_view()
+        d = CountingDeployer()
+        d.sync_file(path)
+        d.sync_file(path)
+        eq_(len(d.synced), 1)
+        eq_((d.deployed, d.skipped), (1, 1))
+
+        self.write_view('SELECT 2 AS two')
+        d.sync_file(path)
+        eq_(len(d.synced), 2)
+
+    def test_force(self):
+        path = self.write_view()
+        d = CountingDeployer(force=True)
+        d.sync_file(path)
+        d.sync_file(path)
+        eq_(len(d.synced), 2)
+        eq_(d.skipped, 0)
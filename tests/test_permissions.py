@@ -0,0 +1,185 @@
+"""
+Tests for declarative permissions
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+
+from nose.tools import *
+import yaml
+
+from .tests import TestDeployableSql
+from .test_pymssql import CatalogCursor, FakeConnection
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.exc import PermissionDefinitionError
+from deployable_sql.permissions import (Permission, diff_permissions, grant_sql,
+                                        parse_permissions, permission_batches,
+                                        revoke_sql)
+
+
+PERMISSIONS = """
+reporting:
+  database: [create  view]
+  schemas:
+    reports: [SELECT, EXECUTE]
+  objects:
+    sales: SELECT
+    audit.log: [SELECT, INSERT]
+loader:
+"""
+
+ROWS = [
+    ('Reporting', 0, None, 'CONNECT', 'G'),
+    ('Reporting', 0, None, 'CREATE VIEW', 'G'),
+    ('Reporting', 3, 'Reports', 'SELECT', 'G'),
+    ('Reporting', 1, 'dbo.sales', 'SELECT', 'G'),
+    ('Reporting', 1, 'dbo.old', 'SELECT', 'W'),
+    ('loader', None, None, None, None),
+]
+
+
+class TestPermissions(object):
+    def setup(self):
+        self.declared = parse_permissions(yaml.safe_load(PERMISSIONS))
+
+    def test_parse(self):
+        eq_(sorted(self.declared), ['loader', 'reporting'])
+        eq_(self.declared['loader'], set())
+        eq_(sorted(self.declared['reporting']), [
+            Permission('reporting', 'DATABASE', '', 'CREATE VIEW'),
+            Permission('reporting', 'OBJECT', 'audit.log', 'INSERT'),
+            Permission('reporting', 'OBJECT', 'audit.log', 'SELECT'),
+            Permission('reporting', 'OBJECT', 'dbo.sales', 'SELECT'),
+            Permission('reporting', 'SCHEMA', 'reports', 'EXECUTE'),
+            Permission('reporting', 'SCHEMA', 'reports', 'SELECT'),
+        ])
+
+    def test_parse_errors(self):
+        for data in (['reporting'], {'reporting': ['SELECT']},
+                     {'reporting': {'tables': {'t': 'SELECT'}}},
+                     {'reporting': {'database': {'SELECT': 1}}}):
+            assert_raises(PermissionDefinitionError, parse_permissions, data)
+
+    def test_diff(self):
+        grants, revokes = diff_permissions(self.declared, ROWS)
+        eq_(grants, [
+            Permission('reporting', 'OBJECT', 'audit.log', 'INSERT'),
+            Permission('reporting', 'OBJECT', 'audit.log', 'SELECT'),
+            Permission('reporting', 'SCHEMA', 'reports', 'EXECUTE'),
+        ])
+        # connect is kept, though it is not declared
+        eq_(revokes, [(Permission('Reporting', 'OBJECT', 'dbo.old', 'SELECT'), True)])
+
+    def test_missing_principal(self):
+        assert_raises(PermissionDefinitionError, diff_permissions, self.declared, ROWS[:-1])
+
+    def test_sql(self):
+        eq_(grant_sql(Permission('r', 'DATABASE', '', 'CREATE VIEW')),
+            'GRANT CREATE VIEW TO [r];')
+        eq_(grant_sql(Permission('r', 'SCHEMA', 'reports', 'SELECT')),
+            'GRANT SELECT ON SCHEMA::[reports] TO [r];')
+        eq_(revoke_sql(Permission('a]b', 'OBJECT', 'dbo.t', 'SELECT'), cascade=True),
+            'REVOKE SELECT ON OBJECT::[dbo].[t] FROM [a]]b] CASCADE;')
+
+    def test_batches(self):
+        grants = [Permission('r', 'OBJECT', 'dbo.t%d' % i, 'SELECT') for i in range(5)]
+        revokes = [(Permission('r', 'DATABASE', '', 'CREATE TABLE'), False)]
+        batches = permission_batches(grants, revokes, size=4)
+        eq_(len(batches), 2)
+        ok_(batches[0].startswith('REVOKE CREATE TABLE FROM [r];\nGRANT'))
+        eq_(batches[1].count('GRANT'), 2)
+
+
+class TestSyncPermissions(TestDeployableSql):
+    def setup(self):
+        super(TestSyncPermissions, self).setup()
+        os.mkdir('permissions')
+        self.path = os.path.join('permissions', 'app.yml')
+        with open(self.path, 'w') as stream:
+            stream.write(PERMISSIONS)
+        with open(os.path.join('permissions', 'grant_deployable.sql'), 'w') as stream:
+            stream.write('GRANT CREATE VIEW TO deployer;')
+
+    def deployer(self, rows, **kwargs):
+        self.cursor = CatalogCursor({'sys.database_permissions': rows})
+        pool = ConnectionPool(lambda: FakeConnection(self.cursor), 'db')
+        d = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool, **kwargs)
+        d._load_manifest = lambda manifest: None
+        return d
+
+    def test_sync(self):
+        d = self.deployer(ROWS)
+        d.sync_file(self.path)
+        statements = self.cursor.statements
+        queries = [s for s in statements if 'sys.database_permissions' in s]
+        eq_(len(queries), 1)
+        ok_("WHERE pr.name IN (N'loader', N'reporting');" in queries[0])
+        changes = [s for s in statements if s.startswith('REVOKE')]
+        eq_(changes, ['REVOKE SELECT ON OBJECT::[dbo].[old] FROM [Reporting] CASCADE;\n'
+                      'GRANT INSERT ON OBJECT::[audit].[log] TO [reporting];\n'
+                      'GRANT SELECT ON OBJECT::[audit].[log] TO [reporting];\n'
+                      'GRANT EXECUTE ON SCHEMA::[reports] TO [reporting];'])
+        eq_(d.deployed, 1)
+
+    def test_unchanged(self):
+        rows = ROWS[:4] + [
+            ('reporting', 3, 'reports', 'EXECUTE', 'G'),
+            ('reporting', 1, 'audit.log', 'SELECT', 'G'),
+            ('reporting', 1, 'audit.log', 'INSERT', 'W'),
+            ('loader', 0, None, 'CONNECT', 'G'),
+        ]
+        d = self.deployer(rows)
+        d.sync_permission(self.path)
+        ok_(not any('GRANT' in s or 'REVOKE' in s for s in self.cursor.statements
+                    if 'sys.database_permissions' not in s))
+
+    def test_batched(self):
+        d = self.deployer(ROWS, batch_size=10)
+        d.sync_file(self.path)
+        d.flush()
+        batch = [s for s in self.cursor.statements if 'REVOKE' in s][0]
+        ok_(batch.startswith('USE db;\nREVOKE'))
+        ok_('deployable_sql_manifest' in batch)
+
+    def test_principal_in_two_files(self):
+        other = os.path.join('permissions', 'other.yml')
+        with open(other, 'w') as stream:
+            stream.write('Reporting:\n  objects:\n    dbo.old: [SELECT]\n')
+        d = self.deployer(ROWS)
+        d.sync_file(self.path)
+        # dbo.old is declared by the other file, so it is kept
+        ok_(not any('REVOKE' in s for s in self.cursor.statements))
+        ok_(any('GRANT EXECUTE ON SCHEMA::[reports]' in s for s in self.cursor.statements))
+
+        # the other file only adds what this one declares for the principal
+        del self.cursor.executed[:]
+        d.sync_file(other)
+        ok_(not any('REVOKE' in s for s in self.cursor.statements))
+
+    def test_given_files(self):
+        d = self.deployer(ROWS)
+        d.permission_files = {'permissions/other.yml': {
+            'reporting': {'objects': {'dbo.old': 'SELECT'}}}}
+        d.sync_permission(self.path)
+        ok_(not any('REVOKE' in s for s in self.cursor.statements))
+
+    def test_flushed_before_reading(self):
+        d = self.deployer(ROWS, batch_size=10)
+        os.mkdir('views')
+        view = os.path.join('views', 'v.sql')
+        with open(view, 'w') as stream:
+            stream.write('SELECT 1 AS x')
+        d.sync_file(view)
+        d.sync_file(self.path)
+        statements = self.cursor.statements
+        query = [i for i, s in enumerate(statements) if 'sys.database_permissions' in s][0]
+        ok_(any('CREATE VIEW dbo.v' in s for s in statements[:query]))
+
+    def test_scripts_not_run(self):
+        d = self.deployer(ROWS)
+        d.sync_file(os.path.join('permissions', 'grant_deployable.sql'))
+        eq_(d.deployed, 0)
+        ok_(not any('deployer' in s for s in self.cursor.statements))
@@ -0,0 +1,138 @@
+"""
+Tests for plan mode
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+from datetime import datetime
+import os
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.plan import (build_plan, changed_paths, format_plan,
+                                 job_differs, normalize_sql)
+from deployable_sql.tables import read_catalog
+
+
+class CatalogDeployer(PyMSSQLDeployer):
+    def __init__(self, modules, jobs):
+        super(CatalogDeployer, self).__init__('user', 'pwd', 'host', 'db')
+        self.modules = modules
+        self.jobs = jobs
+
+    def fetch_modules(self):
+        return self.modules
+
+    def fetch_jobs(self):
+        return self.jobs
+
+    def _load_manifest(self, manifest):
+        pass
+
+
+class TestPlan(TestDeployableSql):
+    def setup(self):
+        super(TestPlan, self).setup()
+        os.mkdir('views')
+        self.current_job = {
+            'steps': [{
+                'step_name': 'testjob', 'subsystem': 'TSQL',
+                'command': 'EXEC testjob;', 'database_name': 'master',
+                'on_success_action': 1, 'on_fail_action': 2,
+            }],
+            'schedules': [{
+                'name': 'weekly', 'freq_type': 8, 'freq_interval': 1,
+                'freq_recurrence_factor': 1,
+                'active_start_date': int(datetime.now().strftime('%Y%m%d')),
+                'active_start_time': 60000,
+            }],
+        }
+
+    def write_view(self, name, sql):
+        path = os.path.join('views', name + '.sql')
+        with open(path, 'w') as stream:
+            stream.write(sql)
+        return path
+
+    def test_normalize_sql(self):
+        eq_(normalize_sql('SELECT  1 -- one\n  AS one;\n'),
+            normalize_sql('SELECT 1 /* the\nnumber */ AS one'))
+
+    def job_source(self):
+        with open(os.path.join('jobs', 'testjob.yml')) as stream:
+            return stream.read()
+
+    def test_job_unchanged(self):
+        assert_false(job_differs(self.job_source(), self.current_job))
+
+    def test_job_changed(self):
+        self.current_job['steps'][0]['command'] = 'EXEC other;'
+        ok_(job_differs(self.job_source(), self.current_job))
+
+    def test_build_plan(self):
+        paths = [
+            self.write_view('same', 'SELECT 1 AS one'),
+            self.write_view('edited', 'SELECT 2 AS two'),
+            self.write_view('drifted', 'SELECT 3 AS three'),
+            self.write_view('new', 'SELECT 4 AS four'),
+            os.path.join('jobs', 'testjob.yml'),
+        ]
+        modules = {
+            ('views', 'dbo.same'): 'CREATE VIEW dbo.same AS\nSELECT 1 AS one;',
+            ('views', 'dbo.edited'): 'CREATE VIEW dbo.edited AS SELECT 1 AS two;',
+            ('views', 'dbo.drifted'): 'CREATE VIEW dbo.drifted AS SELECT 0 AS three;',
+        }
+        d = CatalogDeployer(modules, {'testjob': self.current_job})
+        d.manifest.record('views', 'dbo.drifted', d._hash_path(paths[2]))
+
+        entries = build_plan(d, paths)
+        eq_([e.action for e in entries],
+            ['unchanged', 'alter', 'drift', 'create', 'unchanged'])
+        eq_(changed_paths(entries), paths[1:4])
+        ok_('1 create, 1 alter, 1 drift, 2 unchanged' in format_plan(entries))
+
+    def test_scripts(self):
+        # scripts cannot be compared with the server, so go by the manifest
+        os.mkdir('scripts')
+        paths = []
+        for name in ['ran', 'edited']:
+            paths.append(os.path.join('scripts', name + '.sql'))
+            with open(paths[-1], 'w') as stream:
+                stream.write('UPDATE t SET %s = 1;' % name)
+        d = CatalogDeployer({}, {})
+        d.manifest.record('scripts', 'dbo.ran', d._hash_path(paths[0]))
+        entries = build_plan(d, paths)
+        eq_([(e.object_name, e.action) for e in entries],
+            [('dbo.ran', 'unchanged'), ('dbo.edited', 'alter')])
+        eq_(changed_paths(entries), paths[1:])
+
+    def test_quoted_job_name(self):
+        path = os.path.join('jobs', 'testjob.yml')
+        with open(path) as stream:
+            source = stream.read()
+        with open(path, 'w') as stream:
+            stream.write(source.replace('testjob:', '"N\'testjob\'":', 1))
+        d = CatalogDeployer({}, {'testjob': self.current_job})
+        eq_([(e.object_name, e.action) for e in build_plan(d, [path])],
+            [('testjob', 'unchanged')])
+
+    def test_tables(self):
+        os.mkdir('tables')
+        paths = []
+        for name, sql in [('same', 'CREATE TABLE same (id int NOT NULL)'),
+                          ('wider', 'CREATE TABLE wider (name varchar(20))'),
+                          ('new', 'CREATE TABLE new (id int)')]:
+            paths.append(os.path.join('tables', name + '.sql'))
+            with open(paths[-1], 'w') as stream:
+                stream.write(sql)
+        d = CatalogDeployer({}, {})
+        d._tables = {'dbo': read_catalog([
+            ('same', 'id', 'int', 4, 10, 0, 0, 0, None, None),
+            ('wider', 'name', 'varchar', 10, 0, 0, 1, 0, None, None),
+        ], [])}
+
+        eq_([(e.object_name, e.action) for e in build_plan(d, paths)],
+            [('dbo.same', 'unchanged'), ('dbo.wider', 'alter'), ('dbo.new', 'create')])
@@ -0,0 +1,104 @@
+"""
+Tests for the connection pool
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import threading
+
+from nose.tools import *
+import pymssql
+
+from .tests import TestDeployableSql
+from .test_pymssql import FakeConnection, FakeCursor
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+
+
+class DeadCursor(FakeCursor):
+    def fetchall(self):
+        raise pymssql.InterfaceError('connection is closed')
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        raise pymssql.OperationalError('connection is closed')
+
+
+class TestConnectionPool(TestDeployableSql):
+    def setup(self):
+        super(TestConnectionPool, self).setup()
+        self.opened = []
+
+    def connect(self):
+        conn = FakeConnection(FakeCursor())
+        self.opened.append(conn)
+        return conn
+
+    def test_reuse(self):
+        pool = ConnectionPool(self.connect, 'db')
+        first = pool.acquire()
+        pool.release(first)
+        second = pool.acquire()
+        assert_is(first, second)
+        eq_(len(self.opened), 1)
+
+    def test_prefers_database(self):
+        pool = ConnectionPool(self.connect, 'db')
+        one, two = pool.acquire(), pool.acquire()
+        two.database = 'msdb'
+        pool.release(two)
+        pool.release(one)
+        assert_is(pool.acquire('msdb'), two)
+
+    def test_health_check(self):
+        pool = ConnectionPool(self.connect, 'db', check_after=0)
+        pooled = pool.acquire()
+        pooled.cursor = DeadCursor()
+        pool.release(pooled)
+        pooled = pool.acquire()
+        ok_(pool.ping(pooled))
+        eq_(len(self.opened), 2)
+        ok_(self.opened[0].closed)
+
+    def test_max_size(self):
+        pool = ConnectionPool(self.connect, 'db', max_size=1)
+        held = pool.acquire()
+        got = []
+        thread = threading.Thread(target=lambda: got.append(pool.acquire()))
+        thread.start()
+        thread.join(0.1)
+        eq_(got, [])
+        pool.release(held)
+        thread.join(1)
+        eq_(got, [held])
+
+    def test_close(self):
+        pool = ConnectionPool(self.connect, 'db')
+        pool.release(pool.acquire())
+        pool.close()
+        ok_(self.opened[0].closed)
+
+
+class TestDatabaseContext(TestDeployableSql):
+    def setup(self):
+        super(TestDatabaseContext, self).setup()
+        self.cursor = FakeCursor()
+        pool = ConnectionPool(lambda: FakeConnection(self.cursor), 'db')
+        self.d = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool)
+
+    def test_use_only_on_change(self):
+        self.d._reset_db()
+        eq_(self.cursor.statements, [])
+        self.d._exec('USE msdb;\n\nEXEC sp_add_job', fetch=False)
+        eq_(self.d._pooled.database, 'msdb')
+        self.d._reset_db()
+        self.d._reset_db()
+        eq_(self.cursor.statements[-1], 'USE db;')
+        eq_(self.cursor.statements.count('USE db;'), 1)
+
+    def test_reconnect(self):
+        self.d.connect()
+        self.d._pooled.cursor = DeadCursor()
+        self.d._exec('SELECT 2', fetch=False)
+        eq_(self.cursor.statements, ['SELECT 2'])
@@ -5,11 +5,18 @@ Tests for pymssql deployer module
 # pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
 # pylint: disable=no-self-use
 from __future__ import print_function
+from datetime import datetime
+import os
 
 from nose.tools import *
+import pymssql
 
 from .tests import TestDeployableSql
-from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer, read_job
+from deployable_sql.deployers.pymssql_deployer import (PyMSSQLDeployer, diff_job,
+                                                     load_job, read_job,
+                                                     rewrite_create)
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.exc import BatchError
 
 
 class TestPyMSSQLDeployer(TestDeployableSql):
@@ -61,3 +68,283 @@ class TestPyMSSQLDeployer(TestDeployableSql):
         eq_(sql.count('sp_add_jobschedule'), 2)
         print('sql', sql)
         assert '@on_failure_action = 2' in sql
+
+
+class FakeCursor(object):
+    def __init__(self, fail_on=None):
+        self.executed = []
+        self.fail_on = fail_on
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        if self.fail_on and self.fail_on in sql:
+            raise pymssql.OperationalError('failed: %s' % self.fail_on)
+
+    def fetchall(self):
+        if self.executed[-1] == 'SELECT 1':
+            return [(1,)]
+        raise pymssql.OperationalError('no rows')
+
+    @property
+    def statements(self):
+        return [sql for sql in self.executed if sql != 'SELECT 1']
+
+
+class FakeConnection(object):
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.closed = False
+
+    def autocommit(self, value):
+        pass
+
+    def cursor(self):
+        return self._cursor
+
+    def close(self):
+        self.closed = True
+
+
+class TestBatchedDeploy(TestDeployableSql):
+    def setup(self):
+        super(TestBatchedDeploy, self).setup()
+        os.mkdir('views')
+        self.paths = []
+        for name in ['one', 'two', 'three']:
+            path = os.path.abspath(os.path.join('views', name + '.sql'))
+            with open(path, 'w') as stream:
+                stream.write("SELECT '%s' AS name" % name)
+            self.paths.append(path)
+
+    def deployer(self, fail_on=None, batch_size=3):
+        cursor = FakeCursor(fail_on)
+        pool = ConnectionPool(lambda: FakeConnection(cursor), 'db')
+        return PyMSSQLDeployer('user', 'pwd', 'host', 'db',
+                               batch_size=batch_size, pool=pool)
+
+    def test_single_round_trip(self):
+        d = self.deployer()
+        for path in self.paths:
+            d.sync_view(path)
+        eq_(d.cursor, None)
+        d.flush()
+        eq_(len(d.cursor.executed), 1)
+        sql = d.cursor.executed[0]
+        eq_(sql.count('EXEC sp_executesql'), 3)
+        assert "N'CREATE VIEW dbo.two AS \nSELECT ''two'' AS name;'" in sql
+
+    def test_batch_size(self):
+        d = self.deployer(batch_size=2)
+        for path in self.paths:
+            d.sync_view(path)
+        eq_(len(d.cursor.executed), 1)
+        d.flush()
+        eq_(len(d.cursor.executed), 2)
+
+    def test_failed_batch_retries_each(self):
+        d = self.deployer(fail_on="''two''")
+        for path in self.paths:
+            d.sync_view(path)
+        with assert_raises(BatchError) as cm:
+            d.flush()
+        eq_(list(cm.exception.errors), [self.paths[1]])
+        eq_(len(d.cursor.statements), 4)
+
+    def test_unbatched(self):
+        d = self.deployer(batch_size=None)
+        d.sync_view(self.paths[0])
+        # the connection is already using db, so there is no USE
+        eq_(len(d.cursor.executed), 2)
+        assert d.cursor.executed[1].startswith('CREATE VIEW dbo.one')
+
+
+class TestCreateOrAlter(TestDeployableSql):
+    def setup(self):
+        super(TestCreateOrAlter, self).setup()
+        os.mkdir('functions')
+        self.path = os.path.abspath(os.path.join('functions', 'f.sql'))
+        with open(self.path, 'w') as stream:
+            stream.write('-- a function\ncreate  function dbo.f() RETURNS int AS BEGIN RETURN 1 END')
+        self.cursor = FakeCursor()
+        pool = ConnectionPool(lambda: FakeConnection(self.cursor), 'db')
+        self.d = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool,
+                                 create_or_alter=['functions'])
+
+    def test_rewrite_create(self):
+        eq_(rewrite_create('/* x */ CREATE PROC dbo.p AS SELECT 1', 'ALTER'),
+            '/* x */ ALTER PROC dbo.p AS SELECT 1')
+        eq_(rewrite_create('CREATE OR ALTER VIEW v AS SELECT 1', 'CREATE'),
+            'CREATE VIEW v AS SELECT 1')
+        assert_is_none(rewrite_create('SET NOCOUNT ON; CREATE PROC p', 'ALTER'))
+
+    def test_create_or_alter(self):
+        self.d._create_or_alter_supported = True
+        self.d.sync_function(self.path)
+        eq_(self.cursor.statements,
+            ['-- a function\nCREATE OR ALTER  function dbo.f() RETURNS int AS BEGIN RETURN 1 END'])
+
+    def test_alter_if_exists(self):
+        self.d._create_or_alter_supported = False
+        self.d.sync_function(self.path)
+        sql = self.cursor.statements[0]
+        assert sql.startswith("IF OBJECT_ID (N'dbo.f') IS NULL")
+        assert "N'-- a function\ncreate  function" in sql
+        assert "N'-- a function\nALTER  function" in sql
+
+    def test_other_folders_drop(self):
+        self.d._create_or_alter_supported = True
+        os.mkdir('views')
+        path = os.path.abspath(os.path.join('views', 'v.sql'))
+        with open(path, 'w') as stream:
+            stream.write('SELECT 1 AS one')
+        self.d.sync_view(path)
+        assert 'DROP VIEW' in self.cursor.statements[0]
+
+
+class CatalogCursor(FakeCursor):
+    def __init__(self, results):
+        super(CatalogCursor, self).__init__()
+        self.results = results
+
+    def fetchall(self):
+        for marker, rows in self.results.items():
+            if marker in self.executed[-1]:
+                return rows
+        return super(CatalogCursor, self).fetchall()
+
+
+class TestJobReconcile(TestDeployableSql):
+    def setup(self):
+        super(TestJobReconcile, self).setup()
+        self.path = os.path.abspath(os.path.join('jobs', 'testjob.yml'))
+        self.current = {
+            'settings': {'notify_level_email': 3, 'notify_level_eventlog': 0,
+                         'notify_email_operator_name': 'Dan Cohen'},
+            'steps': [{
+                'step_id': 1, 'step_name': 'testjob', 'subsystem': 'TSQL',
+                'command': 'EXEC testjob;', 'database_name': 'master',
+                'on_success_action': 1, 'on_fail_action': 2,
+            }],
+            'schedules': [{
+                'schedule_id': 7, 'job_count': 1, 'name': 'weekly',
+                'freq_type': 8, 'freq_interval': 1, 'freq_recurrence_factor': 1,
+                'active_start_date': int(datetime.now().strftime('%Y%m%d')),
+                'active_start_time': 60000,
+            }],
+            'servers': [{'server_name': '(local)'}],
+        }
+
+    def diff(self):
+        return diff_job(load_job(self.path), self.current)
+
+    def deployer(self, cursor):
+        pool = ConnectionPool(lambda: FakeConnection(cursor), 'db')
+        return PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool)
+
+    def test_unchanged(self):
+        eq_(self.diff(), [])
+
+    def test_changed_step(self):
+        self.current['steps'][0]['command'] = 'EXEC other;'
+        sql = self.diff()
+        eq_(len(sql), 1)
+        assert sql[0].startswith('EXEC sp_update_jobstep')
+        assert '@step_id = 1' in sql[0]
+        assert "@command = N'EXEC testjob;'" in sql[0]
+        assert '@step_name' not in sql[0]
+
+    def test_removed_step(self):
+        self.current['steps'].append(dict(self.current['steps'][0], step_id=2))
+        self.current['steps'][0]['on_success_action'] = 3
+        sql = self.diff()
+        assert sql[0].startswith('EXEC sp_delete_jobstep')
+        assert '@step_id = 2' in sql[0]
+        # the remaining step is now the last, so it quits with success
+        assert '@on_success_action = 1' in sql[1]
+
+    def test_changed_schedule(self):
+        self.current['schedules'][0]['active_start_time'] = 70000
+        sql = self.diff()
+        eq_(len(sql), 1)
+        assert sql[0].startswith('EXEC sp_update_schedule\n\t@schedule_id = 7')
+
+        self.current['schedules'][0]['job_count'] = 2
+        sql = self.diff()
+        assert sql[0].startswith('EXEC sp_detach_schedule')
+        assert '@delete_unused_schedule = 0' in sql[0]
+        assert sql[1].startswith('EXEC sp_add_jobschedule')
+
+    def test_removed_schedule_and_server(self):
+        self.current['schedules'].append(dict(
+            self.current['schedules'][0], schedule_id=8, name='daily'))
+        self.current['servers'].append({'server_name': 'other'})
+        sql = self.diff()
+        eq_(len(sql), 2)
+        assert '@schedule_id = 8' in sql[0]
+        assert '@delete_unused_schedule = 1' in sql[0]
+        assert sql[1].startswith('EXEC sp_delete_jobserver')
+
+    def test_sync_new_job(self):
+        cursor = FakeCursor()
+        self.deployer(cursor).sync_job(self.path)
+        sql = cursor.statements[-1]
+        assert 'EXEC sp_add_job\n' in sql
+        assert 'sp_delete_job' not in sql
+
+    def test_sync_existing_job(self):
+        self.current['steps'][0]['command'] = 'EXEC other;'
+        d = self.deployer(FakeCursor())
+        d._jobs = {'testjob': self.current}
+        d.sync_job(self.path)
+        sql = d.cursor.statements[-1]
+        assert sql.startswith('USE msdb;\nSET XACT_ABORT ON;\nBEGIN TRANSACTION;')
+        assert 'sp_update_jobstep' in sql
+        assert 'sp_delete_job' not in sql
+        assert sql.endswith('COMMIT TRANSACTION;')
+
+    def test_batched_jobs_recorded(self):
+        # a new job, then a changed one, each switching to msdb
+        for jobs in ({}, {'testjob': dict(self.current, steps=[
+                dict(self.current['steps'][0], command='EXEC other;')])}):
+            cursor = FakeCursor()
+            pool = ConnectionPool(lambda: FakeConnection(cursor), 'db')
+            d = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool, batch_size=3)
+            d._load_manifest = lambda manifest: None
+            d._jobs = jobs
+            d.sync_file(self.path)
+            d.flush()
+            sql = cursor.statements[-1]
+            ok_('USE msdb;' in sql)
+            upsert = sql.index('deployable_sql_manifest')
+            eq_(sql.rindex('USE ', 0, upsert), sql.rindex('USE db;', 0, upsert))
+            ok_(d.manifest.get('jobs', 'dbo.testjob') is not None)
+
+    def test_sync_unchanged_job(self):
+        d = self.deployer(FakeCursor())
+        d._jobs = {'testjob': self.current}
+        d.sync_job(self.path)
+        eq_(d.cursor, None)
+
+    def test_fetch_modules(self):
+        cursor = CatalogCursor({'sys.sql_modules': [
+            ('V ', 'dbo.base', 'CREATE VIEW dbo.base AS SELECT 1;')]})
+        d = self.deployer(cursor)
+        eq_(d.fetch_modules(['dbo.base', 'dbo.top']),
+            {('views', 'dbo.base'): 'CREATE VIEW dbo.base AS SELECT 1;'})
+        assert "AND o.name IN (N'base', N'top')" in cursor.executed[-1]
+        eq_(d.fetch_modules([]), {})
+
+    def test_fetch_jobs(self):
+        cursor = CatalogCursor({
+            'sysoperators': [('testjob', 3, 'Dan Cohen', 0)],
+            'sysjobsteps': [('testjob', 1, 'testjob', 'TSQL', 'EXEC testjob;',
+                             'master', 1, 0, 2, 0, 0, 0, None)],
+            'sysschedules': [],
+            'sysjobservers': [('testjob', '(local)')],
+        })
+        jobs = self.deployer(cursor).fetch_jobs('testjob')
+        eq_(list(jobs), ['testjob'])
+        eq_(jobs['testjob']['settings']['notify_email_operator_name'], 'Dan Cohen')
+        eq_(jobs['testjob']['steps'][0]['command'], 'EXEC testjob;')
+        eq_(jobs['testjob']['servers'], [{'server_name': '(local)'}])
+        assert "WHERE j.name = N'testjob'" in cursor.executed[-1]
@@ -0,0 +1,189 @@
+"""
+Tests for the table rebuild module
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from .test_pymssql import FakeConnection, FakeCursor
+from .test_tables import COLUMN_ROWS, CONSTRAINT_ROWS, ORDERS
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.exc import RebuildError, TableChangeError
+from deployable_sql.rebuild import TableRebuild, copy_key
+from deployable_sql.tables import parse_table, read_catalog, render_table
+
+
+DIGEST = 'a' * 40
+
+
+class ScriptedCursor(FakeCursor):
+    """Answers each query containing a marker with its next result."""
+    def __init__(self, results):
+        super(ScriptedCursor, self).__init__()
+        self.results = results
+
+    def fetchall(self):
+        for marker, results in self.results.items():
+            if marker in self.executed[-1]:
+                return results.pop(0)
+        return super(ScriptedCursor, self).fetchall()
+
+
+class TestRebuild(TestDeployableSql):
+    def setup(self):
+        super(TestRebuild, self).setup()
+        self.current = read_catalog(COLUMN_ROWS, CONSTRAINT_ROWS)['orders']
+        self.table = parse_table(ORDERS.replace('varchar(20)', 'nvarchar(20)'))
+
+    def deployer(self, cursor, **kwargs):
+        pool = ConnectionPool(lambda: FakeConnection(cursor), 'db')
+        d = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool, **kwargs)
+        d._server_properties = ((15, 0, 2000), 3)
+        return d
+
+    def cursor(self, state, chunks):
+        return ScriptedCursor({
+            'content_hash, rows_copied': [state],
+            'SELECT CASE WHEN @next': [[chunk] for chunk in chunks],
+        })
+
+    def rebuild(self, cursor):
+        return TableRebuild(self.deployer(cursor), self.table, self.current,
+                            DIGEST, 1000).run()
+
+    def test_copy_key(self):
+        eq_(copy_key(self.table, self.current), 'id')
+        keyless = self.current._replace(constraints=[])
+        assert_raises(RebuildError, copy_key, self.table, keyless)
+
+    def test_render_table(self):
+        sql = render_table(self.table, 'dbo.orders__rebuild', '__rebuild')
+        assert sql.startswith('CREATE TABLE dbo.orders__rebuild (\n'
+                              '    [id] int IDENTITY(1, 1) NOT NULL,')
+        assert "CONSTRAINT [DF_orders_status__rebuild] DEFAULT ('new')" in sql
+        assert 'CONSTRAINT [PK_orders__rebuild] PRIMARY KEY CLUSTERED (id)' in sql
+        shadow = parse_table(sql)
+        eq_([c.type for c in shadow.columns.values()],
+            [c.type for c in self.table.columns.values()])
+        eq_(len(shadow.constraints), len(self.table.constraints))
+
+    def test_rebuild(self):
+        cursor = self.cursor([], [(0, 1000), (0, 500), (1, 0)])
+        eq_(self.rebuild(cursor), 1500)
+        start = [sql for sql in cursor.executed if 'CREATE TABLE dbo.orders__rebuild' in sql]
+        eq_(len(start), 1)
+        assert 'CREATE TRIGGER dbo.orders__rebuild_sync ON dbo.orders' in start[0]
+        eq_(len([sql for sql in cursor.executed if 'TOP (1000) [id]' in sql]), 3)
+        assert 'SET IDENTITY_INSERT dbo.orders__rebuild ON;' in cursor.executed[-2]
+
+        swap = cursor.executed[-1]
+        assert 'WITH (TABLOCKX, HOLDLOCK)' in swap
+        assert "EXEC sp_rename N'dbo.orders__rebuild', N'orders';" in swap
+        assert ("EXEC sp_rename N'dbo.PK_orders__rebuild', N'PK_orders', N'OBJECT';"
+                in swap)
+        assert swap.index('DROP TABLE dbo.orders;') < swap.index('sp_rename')
+
+    def test_carried_over(self):
+        cursor = self.cursor([], [(1, 0)])
+        cursor.results.update({
+            'sys.indexes': [[
+                ('IX_orders_customer', 2, 1, 'customer_id,placed_at DESC', 'status',
+                 "([status]='new')"),
+                ('IX_orders_gone', 2, 0, 'gone', None, None),
+            ]],
+            'sys.database_permissions': [[
+                ('reporting', 'G', 'SELECT', None),
+                ('loader', 'W', 'UPDATE', 'status'),
+                ('auditor', 'D', 'SELECT', 'gone'),
+            ]],
+            'sys.extended_properties': [[
+                ('MS_Description', 'Orders placed', None),
+                ('MS_Description', "Where it's at", 'status'),
+            ]],
+        })
+        self.rebuild(cursor)
+        index = cursor.executed[-2]
+        eq_(index, "IF INDEXPROPERTY (OBJECT_ID (N'dbo.orders__rebuild'), "
+                   "N'IX_orders_customer', 'IndexID') IS NULL\n"
+                   "    CREATE UNIQUE NONCLUSTERED INDEX [IX_orders_customer] ON "
+                   "dbo.orders__rebuild ([customer_id], [placed_at] DESC) INCLUDE ([status]) "
+                   "WHERE ([status]='new');")
+
+        swap = cursor.executed[-1]
+        for sql in ('GRANT SELECT ON dbo.orders TO [reporting];',
+                    'GRANT UPDATE ON dbo.orders ([status]) TO [loader] WITH GRANT OPTION;',
+                    "EXEC sp_addextendedproperty N'MS_Description', N'Orders placed', "
+                    "N'SCHEMA', N'dbo', N'TABLE', N'orders';",
+                    "EXEC sp_addextendedproperty N'MS_Description', N'Where it''s at', "
+                    "N'SCHEMA', N'dbo', N'TABLE', N'orders', N'COLUMN', N'status';"):
+            ok_(sql in swap, sql)
+            ok_(swap.index("EXEC sp_rename N'dbo.orders__rebuild'") < swap.index(sql))
+        # what is on a dropped column is left behind
+        ok_('auditor' not in swap)
+        ok_(not any('IX_orders_gone' in sql for sql in cursor.executed[-2:]))
+
+    def test_declared_index(self):
+        self.table = parse_table(ORDERS.replace(
+            'CONSTRAINT PK_orders', 'INDEX IX_placed (placed_at),\n    CONSTRAINT PK_orders'))
+        cursor = self.cursor([], [(1, 0)])
+        cursor.results['sys.indexes'] = [[('ix_placed', 2, 0, 'placed_at', None, None)]]
+        self.rebuild(cursor)
+        start = [sql for sql in cursor.executed if 'CREATE TABLE dbo.orders__rebuild' in sql]
+        ok_('INDEX IX_placed (placed_at)' in start[0])
+        ok_(not any('CREATE NONCLUSTERED INDEX' in sql for sql in cursor.executed))
+
+    def test_refused(self):
+        for marker, rows in [('sys.triggers', [('tr_orders_audit',)]),
+                             ('sys.foreign_keys', [('dbo.order_lines',)]),
+                             ('is_schema_bound_reference', [('dbo.v_orders',)]),
+                             ('sys.indexes', [('CIX_orders', 1, 0, 'placed_at', None, None)])]:
+            cursor = self.cursor([], [(1, 0)])
+            cursor.results[marker] = [rows]
+            assert_raises(RebuildError, self.rebuild, cursor)
+            ok_(not any('CREATE TABLE dbo.orders__rebuild' in sql for sql in cursor.executed))
+
+    def test_resume(self):
+        cursor = self.cursor([(DIGEST, 700, 1234)], [(0, 300), (1, 0)])
+        eq_(self.rebuild(cursor), 1000)
+        assert not any('CREATE TABLE dbo.orders__rebuild' in sql for sql in cursor.executed)
+
+    def test_restart_when_changed(self):
+        cursor = self.cursor([('b' * 40, 700, 1234)], [(1, 0)])
+        eq_(self.rebuild(cursor), 0)
+        assert any('DROP TABLE dbo.orders__rebuild' in sql for sql in cursor.executed)
+
+
+class TestSyncRebuild(TestDeployableSql):
+    def setup(self):
+        super(TestSyncRebuild, self).setup()
+        os.mkdir('tables')
+        self.path = os.path.abspath(os.path.join('tables', 'orders.sql'))
+        with open(self.path, 'w') as stream:
+            stream.write(ORDERS.replace(' IDENTITY(1, 1)', ''))
+
+    def deployer(self, **kwargs):
+        self.cursor = ScriptedCursor({
+            'sys.default_constraints': [COLUMN_ROWS],
+            'sys.key_constraints': [CONSTRAINT_ROWS],
+            'content_hash, rows_copied': [[]],
+            'SELECT CASE WHEN @next': [[(1, 0)]],
+        })
+        pool = ConnectionPool(lambda: FakeConnection(self.cursor), 'db')
+        d = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool, **kwargs)
+        d._server_properties = ((15, 0, 2000), 3)
+        return d
+
+    def test_refused_without_rebuild(self):
+        assert_raises(TableChangeError, self.deployer().sync_table, self.path)
+
+    def test_rebuild(self):
+        self.deployer(rebuild_chunk_size=500).sync_table(self.path)
+        assert 'sp_rename' in self.cursor.executed[-1]
+        # the identity is dropped, so ids are copied as they are
+        assert 'IDENTITY_INSERT' not in self.cursor.executed[-1]
@@ -0,0 +1,111 @@
+"""
+Tests for the deploy report module
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import json
+import os
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from .test_pymssql import FakeConnection, FakeCursor
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.report import DeployReport, percentile
+
+
+REPORT_PATH = 'report.json'
+METRICS_PATH = 'deploy.prom'
+
+
+class TestDeployReport(TestDeployableSql):
+    def setup(self):
+        super(TestDeployReport, self).setup()
+        os.mkdir('views')
+        self.paths = []
+        for name in ['one', 'two', 'three']:
+            path = os.path.abspath(os.path.join('views', name + '.sql'))
+            with open(path, 'w') as stream:
+                stream.write("SELECT '%s' AS name ORDER BY 1" % name)
+            self.paths.append(path)
+
+    def teardown(self):
+        for path in [REPORT_PATH, METRICS_PATH]:
+            if os.path.exists(path):
+                os.remove(path)
+        super(TestDeployReport, self).teardown()
+
+    def deployer(self, batch_size=None):
+        cursor = FakeCursor()
+        pool = ConnectionPool(lambda: FakeConnection(cursor), 'db')
+        return PyMSSQLDeployer('user', 'pwd', 'host', 'db',
+                               batch_size=batch_size, pool=pool)
+
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3]
+        eq_(percentile(values, 50), 3)
+        eq_(percentile(values, 95), 5)
+        eq_(percentile([], 50), 0.0)
+
+    def test_phases(self):
+        d = self.deployer()
+        for path in self.paths:
+            d.sync_file(path)
+        d.sync_file(self.paths[0])
+
+        report = d.report.to_dict()
+        eq_(report['deployed'], 3)
+        eq_(report['skipped'], 0)
+        timing = report['objects'][0]
+        eq_((timing['type'], timing['name']), ('views', 'dbo.one'))
+        eq_(sorted(timing['phases']),
+            ['create', 'drop', 'generate', 'hash', 'parse', 'record'])
+        # drop, create and the manifest upsert
+        eq_(timing['round_trips'], 3)
+        eq_(report['types']['views']['count'], 3)
+        eq_(len(report['slowest']), 3)
+
+    def test_skipped(self):
+        d = self.deployer()
+        d.manifest.record('views', 'dbo.one', d._hash_path(self.paths[0]))
+        d.sync_file(self.paths[0])
+        report = d.report.to_dict()
+        eq_(report['skipped'], 1)
+        eq_(report['objects'][0]['round_trips'], 0)
+
+    def test_batched(self):
+        d = self.deployer(batch_size=3)
+        for path in self.paths:
+            d.sync_file(path)
+        d.flush()
+        for timing in d.report.to_dict()['objects']:
+            assert 'batch' in timing['phases']
+
+    def test_clone_shares_report(self):
+        d = self.deployer()
+        other = d.clone()
+        other.sync_file(self.paths[0])
+        eq_(d.report.to_dict()['deployed'], 1)
+
+    def test_write(self):
+        d = self.deployer()
+        d.sync_file(self.paths[0])
+        d.report.finish()
+        d.report.write_json(REPORT_PATH)
+        with open(REPORT_PATH) as stream:
+            eq_(json.load(stream)['deployed'], 1)
+
+        d.report.write_prometheus(METRICS_PATH)
+        with open(METRICS_PATH) as stream:
+            metrics = stream.read()
+        assert 'deployable_sql_object_seconds_count{type="views"} 1\n' in metrics
+        assert 'deployable_sql_phase_seconds{phase="create"}' in metrics
+        assert not os.path.exists(METRICS_PATH + '.tmp')
+
+    def test_empty(self):
+        report = DeployReport().to_dict()
+        eq_(report['deployed'], 0)
+        eq_(report['types'], {})
@@ -0,0 +1,85 @@
+"""
+Tests for the release script module
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.engine import list_folders
+from deployable_sql.script import check_script, compile_script, script_hashes
+
+
+SCRIPT_PATH = 'release.sql'
+
+
+class TestCompileScript(TestDeployableSql):
+    def setup(self):
+        super(TestCompileScript, self).setup()
+        for folder in ['views', 'functions']:
+            os.mkdir(folder)
+        self.write('views', 'v_report', 'SELECT id FROM dbo.v_base\nORDER BY id')
+        self.write('views', 'v_base', 'SELECT 1 AS id')
+        self.write('functions', 'f_one',
+                   'CREATE FUNCTION dbo.f_one () RETURNS int AS BEGIN RETURN 1 END')
+        self.d = PyMSSQLDeployer(None, None, None, 'db')
+
+    def teardown(self):
+        if os.path.exists(SCRIPT_PATH):
+            os.remove(SCRIPT_PATH)
+        super(TestCompileScript, self).teardown()
+
+    def write(self, folder, name, sql):
+        with open(os.path.join(folder, name + '.sql'), 'w') as stream:
+            stream.write(sql)
+
+    def paths(self):
+        return list_folders(['views', 'functions', 'jobs'])
+
+    def compile(self, db='db'):
+        eq_(compile_script(self.d, self.paths(), SCRIPT_PATH, db=db), 4)
+        with open(SCRIPT_PATH) as stream:
+            return stream.read()
+
+    def test_compile(self):
+        sql = self.compile()
+        assert sql.startswith('-- deployable_sql release script\n')
+        assert 'USE db;\nGO\n' in sql
+        # the view it depends on comes first, and its ORDER BY is dropped
+        assert sql.index('CREATE VIEW dbo.v_base') < sql.index('CREATE VIEW dbo.v_report')
+        assert 'CREATE VIEW dbo.v_report AS \nSELECT id FROM dbo.v_base;\nGO\n' in sql
+        assert 'DROP FUNCTION dbo.f_one;\nGO\n' in sql
+        eq_(sql.count("INSERT INTO dbo.deployable_sql_manifest"), 4)
+        # jobs come last, and switch back to the database afterwards
+        assert sql.index('CREATE FUNCTION') < sql.index('USE msdb;')
+        assert sql.rstrip().endswith('GO')
+        assert not os.path.exists(SCRIPT_PATH + '.tmp')
+
+    def test_jobs_without_db(self):
+        sql = self.compile(db=None)
+        assert 'USE db' not in sql
+        eq_(sql.count("INSERT INTO dbo.deployable_sql_manifest"), 3)
+
+    def test_create_or_alter(self):
+        self.d = PyMSSQLDeployer(None, None, None, 'db', create_or_alter=['functions'])
+        sql = self.compile()
+        assert 'CREATE OR ALTER FUNCTION dbo.f_one' in sql
+        assert 'DROP FUNCTION' not in sql
+
+    def test_check(self):
+        self.compile()
+        hashes = script_hashes(SCRIPT_PATH)
+        eq_(sorted(hashes), ['functions/f_one.sql', 'jobs/testjob.yml',
+                             'views/v_base.sql', 'views/v_report.sql'])
+        eq_(check_script(self.d, SCRIPT_PATH, self.paths()), ([], [], []))
+
+        self.write('views', 'v_base', 'SELECT 2 AS id')
+        self.write('views', 'v_new', 'SELECT 3 AS id')
+        os.remove(os.path.join('functions', 'f_one.sql'))
+        eq_(check_script(self.d, SCRIPT_PATH, self.paths()),
+            (['views/v_base.sql'], ['functions/f_one.sql'], ['views/v_new.sql']))
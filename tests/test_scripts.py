@@ -0,0 +1,141 @@
+"""
+Tests for running GO separated scripts and modules one batch at a time
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+
+from nose.tools import *
+import pymssql
+
+from .tests import TestDeployableSql
+from .test_pymssql import FakeConnection, FakeCursor
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.exc import ScriptError
+from deployable_sql.script import compile_script
+
+
+SCRIPT = b"""SET NOCOUNT ON;
+GO
+INSERT INTO dbo.a VALUES (1);
+GO
+-- nothing here
+GO
+INSERT INTO dbo.b VALUES (2);
+"""
+
+PROC = b"""CREATE PROCEDURE dbo.proc AS
+    SELECT 1;
+GO
+GRANT EXECUTE ON dbo.proc TO someone;
+"""
+
+
+class PipelineCursor(FakeCursor):
+    """Fails the pipelined batch with the given number."""
+    def __init__(self, fail_batch):
+        super(PipelineCursor, self).__init__()
+        self.fail_batch = fail_batch
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        if 'SET @deployable_sql_batch = %d;' % self.fail_batch in sql:
+            raise pymssql.OperationalError(
+                'deployable_sql batch %d: Invalid object name' % self.fail_batch)
+
+
+class TestScripts(TestDeployableSql):
+    def setup(self):
+        super(TestScripts, self).setup()
+        for folder in ('scripts', 'stored_procedures'):
+            os.mkdir(folder)
+        self.script = self.write('scripts', 'load', SCRIPT)
+        self.proc = self.write('stored_procedures', 'proc', PROC)
+
+    def write(self, folder, name, data):
+        path = os.path.join(folder, name + '.sql')
+        with open(path, 'wb') as stream:
+            stream.write(data)
+        return path
+
+    def deployer(self, cursor=None, **kwargs):
+        self.cursor = cursor or FakeCursor()
+        pool = ConnectionPool(lambda: FakeConnection(self.cursor), 'db')
+        return PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool, **kwargs)
+
+    def test_batches_streamed(self):
+        d = self.deployer()
+        d._load_manifest = lambda manifest: None
+        d.sync_file(self.script)
+        eq_(self.cursor.statements, [
+            'SET NOCOUNT ON;\n', 'INSERT INTO dbo.a VALUES (1);\n',
+            'INSERT INTO dbo.b VALUES (2);\n'] + self.cursor.statements[3:])
+        assert 'deployable_sql_manifest' in self.cursor.statements[-1]
+        eq_(d.deployed, 1)
+
+    def test_error_line(self):
+        d = self.deployer(FakeCursor(fail_on='dbo.b'))
+        d._load_manifest = lambda manifest: None
+        with assert_raises(ScriptError) as raised:
+            d.sync_file(self.script)
+        eq_((raised.exception.batch, raised.exception.line), (3, 7))
+        assert 'scripts/load.sql: batch 3, from line 7' in str(raised.exception)
+        eq_(d.deployed, 0)
+
+    def test_module_batches(self):
+        d = self.deployer()
+        d._load_manifest = lambda manifest: None
+        d.sync_file(self.proc)
+        statements = self.cursor.statements
+        ok_(any(s.startswith('CREATE PROCEDURE dbo.proc') and 'GRANT' not in s
+                for s in statements))
+        ok_('GRANT EXECUTE ON dbo.proc TO someone;\n' in statements)
+
+    def test_batched_module(self):
+        d = self.deployer(batch_size=5)
+        d._load_manifest = lambda manifest: None
+        d.sync_file(self.proc)
+        d.flush()
+        sql = [s for s in self.cursor.statements if 'CREATE PROCEDURE' in s][0]
+        eq_(sql.count('EXEC sp_executesql'), 2)
+
+    def test_create_or_alter_batches(self):
+        d = self.deployer(create_or_alter=True)
+        d._create_or_alter_supported = True
+        drop_sql, create_sql, _ = d._create_or_alter(
+            'stored_procedures', 'dbo.proc', 'DROP', 'SET ANSI_NULLS ON\nGO\n' + PROC.decode())
+        assert_is_none(drop_sql)
+        ok_('\nGO\nCREATE OR ALTER PROCEDURE dbo.proc' in create_sql)
+        ok_(create_sql.endswith('\nGO\nGRANT EXECUTE ON dbo.proc TO someone;\n'))
+
+    def test_pipeline(self):
+        d = self.deployer(pipeline_size=1000)
+        d._run_script('x', SCRIPT.decode())
+        # the SET is sent on its own, and the inserts together
+        eq_(len(self.cursor.statements), 2)
+        eq_(self.cursor.statements[0], 'SET NOCOUNT ON;\n')
+        ok_('SET @deployable_sql_batch = 2;' in self.cursor.statements[1])
+        ok_('SET @deployable_sql_batch = 3;' in self.cursor.statements[1])
+
+    def test_pipeline_size(self):
+        d = self.deployer(pipeline_size=40)
+        d._run_script('x', 'SELECT 1;\nGO\nSELECT 2;\nGO\n%s\n' % ('SELECT 3' * 10))
+        # the first two together, and the one too large on its own
+        eq_(len(self.cursor.statements), 2)
+
+    def test_pipeline_error(self):
+        d = self.deployer(PipelineCursor(3), pipeline_size=1000)
+        with assert_raises(ScriptError) as raised:
+            d._run_script('x', SCRIPT.decode())
+        eq_((raised.exception.batch, raised.exception.line), (3, 7))
+
+    def test_compile(self):
+        d = self.deployer()
+        compile_script(d, [self.proc, self.script], 'release.sql', db='db')
+        with open('release.sql') as stream:
+            script = stream.read()
+        ok_('INSERT INTO dbo.b VALUES (2);\nGO\n\nUSE db;\nGO' in script)
+        os.remove('release.sql')
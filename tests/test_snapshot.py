@@ -0,0 +1,156 @@
+"""
+Tests for pre-deploy snapshots and rolling back to them
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+import shutil
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from .test_pymssql import CatalogCursor, FakeConnection, FakeCursor
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer, diff_job
+from deployable_sql.exc import DeployableSQLError
+from deployable_sql.snapshot import (SNAPSHOT_DIR, _compress, job_definition,
+                                     load_snapshot, rollback, take_snapshot)
+
+
+JOB = {
+    'settings': {'notify_level_email': 3, 'notify_level_eventlog': 0,
+                 'notify_email_operator_name': 'Dan Cohen'},
+    'steps': [{
+        'step_id': 1, 'step_name': 'nightly', 'subsystem': 'TSQL',
+        'command': "EXEC it's;", 'database_name': 'master',
+        'on_success_action': 1, 'on_fail_action': 2,
+    }],
+    'schedules': [{
+        'schedule_id': 7, 'job_count': 1, 'name': 'weekly', 'enabled': 1,
+        'freq_type': 8, 'freq_interval': 1, 'freq_recurrence_factor': 1,
+        'active_start_date': 20200105, 'active_start_time': 60000,
+    }],
+    'servers': [{'server_name': '(local)'}],
+}
+
+
+class TestSnapshot(TestDeployableSql):
+    def setup(self):
+        super(TestSnapshot, self).setup()
+        # the jobs folder holds the test job already
+        for folder in ('views', 'tables'):
+            os.mkdir(folder)
+        self.paths = []
+        for folder, name, data in [
+                ('views', 'base', 'SELECT 1 AS x'),
+                ('views', 'top', 'SELECT x FROM dbo.base'),
+                ('views', 'new', 'SELECT 2 AS y'),
+                ('tables', 't', 'CREATE TABLE dbo.t (a int)'),
+                ('jobs', 'nightly', 'nightly:\n  steps: []\n')]:
+            path = os.path.join(folder, name + ('.yml' if folder == 'jobs' else '.sql'))
+            with open(path, 'w') as stream:
+                stream.write(data)
+            self.paths.append(path)
+        self.modules = {
+            ('views', 'dbo.Base'): 'CREATE VIEW dbo.base AS SELECT 1 AS x;',
+            ('views', 'dbo.top'): 'CREATE VIEW dbo.top AS SELECT x FROM dbo.base;',
+        }
+
+    def teardown(self):
+        if os.path.exists(SNAPSHOT_DIR):
+            shutil.rmtree(SNAPSHOT_DIR)
+        super(TestSnapshot, self).teardown()
+
+    def deployer(self, cursor=None):
+        self.cursor = cursor or FakeCursor()
+        pool = ConnectionPool(lambda: FakeConnection(self.cursor), 'db')
+        d = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool)
+        d._load_manifest = lambda manifest: None
+        d.fetch_modules = lambda names=None: dict(self.modules)
+        d.fetch_jobs = lambda job_name=None: {'nightly': JOB}
+        return d
+
+    def test_take_snapshot(self):
+        d = self.deployer()
+        d.manifest.record('views', 'dbo.base', 'abc')
+        snapshot = take_snapshot(d, self.paths, deploy_id='one')
+        eq_(snapshot.modules, [
+            ['views', 'dbo.base', 'CREATE VIEW dbo.base AS SELECT 1 AS x;'],
+            ['views', 'dbo.top', 'CREATE VIEW dbo.top AS SELECT x FROM dbo.base;'],
+            ['views', 'dbo.new', None]])
+        eq_(snapshot.jobs, [['nightly', JOB]])
+        eq_(snapshot.manifest[0], ['views', 'dbo.base', 'abc'])
+        eq_(snapshot.manifest[-1], ['jobs', 'dbo.nightly', None])
+        ok_(os.path.exists(os.path.join(SNAPSHOT_DIR, 'one.json.gz')))
+        insert = [s for s in self.cursor.statements if 'INSERT INTO' in s]
+        eq_(len(insert), 1)
+        ok_("VALUES (N'one', 0x1f8b" in insert[0])
+        eq_(load_snapshot(d, 'one'), snapshot)
+
+    def test_unchanged_left_out(self):
+        d = self.deployer()
+        names = []
+        d.fetch_modules = lambda names_=None: names.append(names_) or dict(self.modules)
+        d.manifest.record('views', 'dbo.base', d._hash_path(self.paths[0]))
+        snapshot = take_snapshot(d, self.paths, deploy_id='seven')
+        eq_([n for _, n, _ in snapshot.modules], ['dbo.top', 'dbo.new'])
+        eq_(names, [['dbo.top', 'dbo.new']])
+        d.force = True
+        snapshot = take_snapshot(d, self.paths, deploy_id='eight')
+        eq_([n for _, n, _ in snapshot.modules], ['dbo.base', 'dbo.top', 'dbo.new'])
+
+    def test_sources(self):
+        # a bundled job is named from its source, as its file is not on disk
+        path = os.path.join('bundled', 'jobs', 'nightly.yml')
+        snapshot = take_snapshot(self.deployer(), [path], deploy_id='six',
+                                 sources={path: 'nightly:\n  steps: []\n'})
+        eq_(snapshot.jobs, [['nightly', JOB]])
+        eq_(snapshot.manifest, [['jobs', 'dbo.nightly', None]])
+
+    def test_load_from_server(self):
+        snapshot = take_snapshot(self.deployer(), self.paths, deploy_id='two')
+        shutil.rmtree(SNAPSHOT_DIR)
+        d = self.deployer(CatalogCursor({
+            'SELECT snapshot': [(bytearray(_compress(snapshot)),)]}))
+        eq_(load_snapshot(d, 'two'), snapshot)
+        d = self.deployer(CatalogCursor({'SELECT snapshot': []}))
+        assert_raises(DeployableSQLError, load_snapshot, d, 'three')
+
+    def test_rollback(self):
+        d = self.deployer()
+        take_snapshot(d, self.paths, deploy_id='four')
+        # the deploy changed both views the wrong way round, and added one
+        self.modules = {
+            ('views', 'dbo.base'): 'CREATE VIEW dbo.base AS SELECT 3 AS x;',
+            ('views', 'dbo.top'): '/* changed */ CREATE VIEW dbo.top AS SELECT x FROM dbo.base;',
+            ('views', 'dbo.new'): 'CREATE VIEW dbo.new AS SELECT 2 AS y;',
+        }
+        d.manifest.record('views', 'dbo.new', 'def')
+        del self.cursor.executed[:]
+        eq_(rollback(d, 'four'), 2)
+
+        statements = self.cursor.statements
+        drops = [s for s in statements if 'DROP VIEW' in s]
+        ok_('dbo.new' in drops[0])
+        ok_('dbo.base' in drops[1])
+        ok_('CREATE VIEW dbo.base AS SELECT 1 AS x;' in statements)
+        ok_(not any('dbo.top' in s for s in statements if 'DROP' in s))
+        eq_(d.manifest.get('views', 'dbo.new'), None)
+        ok_("DELETE FROM dbo.deployable_sql_manifest WHERE object_type = N'views' AND "
+            "object_name = N'dbo.new';" in statements[-1])
+
+    def test_rollback_schema(self):
+        d = self.deployer()
+        take_snapshot(d, self.paths, deploy_id='five')
+        d.schema = 'other'
+        assert_raises(DeployableSQLError, rollback, d, 'five')
+
+    def test_job_definition(self):
+        job = job_definition('nightly', JOB)
+        eq_(list(job), ["N'nightly'"])
+        eq_(job["N'nightly'"]['steps'][0]['command'], "N'EXEC it''s;'")
+        eq_(job["N'nightly'"]['schedules'][0]['freq_type'], 'weekly')
+        # an unchanged job needs nothing to restore it
+        eq_(diff_job(job, JOB), [])
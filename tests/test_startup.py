@@ -0,0 +1,84 @@
+"""
+Tests that the command line starts without loading what it does not need
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import json
+import os
+import subprocess
+import sys
+from timeit import default_timer
+
+from nose.tools import *
+
+import deployable_sql
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI_PATH = os.path.join(ROOT, 'bin', 'deploy_sql.py')
+
+# modules which only deploys should load
+HEAVY_MODULES = ['pymssql', 'yaml', 'dateutil', 'deployable_sql.deployers.pymssql_deployer']
+
+# how much longer than a bare interpreter the command line may take to load:
+# several times what it takes now, or, on a machine slow enough for that to
+# be more, a multiple of the bare interpreter's own time
+STARTUP_BUDGET = 0.25
+STARTUP_RATIO = 10
+
+# the best of this many runs is timed, to leave out a busy machine's pauses
+STARTUP_RUNS = 5
+
+LOAD_CLI = """import json, runpy, sys
+runpy.run_path(%r, run_name='deploy_sql')
+print(json.dumps(sorted(sys.modules)))""" % CLI_PATH
+
+LOAD_PACKAGE = """import json, sys
+import deployable_sql, deployable_sql.deployers
+print(json.dumps(sorted(sys.modules)))"""
+
+
+def run_python(code):
+    """Runs code in a fresh interpreter, returning its output and time taken."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = default_timer()
+    output = subprocess.check_output([sys.executable, '-c', code], env=env, cwd=ROOT)
+    return output.decode('utf-8'), default_timer() - start
+
+
+def loaded_modules(code):
+    """Runs code in a fresh interpreter, returning the modules it printed."""
+    return set(json.loads(run_python(code)[0]))
+
+
+def best_time(code):
+    """The shortest time taken to run code in a fresh interpreter."""
+    return min(run_python(code)[1] for _ in range(STARTUP_RUNS))
+
+
+class TestStartup(object):
+    def test_lazy_exports(self):
+        eq_(deployable_sql.PyMSSQLDeployer, PyMSSQLDeployer)
+        assert_raises(AttributeError, getattr, deployable_sql, 'Nothing')
+        eq_(deployable_sql.deployers.PyMSSQLDeployer, PyMSSQLDeployer)
+        assert_raises(AttributeError, getattr, deployable_sql.deployers, 'Nothing')
+
+    def test_cli_imports(self):
+        modules = loaded_modules(LOAD_CLI)
+        eq_([m for m in HEAVY_MODULES if m in modules], [])
+        assert 'deployable_sql.folders' in modules
+
+    def test_package_imports(self):
+        modules = loaded_modules(LOAD_PACKAGE)
+        eq_([m for m in HEAVY_MODULES if m in modules], [])
+
+    def test_startup_budget(self):
+        bare = best_time('pass')
+        cli = best_time(LOAD_CLI)
+        budget = max(STARTUP_BUDGET, bare * STARTUP_RATIO)
+        assert cli - bare < budget, (
+            'Loading the command line took %.3fs longer than a bare interpreter, '
+            'over the budget of %.3fs' % (cli - bare, budget))
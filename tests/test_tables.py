@@ -0,0 +1,227 @@
+"""
+Tests for the tables module
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from .test_pymssql import CatalogCursor, FakeConnection, FakeCursor
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.exc import TableChangeError, TableDefinitionError
+from deployable_sql.tables import (DESTRUCTIVE, ONLINE, REBUILD, SIZE_OF_DATA,
+                                   UNSUPPORTED, canonical_type, diff_table,
+                                   index_names, parse_table, read_catalog,
+                                   render_table)
+
+
+ORDERS = """-- orders placed by customers
+CREATE TABLE [dbo].[orders] (
+    id int IDENTITY(1, 1) NOT NULL,
+    customer_id int NOT NULL REFERENCES dbo.customers (id),
+    status varchar(20) NOT NULL CONSTRAINT DF_orders_status DEFAULT ('new'),
+    note nvarchar(max),
+    placed_at datetime2,
+    CONSTRAINT PK_orders PRIMARY KEY CLUSTERED (id),
+    CONSTRAINT CK_orders_status CHECK (status IN ('new', 'done'))
+);
+"""
+
+COLUMN_ROWS = [
+    ('orders', 'id', 'int', 4, 10, 0, 0, 1, None, None),
+    ('orders', 'customer_id', 'int', 4, 10, 0, 0, 0, None, None),
+    ('orders', 'status', 'varchar', 20, 0, 0, 0, 0, 'DF_orders_status', "('new')"),
+    ('orders', 'note', 'nvarchar', -1, 0, 0, 1, 0, None, None),
+    ('orders', 'placed_at', 'datetime2', 8, 27, 7, 1, 0, None, None),
+]
+
+CONSTRAINT_ROWS = [
+    ('orders', 'PK_orders', 'PK', 'id', None),
+    ('orders', 'CK_orders_status', 'C ', None, "([status]='new' OR [status]='done')"),
+    ('orders', 'FK_orders_customers', 'F', 'customer_id', 'dbo.customers'),
+]
+
+
+class TestParseTable(object):
+    def test_parse(self):
+        table = parse_table(ORDERS)
+        eq_(table.name, 'dbo.orders')
+        eq_(list(table.columns),
+            ['id', 'customer_id', 'status', 'note', 'placed_at'])
+        eq_(table.columns['id'].identity, True)
+        eq_(table.columns['id'].seed, '1, 1')
+        eq_(table.columns['note'].type, 'nvarchar(max)')
+        eq_(table.columns['note'].nullable, True)
+        eq_(table.columns['status'].default, "('new')")
+        eq_(table.columns['status'].default_name, 'DF_orders_status')
+        eq_([(c.kind, c.columns) for c in table.constraints],
+            [('F', ('customer_id',)), ('PK', ('id',)), ('C', ())])
+        eq_(table.constraints[0].definition, 'dbo.customers')
+
+    def test_indexes(self):
+        table = parse_table('CREATE TABLE t (a int IDENTITY(1000, 5), b int, '
+                            'INDEX IX_b NONCLUSTERED (b))')
+        eq_(table.indexes, ['INDEX IX_b NONCLUSTERED (b)'])
+        eq_(index_names(table), set(['ix_b']))
+        sql = render_table(table, 'dbo.t2')
+        ok_('[a] int IDENTITY(1000, 5) NOT NULL' in sql)
+        ok_(sql.endswith('INDEX IX_b NONCLUSTERED (b)\n);'))
+
+    def test_schema(self):
+        eq_(parse_table('CREATE TABLE t (a int)', 'cu').name, 'cu.t')
+
+    def test_no_table(self):
+        assert_raises(TableDefinitionError, parse_table, 'SELECT 1')
+
+    def test_canonical_type(self):
+        eq_(canonical_type('VARCHAR'), 'varchar(1)')
+        eq_(canonical_type('nvarchar (MAX)'), 'nvarchar(max)')
+        eq_(canonical_type('decimal(10)'), 'decimal(10,0)')
+        eq_(canonical_type('datetime2'), 'datetime2(7)')
+        eq_(canonical_type('integer'), 'int')
+
+
+class TestDiffTable(object):
+    def setup(self):
+        self.current = read_catalog(COLUMN_ROWS, CONSTRAINT_ROWS)['orders']
+
+    def diff(self, sql, metadata_defaults=True):
+        return diff_table(parse_table(sql), self.current, metadata_defaults)
+
+    def impacts(self, sql, metadata_defaults=True):
+        return [c.impact for c in self.diff(sql, metadata_defaults)]
+
+    def test_unchanged(self):
+        eq_(self.diff(ORDERS), [])
+
+    def test_add_nullable_column(self):
+        changes = self.diff(ORDERS.replace('placed_at datetime2,',
+                                           'placed_at datetime2,\n    ref int NULL,'))
+        eq_([c.impact for c in changes], [ONLINE])
+        eq_(changes[0].sql, 'ALTER TABLE dbo.orders ADD [ref] int NULL;')
+
+    def test_add_column_with_default(self):
+        sql = ORDERS.replace('placed_at datetime2,',
+                             'placed_at datetime2,\n    qty int NOT NULL DEFAULT 0,')
+        eq_(self.impacts(sql), [ONLINE])
+        eq_(self.impacts(sql, metadata_defaults=False), [SIZE_OF_DATA])
+        assert 'CONSTRAINT [DF_orders_qty] DEFAULT 0' in self.diff(sql)[0].sql
+
+    def test_add_not_null_column(self):
+        sql = ORDERS.replace('placed_at datetime2,',
+                             'placed_at datetime2,\n    qty int NOT NULL,')
+        eq_(self.impacts(sql), [UNSUPPORTED])
+
+    def test_widen_varchar(self):
+        eq_(self.impacts(ORDERS.replace('varchar(20)', 'varchar(50)')), [ONLINE])
+        eq_(self.impacts(ORDERS.replace('varchar(20)', 'varchar(10)')), [SIZE_OF_DATA])
+        eq_(self.impacts(ORDERS.replace('varchar(20)', 'nvarchar(20)')), [SIZE_OF_DATA])
+
+    def test_not_null(self):
+        eq_(self.impacts(ORDERS.replace('placed_at datetime2',
+                                        'placed_at datetime2 NOT NULL')),
+            [SIZE_OF_DATA])
+
+    def test_drop_column(self):
+        changes = self.diff(ORDERS.replace('    note nvarchar(max),\n', ''))
+        eq_([c.impact for c in changes], [DESTRUCTIVE])
+        eq_(changes[0].sql, 'ALTER TABLE dbo.orders DROP COLUMN [note];')
+
+    def test_drop_column_with_default(self):
+        sql = ORDERS.replace(
+            "    status varchar(20) NOT NULL CONSTRAINT DF_orders_status DEFAULT ('new'),\n",
+            '').replace("CK_orders_status CHECK (status IN ('new', 'done'))",
+                  'CK_orders_id CHECK (id > 0)')
+        changes = self.diff(sql)
+        eq_([c.impact for c in changes], [ONLINE, DESTRUCTIVE, SIZE_OF_DATA])
+        assert changes[1].sql.startswith(
+            'ALTER TABLE dbo.orders DROP CONSTRAINT [DF_orders_status];')
+
+    def test_identity(self):
+        eq_(self.impacts(ORDERS.replace(' IDENTITY(1, 1)', '')), [REBUILD])
+
+    def test_change_default(self):
+        changes = self.diff(ORDERS.replace("DEFAULT ('new')", "DEFAULT ('open')"))
+        eq_([c.impact for c in changes], [ONLINE])
+        eq_(changes[0].sql.split('\n'), [
+            'ALTER TABLE dbo.orders DROP CONSTRAINT [DF_orders_status];',
+            "ALTER TABLE dbo.orders ADD CONSTRAINT [DF_orders_status] "
+            "DEFAULT ('open') FOR [status];"])
+
+    def test_constraints(self):
+        eq_(self.diff(ORDERS.replace("IN ('new', 'done')", "IN ('new')")), [])
+        changes = self.diff(ORDERS.replace('CK_orders_status', 'CK_orders_new'))
+        eq_([c.description for c in changes],
+            ['drop constraint CK_orders_status', 'add constraint CK_orders_new'])
+        eq_([c.impact for c in changes], [ONLINE, SIZE_OF_DATA])
+
+
+class TestSyncTable(TestDeployableSql):
+    def setup(self):
+        super(TestSyncTable, self).setup()
+        os.mkdir('tables')
+        self.path = os.path.abspath(os.path.join('tables', 'orders.sql'))
+        self.write(ORDERS)
+
+    def write(self, sql):
+        with open(self.path, 'w') as stream:
+            stream.write(sql)
+
+    def deployer(self, cursor, **kwargs):
+        pool = ConnectionPool(lambda: FakeConnection(cursor), 'db')
+        d = PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool, **kwargs)
+        d._server_properties = ((15, 0, 2000), 2)
+        return d
+
+    def catalog(self):
+        return CatalogCursor({'sys.default_constraints': COLUMN_ROWS,
+                              'sys.key_constraints': CONSTRAINT_ROWS})
+
+    def test_create(self):
+        cursor = FakeCursor()
+        self.deployer(cursor).sync_table(self.path)
+        eq_(cursor.statements[-1], ORDERS)
+
+    def test_unchanged(self):
+        cursor = self.catalog()
+        self.deployer(cursor).sync_table(self.path)
+        assert not any('ALTER TABLE' in sql for sql in cursor.executed)
+
+    def test_alter(self):
+        self.write(ORDERS.replace('varchar(20)', 'varchar(50)'))
+        cursor = self.catalog()
+        self.deployer(cursor).sync_table(self.path)
+        sql = cursor.executed[-1]
+        assert sql.startswith('SET XACT_ABORT ON;\nBEGIN TRANSACTION;')
+        assert 'ALTER TABLE dbo.orders ALTER COLUMN [status] varchar(50) NOT NULL;' in sql
+        assert sql.endswith('COMMIT TRANSACTION;')
+
+    def test_refused(self):
+        self.write(ORDERS.replace('    note nvarchar(max),\n', '')
+                   .replace('varchar(20)', 'varchar(50)'))
+        cursor = self.catalog()
+        with assert_raises(TableChangeError) as caught:
+            self.deployer(cursor).sync_table(self.path)
+        eq_(caught.exception.table, 'dbo.orders')
+        eq_([c.impact for c in caught.exception.changes], [DESTRUCTIVE])
+        # nothing is changed, not even the changes which were allowed
+        assert not any('ALTER TABLE' in sql for sql in cursor.executed)
+
+    def test_allowed(self):
+        self.write(ORDERS.replace('    note nvarchar(max),\n', ''))
+        cursor = self.catalog()
+        self.deployer(cursor, allow=[DESTRUCTIVE]).sync_table(self.path)
+        assert 'DROP COLUMN [note]' in cursor.executed[-1]
+
+    def test_metadata_defaults(self):
+        d = self.deployer(FakeCursor())
+        eq_(d.supports_metadata_defaults(), False)
+        d._server_properties = ((11, 0, 2100), 3)
+        eq_(d.supports_metadata_defaults(), True)
+        d._server_properties = ((10, 50, 1600), 3)
+        eq_(d.supports_metadata_defaults(), False)
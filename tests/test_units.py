@@ -0,0 +1,94 @@
+"""
+Tests for deploy units and the pipeline which reads them
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from .test_engine import RecordingDeployer
+from .test_pymssql import FakeConnection, FakeCursor
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.engine import DeployEngine, list_folders
+from deployable_sql.units import (DeployUnit, dependency_names, read_unit,
+                                  read_units)
+
+
+class TestUnits(TestDeployableSql):
+    def setup(self):
+        super(TestUnits, self).setup()
+        for folder in ('views', 'functions'):
+            os.mkdir(folder)
+        self.base = self.write('views', 'base', b'SELECT 1 AS x\r\nORDER BY x')
+        self.top = self.write('views', 'top', b'SELECT x FROM dbo.base -- not func')
+        self.func = self.write('functions', 'func',
+                               b'CREATE FUNCTION dbo.func() RETURNS int AS BEGIN RETURN 1 END')
+
+    def write(self, folder, name, data):
+        path = os.path.join(folder, name + '.sql')
+        with open(path, 'wb') as stream:
+            stream.write(data)
+        return path
+
+    def deployer(self, **kwargs):
+        self.cursor = FakeCursor()
+        pool = ConnectionPool(lambda: FakeConnection(self.cursor), 'db')
+        return PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool, **kwargs)
+
+    def test_immutable(self):
+        unit = read_unit(self.deployer(), self.base)
+        assert_raises(AttributeError, setattr, unit, 'digest', 'x')
+        assert_false(hasattr(unit, '__dict__'))
+        ok_(isinstance(unit, DeployUnit))
+
+    def test_read_unit(self):
+        d = self.deployer()
+        modules = dependency_names([self.base, self.top, self.func])
+        unit = read_unit(d, self.top, modules)
+        eq_(unit.key, ('views', 'dbo.top'))
+        eq_(unit.digest, d._hash_path(self.top))
+        eq_(unit.dependencies, frozenset([self.base]))
+        eq_(unit.drop_sql, d.render_view(self.top)[1])
+        eq_(unit.create_sql, d.render_view(self.top)[2])
+
+        base = read_unit(d, self.base)
+        eq_(base.source, 'SELECT 1 AS x\nORDER BY x')
+        eq_(base.create_sql, 'CREATE VIEW dbo.base AS \nSELECT 1 AS x;')
+
+    def test_unchanged_not_rendered(self):
+        d = self.deployer()
+        d.manifest.record('views', 'dbo.base', d._hash_path(self.base))
+        unit = read_unit(d, self.base)
+        eq_((unit.drop_sql, unit.create_sql), (None, None))
+        ok_(read_unit(d, self.base, render=True).create_sql)
+
+    def test_read_units(self):
+        paths = list_folders(['views', 'functions'])
+        units = read_units(self.deployer(), paths, workers=3, render=True)
+        eq_([unit.path for unit in units], paths)
+        assert 'DROP FUNCTION dbo.func;' in units[-1].drop_sql
+
+    def test_read_error(self):
+        bad = self.write('views', 'bad', b'SELECT \xff')
+        assert_raises(UnicodeDecodeError, read_units, self.deployer(), [self.base, bad])
+
+    def test_sync_unit(self):
+        d = self.deployer()
+        unit = read_unit(d, self.top)
+        d.sync_unit(unit)
+        d.sync_unit(unit)
+        eq_((d.deployed, d.skipped), (1, 1))
+        eq_(len([sql for sql in self.cursor.executed if 'CREATE VIEW dbo.top' in sql]), 1)
+
+    def test_engine_read_failure(self):
+        self.write('views', 'base', b'SELECT \xff')
+        d = RecordingDeployer()
+        engine = DeployEngine(d, workers=2).run(list_folders(['views', 'functions']))
+        eq_(list(engine.failed), [self.base])
+        eq_(engine.blocked, [self.top])
+        eq_(d.synced, ['func'])
@@ -0,0 +1,64 @@
+"""
+Tests for post deploy validation
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+
+from nose.tools import *
+
+from .tests import TestDeployableSql
+from .test_pymssql import CatalogCursor, FakeConnection
+from deployable_sql.deployers.pool import ConnectionPool
+from deployable_sql.deployers.pymssql_deployer import PyMSSQLDeployer
+from deployable_sql.validate import (deployed_names, fetch_dependents,
+                                     format_validation, validate)
+
+
+DEPENDENTS = [('dbo.v_a', 1), ('dbo.p_c', 1), ('dbo.v_b', 2)]
+
+
+class TestValidate(TestDeployableSql):
+    def deployer(self, fail_on=None, workers=1):
+        self.cursor = CatalogCursor({'sys.sql_expression_dependencies': DEPENDENTS})
+        self.cursor.fail_on = fail_on
+        pool = ConnectionPool(lambda: FakeConnection(self.cursor), 'db',
+                              max_size=workers)
+        return PyMSSQLDeployer('user', 'pwd', 'host', 'db', pool=pool)
+
+    def refreshed(self):
+        return [sql for sql in self.cursor.executed if 'sp_refreshsqlmodule' in sql]
+
+    def test_fetch_dependents(self):
+        d = self.deployer()
+        eq_(fetch_dependents(d, ['dbo.v_base', "dbo.it's"]),
+            [['dbo.v_a', 'dbo.p_c'], ['dbo.v_b']])
+        sql = self.cursor.executed[-1]
+        assert "VALUES (N'dbo.v_base'), (N'dbo.it''s')" in sql
+        # each level is deduplicated before the next is found
+        assert 'SELECT DISTINCT d.referencing_id, @depth + 1' in sql
+        eq_(fetch_dependents(d, []), [])
+
+    def test_validate(self):
+        validation = validate(self.deployer(fail_on="N'dbo.v_b'"), ['dbo.v_base'])
+        eq_(validation.checked, 3)
+        eq_(list(validation.invalid), ['dbo.v_b'])
+        # dependents are refreshed after what they depend on
+        eq_(self.refreshed()[-1], "EXEC sp_refreshsqlmodule N'dbo.v_b';")
+        assert 'dbo.v_b: failed' in format_validation(validation)
+
+    def test_parallel(self):
+        validation = validate(self.deployer(workers=3), ['dbo.v_base'], workers=3)
+        eq_(validation, (3, {}))
+        eq_(len(self.refreshed()), 3)
+        eq_(self.refreshed()[-1], "EXEC sp_refreshsqlmodule N'dbo.v_b';")
+
+    def test_deployed_names(self):
+        d = self.deployer()
+        d.report.add(('views', 'dbo.changed'), 'create', 0.1)
+        d.report.skip(('views', 'dbo.same'))
+        paths = [os.path.join('views', 'changed.sql'), os.path.join('views', 'same.sql'),
+                 os.path.join('sps', 'proc.sql'), os.path.join('jobs', 'testjob.yml')]
+        eq_(deployed_names(d, paths), ['dbo.changed', 'dbo.proc'])
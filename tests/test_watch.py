@@ -0,0 +1,85 @@
+"""
+Tests for watch mode
+"""
+# pylint: disable=missing-docstring, import-error, wildcard-import
+# pylint: disable=attribute-defined-outside-init,unused-wildcard-import, no-init
+# pylint: disable=no-self-use
+from __future__ import print_function
+import os
+import threading
+import time
+
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+
+from .tests import TestDeployableSql
+from .test_manifest import CountingDeployer
+from deployable_sql.folders import run_setup
+from deployable_sql.watch import (InotifyWatcher, PollingWatcher, ignored,
+                                  wait_for_burst, watch)
+
+
+class TestWatch(TestDeployableSql):
+    def setup(self):
+        super(TestWatch, self).setup()
+        run_setup('blank', 'whatever', gitinit=False)
+
+    def write(self, name, sql='SELECT 1 AS one'):
+        path = os.path.join('views', name)
+        with open(path, 'w') as stream:
+            stream.write(sql)
+        return path
+
+    def write_later(self, names, delay=0.05):
+        def write_all():
+            for name in names:
+                time.sleep(delay)
+                self.write(name)
+        thread = threading.Thread(target=write_all)
+        thread.start()
+        return thread
+
+    def test_ignored(self):
+        ok_(ignored('.view.sql.swp'))
+        ok_(ignored('view.sql~'))
+        assert_false(ignored('view.sql'))
+
+    def test_polling(self):
+        watcher = PollingWatcher(['views'], interval=0.01)
+        eq_(watcher.changes(0.02), set())
+        self.write('one.sql')
+        eq_(watcher.changes(0.1), set([os.path.join('views', 'one.sql')]))
+
+    def test_inotify(self):
+        try:
+            watcher = InotifyWatcher(['views'])
+        except OSError:
+            raise SkipTest('inotify is not available')
+        try:
+            eq_(watcher.changes(0.01), set())
+            self.write('one.sql')
+            eq_(watcher.changes(1), set([os.path.join('views', 'one.sql')]))
+        finally:
+            watcher.close()
+
+    def test_debounce(self):
+        watcher = PollingWatcher(['views'], interval=0.01)
+        thread = self.write_later(['one.sql', 'two.sql', 'three.sql'])
+        paths = wait_for_burst(watcher, debounce=0.3)
+        thread.join()
+        eq_(len(paths), 3)
+
+    def test_watch(self):
+        d = CountingDeployer()
+        thread = self.write_later(['one.sql', 'two.sql'])
+        watch(d, ['views', 'functions'], debounce=0.2, poll=True, bursts=1)
+        thread.join()
+        eq_(sorted(os.path.basename(p) for p in d.synced), ['one.sql', 'two.sql'])
+
+    def test_before(self):
+        d = CountingDeployer()
+        bursts = []
+        thread = self.write_later(['one.sql'])
+        watch(d, ['views'], debounce=0.2, poll=True, bursts=1, before=bursts.append)
+        thread.join()
+        eq_([[os.path.basename(p) for p in paths] for paths in bursts], [['one.sql']])
@@ -12,6 +12,8 @@ from nose.tools import *
 from deployable_sql.folders import FOLDERS, FILES, create_job, run_setup
 from deployable_sql.exc import *
 from deployable_sql.central import *
+from deployable_sql.index import INDEX_PATH
+from deployable_sql.manifest import MANIFEST_PATH
 
 
 class TestDeployableSql(object):
@@ -24,10 +26,10 @@ class TestDeployableSql(object):
         if os.path.exists(os.path.join('jobs', 'testjob.yml')):
             os.remove(os.path.join('jobs', 'testjob.yml'))
 
-        for f in FILES:
+        for f in FILES + [MANIFEST_PATH, INDEX_PATH]:
             if os.path.exists(f):
                 os.remove(f)
-                
+
         for f in FOLDERS:
             if os.path.exists(f):
                 for filename in os.listdir(f):